@@ -0,0 +1,150 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Archive writing throughput per compression level and thread count
+
+Writes a synthetic artifact (FASTQ-like text, which compresses roughly as
+sequence data does) of the given size, then zips it with qiime2's writer
+(zipfile at its default level, on one core) and with q2dataflow's writer at
+each level. Reported per writer: seconds, throughput in MB/s of input and
+the archive size relative to the input. Every archive is verified by
+inflating it and checking the CRCs.
+
+    python benchmarks/archive_writer.py --size 4G --threads 1 8
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import zipfile
+import argparse
+import tempfile
+
+from q2dataflow.core.runtime.archive import write_archive
+from q2dataflow.core.runtime.util import get_available_cores, parse_size
+
+LEVELS = (0, 1, 3, 6, 9)
+FILE_SIZE = 1024 ** 3
+
+
+def make_artifact(root, size, seed=0):
+    """A `<uuid>/` tree of `size` bytes, in files of up to 1 GiB"""
+    rng = random.Random(seed)
+    uuid_ = str(uuid.UUID(int=rng.getrandbits(128)))
+    data_dir = os.path.join(root, uuid_, 'data')
+    os.makedirs(data_dir)
+    with open(os.path.join(root, uuid_, 'metadata.yaml'), 'w') as fh:
+        fh.write('uuid: %s\ntype: SampleData[SequencesWithQuality]\n'
+                 'format: SingleLanePerSampleSingleEndFastqDirFmt\n' % uuid_)
+
+    written = 0
+    index = 0
+    while written < size:
+        fp = os.path.join(data_dir, 'sample-%d_S1_L001_R1_001.fastq' % index)
+        with open(fp, 'wb') as fh:
+            file_written = 0
+            while file_written < min(FILE_SIZE, size - written):
+                chunk = _fastq_chunk(rng, file_written)
+                fh.write(chunk)
+                file_written += len(chunk)
+        written += file_written
+        index += 1
+    return uuid_, written
+
+
+_BASES = bytes(b'ACGT'[i % 4] for i in range(256))
+_QUALS = bytes(b'?@ABCDEFGHI'[i % 11] for i in range(256))
+
+
+def _fastq_chunk(rng, first_read, reads=1000, length=150):
+    def random_bytes(n, table):
+        return rng.getrandbits(n * 8).to_bytes(n, 'little').translate(table)
+
+    seqs = random_bytes(reads * length, _BASES)
+    quals = random_bytes(reads * length, _QUALS)
+    return b''.join(
+        b'@read%d\n%s\n+\n%s\n' % (first_read + i,
+                                     seqs[i * length:(i + 1) * length],
+                                     quals[i * length:(i + 1) * length])
+        for i in range(reads))
+
+
+def _qiime2_save(root, uuid_, filepath):
+    # as qiime2.core.archive.format.v0.ArchiveFormat.save
+    source = os.path.join(root, uuid_)
+    with zipfile.ZipFile(filepath, mode='w', compression=zipfile.ZIP_DEFLATED,
+                         allowZip64=True) as zf:
+        for dirpath, dirnames, filenames in os.walk(source):
+            for filename in filenames:
+                abspath = os.path.join(dirpath, filename)
+                zf.write(abspath, arcname=os.path.relpath(abspath, root))
+
+
+def _verify(filepath):
+    with zipfile.ZipFile(filepath) as zf:
+        bad = zf.testzip()
+    if bad is not None:
+        raise RuntimeError("%s: bad CRC for %s" % (filepath, bad))
+
+
+def measure(root, uuid_, size, out_dir, levels, threads):
+    filepath = os.path.join(out_dir, 'benchmark.qza')
+    writers = [('qiime2', lambda: _qiime2_save(root, uuid_, filepath))]
+    for level in levels:
+        for n in threads:
+            writers.append(('level=%d threads=%d' % (level, n),
+                            lambda level=level, n=n: write_archive(
+                                root, uuid_, filepath, level, n)))
+
+    results = {}
+    for name, write in writers:
+        start = time.perf_counter()
+        write()
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            'seconds': round(elapsed, 2),
+            'mb_per_s': round(size / 1e6 / elapsed, 1),
+            'ratio': round(os.path.getsize(filepath) / size, 3),
+        }
+        _verify(filepath)
+        os.remove(filepath)
+        print(name, json.dumps(results[name]), file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='4G',
+                        help="size of the synthetic artifact (default: 4G)")
+    parser.add_argument('--levels', type=int, nargs='+', default=LEVELS)
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, get_available_cores()])
+    parser.add_argument('--dir', default=None,
+                        help="where to write (default: the temp directory); "
+                             "needs twice --size free")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='q2dataflow-archive-bench',
+                                dir=args.dir)
+    try:
+        root = os.path.join(work_dir, 'artifact')
+        uuid_, size = make_artifact(root, parse_size(args.size))
+        results = measure(root, uuid_, size, work_dir, args.levels,
+                          sorted(set(args.threads)))
+    finally:
+        shutil.rmtree(work_dir)
+
+    print(json.dumps({'size_bytes': size, 'cores': get_available_cores(),
+                      'writers': results}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Loading and merging many metadata files, serially and in parallel
+
+Writes N metadata TSVs describing the same samples (each with its own
+columns, half numeric and half categorical, and with sample IDs in a
+different order), then converts them the way `run` does for a Metadata
+parameter given all N files, with one loading thread and with the default.
+Reported per source count and mode: the median seconds and the shape of the
+merged metadata.
+
+    python benchmarks/metadata_merge.py --sources 10 25 50 --samples 100000
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+
+COLUMNS = 4
+
+
+def write_sources(directory, n_sources, n_samples, seed=0):
+    rng = random.Random(seed)
+    ids = ['sample-%d' % i for i in range(n_samples)]
+    fps = []
+    for source in range(n_sources):
+        rng.shuffle(ids)
+        fp = os.path.join(directory, 'metadata-%d.tsv' % source)
+        with open(fp, 'w') as fh:
+            names = ['s%d_c%d' % (source, c) for c in range(COLUMNS)]
+            fh.write('sample-id\t%s\n' % '\t'.join(names))
+            fh.write('#q2:types\t%s\n' % '\t'.join(
+                'numeric' if c % 2 == 0 else 'categorical'
+                for c in range(COLUMNS)))
+            for id_ in ids:
+                fh.write('%s\t%s\n' % (id_, '\t'.join(
+                    '%.4f' % rng.random() if c % 2 == 0
+                    else 'group-%d' % rng.randrange(20)
+                    for c in range(COLUMNS))))
+        fps.append(fp)
+    return fps
+
+
+def convert(fps, threads):
+    from qiime2.plugin import Metadata
+    from q2dataflow.core.description_language.drivers.action import \
+        _convert_metadata
+    from q2dataflow.core.description_language.drivers.artifact_loader \
+        import LOAD_THREADS_ENV_VAR
+
+    os.environ[LOAD_THREADS_ENV_VAR] = str(threads)
+    value = [{'type': 'tsv', 'source': fp} for fp in fps]
+    start = time.perf_counter()
+    metadata = _convert_metadata(Metadata, value, 'metadata')
+    elapsed = time.perf_counter() - start
+    return elapsed, list(metadata.to_dataframe().shape)
+
+
+def main(argv=None):
+    from q2dataflow.core.runtime.util import get_available_cores
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sources', type=int, nargs='+',
+                        default=[10, 25, 50])
+    parser.add_argument('--samples', type=int, default=100000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=get_available_cores())
+    args = parser.parse_args(argv)
+
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='q2dataflow-metadata-bench')
+    try:
+        fps = write_sources(work_dir, max(args.sources), args.samples)
+        for n_sources in args.sources:
+            results[n_sources] = {}
+            for mode, threads in (('serial', 1), ('parallel', args.threads)):
+                runs = [convert(fps[:n_sources], threads)
+                        for _ in range(args.repeats)]
+                results[n_sources][mode] = {
+                    'threads': threads,
+                    'seconds': round(statistics.median(r[0] for r in runs),
+                                     3),
+                    'shape': runs[-1][1],
+                }
+                print(n_sources, mode, json.dumps(results[n_sources][mode]),
+                      file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir)
+
+    print(json.dumps({'samples': args.samples, 'results': results},
+                     indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
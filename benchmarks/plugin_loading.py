@@ -0,0 +1,114 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Single-plugin loading versus full PluginManager discovery
+
+Each run is a fresh interpreter that resolves PLUGIN.ACTION (and, with
+--inputs, runs it) the way `q2dataflow {wdl | cwl} run` does, with either
+discovery mode. Reported per mode: the median time to the action being ready
+(or run), the median process wall time, the peak RSS and the number of
+plugins registered.
+
+    python benchmarks/plugin_loading.py diversity alpha
+    python benchmarks/plugin_loading.py feature_table summarize \\
+        --inputs inputs.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import statistics
+import subprocess
+
+MODES = ('single', 'full')
+
+
+def _child(plugin_id, action_id, inputs_fp):
+    start = time.perf_counter()
+
+    import qiime2.sdk as sdk
+    from q2dataflow.core.description_language.drivers.action import \
+        action_runner, _get_plugin
+
+    action = _get_plugin(plugin_id).actions[action_id]
+    if inputs_fp is not None:
+        with open(inputs_fp) as fh:
+            inputs = json.load(fh)
+        action_runner(plugin_id, action.id, inputs, parse_primitives=True)
+
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'ready_s': elapsed,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'plugins': len(sdk.PluginManager.reuse_existing().plugins),
+    }))
+
+
+def run_once(mode, plugin_id, action_id, inputs_fp):
+    from q2dataflow.core.description_language.drivers.plugin_loader import \
+        DISCOVERY_ENV_VAR
+
+    env = dict(os.environ)
+    env[DISCOVERY_ENV_VAR] = mode
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               plugin_id, action_id]
+    if inputs_fp is not None:
+        command += ['--inputs', inputs_fp]
+
+    start = time.perf_counter()
+    proc = subprocess.run(command, env=env, stdout=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+    wall = time.perf_counter() - start
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['wall_s'] = wall
+    return result
+
+
+def measure(plugin_id, action_id, inputs_fp, repeats):
+    results = {}
+    for mode in MODES:
+        runs = [run_once(mode, plugin_id, action_id, inputs_fp)
+                for _ in range(repeats)]
+        results[mode] = {
+            'ready_s': round(statistics.median(
+                r['ready_s'] for r in runs), 4),
+            'wall_s': round(statistics.median(r['wall_s'] for r in runs), 4),
+            'peak_rss_mb': round(max(
+                r['peak_rss_kb'] for r in runs) / 1024, 1),
+            'plugins': runs[-1]['plugins'],
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('plugin')
+    parser.add_argument('action')
+    parser.add_argument('--inputs', default=None,
+                        help="JSON inputs (as for `run`) to also execute the "
+                             "action with")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _child(args.plugin, args.action, args.inputs)
+        return 0
+
+    inputs_fp = os.path.abspath(args.inputs) if args.inputs else None
+    results = measure(args.plugin, args.action, inputs_fp, args.repeats)
+    print(json.dumps({'plugin': args.plugin, 'action': args.action,
+                      'inputs': inputs_fp, 'modes': results}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Cold-start benchmark for the `q2dataflow` console script
+
+For each subcommand this reports the median wall time of fresh interpreter
+runs and the slowest imports according to `python -X importtime`, and checks
+that the subcommand does not import modules it has no use for.
+
+    python benchmarks/startup.py [OPTIONS]            # report
+    python benchmarks/startup.py [OPTIONS] --record   # (re)write baselines
+    python benchmarks/startup.py [OPTIONS] --check    # fail on a regression
+
+where OPTIONS are `--plugin PLUGIN --run PLUGIN ACTION INPUTS_JSON`.
+
+`version PLUGIN` and `wdl run` are what the tasks of a workflow pay for, so
+they need an environment with QIIME 2 and a plugin: --check fails if they
+are not measured or have no baseline, unless --help-only says that only the
+commands that never import QIIME 2 are being checked.
+
+Baselines are environment-specific; record them in the environment you
+intend to compare against.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+
+BASELINES_FP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'startup_baselines.json')
+
+# name: (arguments, module prefixes the subcommand must not import)
+SUBCOMMANDS = {
+    'help': (['--help'], ['qiime2', 'q2dataflow.languages.wdl.templaters',
+                          'q2dataflow.languages.cwl.templaters']),
+    'wdl-version': (['wdl', '--version'],
+                    ['qiime2', 'q2dataflow.languages.cwl.templaters']),
+    'cwl-version': (['cwl', '--version'],
+                    ['qiime2', 'q2dataflow.languages.wdl.templaters']),
+    'wdl-run-help': (['wdl', 'run', '--help'],
+                     ['qiime2', 'q2dataflow.languages.cwl.templaters']),
+    'wdl-template-help': (['wdl', 'template', 'plugin', '--help'],
+                          ['qiime2', 'q2dataflow.languages.cwl.templaters']),
+    'run-batch-help': (['run-batch', '--help'], ['qiime2']),
+}
+# `version` needs an installed plugin, see --plugin
+VERSION_FORBIDDEN = ['qiime2', 'q2dataflow.languages.wdl.templaters',
+                     'q2dataflow.languages.cwl.templaters']
+# `wdl run` needs an action and its inputs, see --run
+RUN_FORBIDDEN = ['q2dataflow.languages.wdl.templaters',
+                 'q2dataflow.languages.cwl.templaters']
+# measured only with QIIME 2 installed, and so easily left out
+REQUIRED = ('version', 'wdl-run')
+
+# a measured median may exceed its baseline by this factor plus this many
+# seconds before --check reports a regression
+TOLERANCE_FACTOR = 1.5
+TOLERANCE_SECONDS = 0.05
+
+
+def _command(args, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    return command + ['-m', 'q2dataflow'] + args
+
+
+def time_command(args, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(_command(args), stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def import_profile(args):
+    """Modules imported by a run, as {module: cumulative microseconds}"""
+    proc = subprocess.run(_command(args, importtime=True),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+    modules = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        modules[fields[2].strip()] = int(fields[1])
+    return modules
+
+
+def forbidden_imports(modules, forbidden):
+    return sorted(m for m in modules
+                  for prefix in forbidden
+                  if m == prefix or m.startswith(prefix + '.'))
+
+
+def _environment():
+    try:
+        import importlib.metadata
+        qiime2_version = importlib.metadata.version('qiime2')
+    except Exception:
+        qiime2_version = None
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'qiime2': qiime2_version}
+
+
+def measure(subcommands, repeats, top):
+    results = {}
+    for name, (args, forbidden) in subcommands.items():
+        modules = import_profile(args)
+        slowest = sorted(modules.items(), key=lambda kv: kv[1], reverse=True)
+        results[name] = {
+            'args': args,
+            'median_s': round(time_command(args, repeats), 4),
+            'modules': len(modules),
+            'slowest_imports_us': dict(slowest[:top]),
+            'forbidden_imports': forbidden_imports(modules, forbidden),
+        }
+    return results
+
+
+def check(results, baselines, help_only=False):
+    problems = []
+    if not help_only:
+        for name in REQUIRED:
+            if name not in results:
+                problems.append('%s was not measured (see --plugin and '
+                                '--run, or pass --help-only)' % name)
+            elif name not in baselines.get('commands', {}):
+                problems.append('%s has no baseline: record one in an '
+                                'environment with QIIME 2' % name)
+    for name, result in results.items():
+        if result['forbidden_imports']:
+            problems.append('%s imports %s' % (
+                name, ', '.join(result['forbidden_imports'])))
+        baseline = baselines.get('commands', {}).get(name)
+        if baseline is None:
+            continue
+        allowed = baseline['median_s'] * TOLERANCE_FACTOR + TOLERANCE_SECONDS
+        if result['median_s'] > allowed:
+            problems.append('%s took %.3fs (baseline %.3fs)' % (
+                name, result['median_s'], baseline['median_s']))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=7)
+    parser.add_argument('--top', type=int, default=10,
+                        help="slowest imports to report per subcommand")
+    parser.add_argument('--plugin', default=None,
+                        help="also time `q2dataflow version PLUGIN`")
+    parser.add_argument('--run', nargs=3, default=None,
+                        metavar=('PLUGIN', 'ACTION', 'INPUTS_JSON'),
+                        help="also time `q2dataflow wdl run PLUGIN ACTION "
+                             "INPUTS_JSON`")
+    parser.add_argument('--help-only', action='store_true',
+                        help="check without `version` and `wdl run`, which "
+                             "need QIIME 2")
+    parser.add_argument('--record', action='store_true',
+                        help="write the results as the new baselines")
+    parser.add_argument('--check', action='store_true',
+                        help="exit non-zero on a regression from the "
+                             "baselines or a forbidden import")
+    args = parser.parse_args(argv)
+
+    subcommands = dict(SUBCOMMANDS)
+    if args.plugin is not None:
+        subcommands['version'] = (['version', args.plugin], VERSION_FORBIDDEN)
+    if args.run is not None:
+        subcommands['wdl-run'] = (['wdl', 'run'] + args.run, RUN_FORBIDDEN)
+
+    results = measure(subcommands, args.repeats, args.top)
+    report = {'environment': _environment(), 'commands': results}
+    print(json.dumps(report, indent=2))
+
+    if args.record:
+        with open(BASELINES_FP, 'w') as fh:
+            json.dump(report, fh, indent=2)
+            fh.write('\n')
+
+    if args.check:
+        baselines = {}
+        if os.path.exists(BASELINES_FP):
+            with open(BASELINES_FP) as fh:
+                baselines = json.load(fh)
+        problems = check(results, baselines, args.help_only)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,20 +5,19 @@
 #
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
+import os
+import sys
 import click
-from click.testing import CliRunner
 import json
 
 import q2dataflow.core.description_language.interface as clickin
-from q2dataflow.languages.wdl.templaters.helpers import \
-    q2wdl_prefix as wdl_prefix, \
-    metafile_synth_param_prefix as wdl_metafile_synth_prefix, \
-    reserved_param_prefix as wdl_reserved_prefix
-from q2dataflow.languages.cwl.templaters.helpers import \
-    q2cwl_prefix as cwl_prefix, \
-    metafile_synth_param_prefix as cwl_metafile_synth_prefix, \
-    reserved_param_prefix as cwl_reserved_prefix, \
-    collection_keys_prefix as cwl_collection_keys_prefix
+import q2dataflow.core.runtime.forkserver as forkserver
+from q2dataflow.core.runtime.cache_refs import is_cache_ref, parse_cache_ref
+from q2dataflow.core.runtime.diagnostics import DIAGNOSTICS
+from q2dataflow.core.runtime.io_report import IO_SUMMARY_ENV_VAR
+import q2dataflow.core.runtime.profiling as profiling
+import q2dataflow.core.runtime.ledger as ledger
+import q2dataflow.core.runtime.plan as conversion_plan
 import q2dataflow.languages.wdl.util as wdl_util
 import q2dataflow.languages.cwl.util as cwl_util
 
@@ -29,7 +28,12 @@ def _make_metadata_param(curr_source, curr_col):
     if curr_source is None:
         return None
 
-    curr_type = curr_source.split(".")[-1]
+    if is_cache_ref(curr_source):
+        # a cache key holds an artifact; fail here if the key is malformed
+        parse_cache_ref(curr_source)
+        curr_type = "qza"
+    else:
+        curr_type = curr_source.split(".")[-1]
     if curr_type not in ["qza", "tsv"]:
         raise ValueError(f"Unexpected metadata type: '{curr_type}'")
 
@@ -60,15 +64,8 @@ def _reformat_metadata_param(curr_metafile_key, params_dict,
         else:
             # a metadata file param can have multiple files
             for curr_source in curr_val:
-                curr_type = curr_source.split(".")[-1]
-                if curr_type not in ["qza", "tsv"]:
-                    raise ValueError(
-                        f"Unexpected metadata type: '{curr_type}'")
-
-                new_metadata_val = {'type': curr_type,
-                                    'source': curr_source,
-                                    'column': curr_col}
-                new_param_val.append(new_metadata_val)
+                new_param_val.append(
+                    _make_metadata_param(curr_source, curr_col))
             # next metadata source
 
     params_dict[curr_param] = new_param_val
@@ -123,6 +120,56 @@ def _reformat_special_params(params_dict, lang_prefix,
     return params_dict
 
 
+def _apply_conversion_plan(params_dict, plan):
+    # the plan says what each synthetic key holds, so there is no scanning
+    # for prefixes, and a key it does not know is an error, not an argument
+    keys = plan['keys']
+    known = set(plan['params']).union(plan['outputs'])
+    config = {}
+    parts = {}
+    unknown = []
+    for curr_key, curr_val in params_dict.items():
+        if curr_key in keys:
+            param_name, role = keys[curr_key]
+            parts.setdefault(param_name, {})[role] = curr_val
+        elif curr_key in known:
+            config[curr_key] = curr_val
+        else:
+            unknown.append(curr_key)
+    if unknown:
+        raise ValueError(f"Unrecognized inputs: {', '.join(sorted(unknown))}")
+
+    for param_name, part in parts.items():
+        kind = plan['params'][param_name][0]
+        if kind == 'column_tabular':
+            config[param_name] = _make_metadata_param(
+                part.get(conversion_plan.METAFILE),
+                part.get(conversion_plan.COLUMN))
+        elif kind == 'metadata_tabular':
+            sources = part.get(conversion_plan.METAFILE)
+            config[param_name] = None if sources is None else \
+                [_make_metadata_param(x, None) for x in sources]
+        elif conversion_plan.COLLECTION_KEYS in part:
+            collection_keys = part[conversion_plan.COLLECTION_KEYS]
+            # the values are under the parameter's own name, unless renamed
+            collection_vals = part.get(conversion_plan.VALUE,
+                                       config.get(param_name))
+            if collection_keys is None and collection_vals is None:
+                config[param_name] = None
+                continue
+            # one left unset and the other empty is an empty collection
+            collection_keys = collection_keys or []
+            collection_vals = collection_vals or []
+            if len(collection_keys) != len(collection_vals):
+                raise ValueError("Collection keys and values must "
+                                 "be the same length")
+            config[param_name] = dict(zip(collection_keys, collection_vals))
+        else:
+            config[param_name] = part[conversion_plan.VALUE]
+
+    return config
+
+
 def _reformat_cwl_path_params(params_dict):
     def _reformat_cwl_param(param_obj):
         result = None
@@ -152,14 +199,94 @@ def _reformat_cwl_path_params(params_dict):
     return output_dict
 
 
+def _run(plugin, action, config, plan=None):
+    # Hand the task to a warm fork-server if one is listening, otherwise pay
+    # the start-up cost here
+    status = forkserver.request_run(plugin, action, config,
+                                    parse_primitives=True, plan=plan)
+    if status is None:
+        clickin.run(plugin, action, config, parse_primitives=True, plan=plan)
+    elif status != 0:
+        sys.exit(status)
+
+
+def _set_io_summary(io_summary):
+    # through the environment, which reaches a fork-server task as well
+    if io_summary:
+        os.environ[IO_SUMMARY_ENV_VAR] = '1'
+
+
+def _set_profile(profile, profile_scope):
+    if profile:
+        os.environ[profiling.PROFILE_ENV_VAR] = profile
+    if profile_scope:
+        os.environ[profiling.SCOPE_ENV_VAR] = profile_scope
+
+
+def _profile_options(func):
+    func = click.option(
+        '--profile-scope', type=click.Choice(profiling.SCOPES),
+        help="What to profile: the action only (the default) or the whole "
+             "run, from loading inputs to saving results")(func)
+    return click.option(
+        '--profile', type=click.Choice(list(profiling.PROFILERS)),
+        help="Profile the action into the working directory: a pstats dump "
+             "(cprofile) or collapsed stacks (sampling, low overhead)")(func)
+
+
+_io_summary_option = click.option(
+    '--io-summary', is_flag=True, default=False,
+    help="Print a line with the size, time and throughput of every artifact "
+         "read or written")
+_jobs_option = click.option(
+    '--jobs', type=int, default=1, show_default=True,
+    help="Number of worker processes to template with")
+_snapshot_option = click.option(
+    '--from-snapshot', 'snapshot',
+    type=click.Path(file_okay=True, dir_okay=False, exists=True),
+    default=None,
+    help="Template from a `q2dataflow snapshot` file instead of importing "
+         "the installed plugins")
+_cache_refs_option = click.option(
+    '--cache-refs', is_flag=True, default=False,
+    help="Pass artifacts between steps as 'cache:/path/to/cache:key' "
+         "strings naming QIIME 2 Cache entries instead of as .qza files")
+_diagnostics_option = click.option(
+    '--diagnostic', 'diagnostics', type=click.Choice(list(DIAGNOSTICS)),
+    multiple=True,
+    help="Have every task write this diagnostic file, and collect it as an "
+         "optional output named q2dataflow_{name} (repeatable)")
+_actions_option = click.option(
+    '--actions', type=str, multiple=True,
+    help="Only (re)generate actions matching this glob, e.g. 'filter-*' or "
+         "'feature-table.*' (repeatable); other templates are left alone")
+
+
+def _template_settings(ctx, cache_refs, diagnostics=()):
+    settings = ctx.obj
+    if cache_refs:
+        settings = dict(settings, cache_refs=True)
+    if diagnostics:
+        settings = dict(settings, diagnostics=tuple(diagnostics))
+    return settings
+
+
 @click.command("plugin")
 @click.option('--quiet/--no-quiet', default=False)
+@_jobs_option
+@_actions_option
+@_snapshot_option
+@_cache_refs_option
+@_diagnostics_option
 @click.argument('plugin', type=str)
 @click.argument('output', type=clickin.OUTPUT_DIR)
 @click.pass_context
-def _template_plugin(ctx, plugin: str, output: str, quiet: bool = False):
-    clickin.plugin(
-        plugin, output, ctx.obj[MODULE_NAME], quiet, settings=ctx.obj)
+def _template_plugin(ctx, plugin: str, output: str, quiet: bool = False,
+                     jobs: int = 1, actions: tuple = (), snapshot=None,
+                     cache_refs: bool = False, diagnostics: tuple = ()):
+    clickin.plugin(plugin, output, ctx.obj[MODULE_NAME], quiet,
+                   settings=_template_settings(ctx, cache_refs, diagnostics),
+                   jobs=jobs, actions=actions, snapshot=snapshot)
 
 
 @click.command("builtins")
@@ -172,10 +299,19 @@ def _template_builtins(ctx, output: str, quiet: bool = False):
 
 @click.command("all")
 @click.option('--quiet/--no-quiet', default=False)
+@_jobs_option
+@_actions_option
+@_snapshot_option
+@_cache_refs_option
+@_diagnostics_option
 @click.argument('output', type=clickin.OUTPUT_DIR)
 @click.pass_context
-def _template_all(ctx, output: str, quiet: bool = False):
-    clickin.all(output, ctx.obj[MODULE_NAME], quiet, settings=ctx.obj)
+def _template_all(ctx, output: str, quiet: bool = False, jobs: int = 1,
+                  actions: tuple = (), snapshot=None,
+                  cache_refs: bool = False, diagnostics: tuple = ()):
+    clickin.all(output, ctx.obj[MODULE_NAME], quiet,
+                settings=_template_settings(ctx, cache_refs, diagnostics),
+                jobs=jobs, actions=actions, snapshot=snapshot)
 
 
 @click.group()
@@ -190,6 +326,150 @@ def version(plugin):
     clickin.version(plugin)
 
 
+@root.command("snapshot",
+              help="Write the signatures of the installed plugins' actions "
+                   "to a file that `template --from-snapshot` can use "
+                   "without importing the plugins (gzipped if it ends "
+                   "in .gz)")
+@click.option('--plugin', 'plugins', type=str, multiple=True,
+              help="Plugin id to include (repeatable); all plugins are "
+                   "included if not given")
+@click.argument('output', type=click.Path(file_okay=True, dir_okay=False))
+def snapshot(output, plugins):
+    clickin.snapshot(output, plugins)
+
+
+@root.command("run-batch",
+              help="Run many action invocations from a JSONL manifest of "
+                   "{\"plugin\", \"action\", \"inputs\"} records, using a "
+                   "pool of worker processes")
+@click.option('--jobs', type=int, default=None,
+              help="Worker processes (default: the allocated cores)")
+@click.option('--status-file', type=click.Path(dir_okay=False), default=None,
+              help="Also write one JSON status line per record here")
+@click.option('--quiet/--no-quiet', default=False)
+@click.argument('manifest',
+                type=click.Path(file_okay=True, dir_okay=False, exists=True))
+def run_batch(manifest, jobs, status_file, quiet):
+    failures = clickin.run_batch(manifest, jobs=jobs, status_file=status_file,
+                                 quiet=quiet)
+    if failures:
+        sys.exit(1)
+
+
+# Fork-server
+@root.group("forkserver",
+            short_help="Keep QIIME 2 warm between `wdl run`/`cwl run` tasks")
+def forkserver_group():
+    pass
+
+
+@forkserver_group.command("start",
+                          help="Run a fork-server in the foreground. "
+                               "`q2dataflow wdl run` and `q2dataflow cwl run` "
+                               "will use it whenever its socket exists.")
+@click.option('--socket', 'socket_path', type=str, default=None,
+              help="Socket path (default: $%s or a per-user path in the "
+                   "temporary directory)" % forkserver.SOCKET_ENV_VAR)
+@click.option('--plugin', 'plugins', type=str, multiple=True,
+              help="Plugin id to import ahead of time (repeatable); "
+                   "all plugins are loaded if not given")
+@click.option('--max-tasks-per-child', type=int, default=0, show_default=True,
+              help="Replace the warm process after this many tasks "
+                   "(0 for no limit)")
+@click.option('--poll-interval', type=float, default=5.0, show_default=True,
+              help="Seconds between checks for a changed environment")
+def forkserver_start(socket_path, plugins, max_tasks_per_child,
+                     poll_interval):
+    forkserver.serve(socket_path, plugins=plugins,
+                     max_tasks_per_child=max_tasks_per_child,
+                     poll_interval=poll_interval)
+
+
+@forkserver_group.command("reload",
+                          help="Re-import QIIME 2 and plugins, e.g. after "
+                               "changing the conda environment")
+@click.option('--socket', 'socket_path', type=str, default=None)
+def forkserver_reload(socket_path):
+    forkserver.request_control('reload', socket_path=socket_path)
+
+
+@forkserver_group.command("stop")
+@click.option('--socket', 'socket_path', type=str, default=None)
+def forkserver_stop(socket_path):
+    forkserver.request_control('stop', socket_path=socket_path)
+
+
+# Ledger
+@root.group("ledger",
+            short_help="Query the record of runs kept in $%s"
+                       % ledger.LEDGER_ENV_VAR)
+def ledger_group():
+    pass
+
+
+def _ledger_options(func):
+    func = click.option(
+        '--include-failed', is_flag=True, default=False,
+        help="Count runs that did not exit successfully")(func)
+    func = click.option('--plugin', type=str, default=None,
+                        help="Only this plugin's actions")(func)
+    return click.option(
+        '--ledger', 'ledger_fp', envvar=ledger.LEDGER_ENV_VAR, required=True,
+        type=click.Path(file_okay=True, dir_okay=False, exists=True),
+        help="Database file (default: $%s)" % ledger.LEDGER_ENV_VAR)(func)
+
+
+def _megabytes(n_bytes):
+    return None if n_bytes is None else round(n_bytes / 1e6, 1)
+
+
+def _seconds(seconds):
+    return None if seconds is None else round(seconds, 2)
+
+
+@ledger_group.command("slowest", help="The slowest runs")
+@_ledger_options
+@click.option('--limit', type=int, default=20, show_default=True)
+def ledger_slowest(ledger_fp, plugin, include_failed, limit):
+    conn = ledger.connect(ledger_fp)
+    rows = [(started, plugin_id, action_id, _seconds(duration),
+             _megabytes(rss), status)
+            for started, plugin_id, action_id, duration, rss, status
+            in ledger.slowest_runs(conn, limit, plugin, include_failed)]
+    click.echo(ledger.format_table(
+        ('started', 'plugin', 'action', 'seconds', 'peak_rss_mb', 'exit'),
+        rows))
+
+
+@ledger_group.command("durations",
+                      help="Percentiles of the duration of each action")
+@_ledger_options
+def ledger_durations(ledger_fp, plugin, include_failed):
+    conn = ledger.connect(ledger_fp)
+    rows = [(plugin_id, action_id, runs) + tuple(map(_seconds, stats))
+            for plugin_id, action_id, runs, *stats
+            in ledger.action_percentiles(conn, 'duration_s', plugin,
+                                         include_failed)]
+    click.echo(ledger.format_table(
+        ('plugin', 'action', 'runs', 'p50_s', 'p95_s', 'max_s'), rows))
+
+
+@ledger_group.command("memory",
+                      help="Percentiles of the peak memory of each action, "
+                           "the larger of its own and its largest child "
+                           "process's")
+@_ledger_options
+def ledger_memory(ledger_fp, plugin, include_failed):
+    conn = ledger.connect(ledger_fp)
+    rows = [(plugin_id, action_id, runs) + tuple(map(_megabytes, stats))
+            for plugin_id, action_id, runs, *stats
+            in ledger.action_percentiles(
+                conn, ledger.PEAK_MEMORY, plugin, include_failed)]
+    click.echo(ledger.format_table(
+        ('plugin', 'action', 'runs', 'p50_mb', 'p95_mb', 'max_mb'), rows))
+
+
 # WDL
 @root.group()
 @click.version_option(wdl_util.Q2_WDL_VERSION)
@@ -211,14 +491,27 @@ def wdl_template(ctx):
 @click.argument('action', type=str)
 @click.argument('inputs-json',
                 type=click.Path(file_okay=True, dir_okay=False, exists=True))
-def run_wdl(plugin: str, action: str, inputs_json):
+@_io_summary_option
+@_profile_options
+def run_wdl(plugin: str, action: str, inputs_json, io_summary=False,
+            profile=None, profile_scope=None):
+    _set_io_summary(io_summary)
+    _set_profile(profile, profile_scope)
     with open(inputs_json, 'r') as fh:
         config = json.load(fh)
 
-    config = _reformat_special_params(
-        config, wdl_prefix, wdl_metafile_synth_prefix, wdl_reserved_prefix)
+    # templates made before conversion plans were have none
+    plan = conversion_plan.load_plan(config.pop(wdl_util.plan_param_name,
+                                                None))
+    if plan is not None:
+        config = _apply_conversion_plan(config, plan)
+    else:
+        config = _reformat_special_params(
+            config, wdl_util.q2wdl_prefix,
+            wdl_util.metafile_synth_param_prefix,
+            wdl_util.reserved_param_prefix)
 
-    clickin.run(plugin, action, config, parse_primitives=True)
+    _run(plugin, action, config, plan)
 
 
 # CWL
@@ -242,17 +535,28 @@ def cwl_template(ctx):
 @click.argument('action', type=str)
 @click.argument('inputs-json',
                 type=click.Path(file_okay=True, dir_okay=False, exists=True))
-def run_cwl(plugin, action, inputs_json):
+@_io_summary_option
+@_profile_options
+def run_cwl(plugin, action, inputs_json, io_summary=False,
+            profile=None, profile_scope=None):
+    _set_io_summary(io_summary)
+    _set_profile(profile, profile_scope)
     with open(inputs_json, 'r') as fh:
         raw_inputs_json = json.load(fh)
         config = raw_inputs_json['inputs']
 
     config = _reformat_cwl_path_params(config)
-    config = _reformat_special_params(
-        config, cwl_prefix, cwl_metafile_synth_prefix, cwl_reserved_prefix,
-        cwl_collection_keys_prefix)
+    # templates made before conversion plans were have none
+    plan = conversion_plan.load_plan(raw_inputs_json.get('plan'))
+    if plan is not None:
+        config = _apply_conversion_plan(config, plan)
+    else:
+        config = _reformat_special_params(
+            config, cwl_util.q2cwl_prefix,
+            cwl_util.metafile_synth_param_prefix,
+            cwl_util.reserved_param_prefix, cwl_util.collection_keys_prefix)
 
-    clickin.run(plugin, action, config, parse_primitives=True)
+    _run(plugin, action, config, plan)
 
 
 wdl_template.add_command(_template_plugin)
@@ -7,13 +7,21 @@
 # ----------------------------------------------------------------------------
 
 import os
+import functools
 import importlib
-import qiime2.sdk as _sdk
+import multiprocessing
 import q2dataflow.core.description_language.environment as _environment
+import q2dataflow.core.description_language.manifest as _manifest
+import q2dataflow.core.signature_converter.snapshot as _snapshot
 
 # iterators to template (create template files for) various qiime2 components
 __all__ = ['template_plugin_iter', 'template_builtins_iter',
-           'template_all_iter']
+           'template_all_iter', 'get_plugin']
+
+# Parallel templating recycles each worker after this many plugins (or
+# actions), so that the imports and examples of one plugin do not pile up in
+# a long-lived worker.
+MAX_TASKS_PER_CHILD = 1
 
 
 def _collect_test_data_iter(action, test_dir, templater_lib):
@@ -26,22 +34,29 @@ def _collect_test_data_iter(action, test_dir, templater_lib):
 
 def _create_dir_iter(directory, templater_lib):
     if not os.path.exists(directory):
-        os.mkdir(directory)
+        try:
+            os.mkdir(directory)
+        except FileExistsError:
+            # another worker got there first
+            return
         yield {'status': 'created', 'type': 'directory', 'path': directory}
 
 
-def _store_action_template_str_iter(action_template_str, path, templater_lib):
+def _store_action_template_str_iter(action_template_str, path, templater_lib,
+                                    fingerprint=None):
     is_existing = os.path.exists(path)
 
     templater_lib.store_action_template_str(action_template_str, path)
 
-    if not is_existing:
-        yield {'status': 'created', 'type': 'file', 'path': path}
-    else:
-        yield {'status': 'updated', 'type': 'file', 'path': path}
+    status = 'created' if not is_existing else 'updated'
+    # the fingerprint travels with the status (possibly from a worker
+    # process) and is recorded in the manifest by _record_manifest_iter
+    yield {'status': status, 'type': 'file', 'path': path,
+           'fingerprint': fingerprint}
 
 
-def _template_action_iter(plugin, action, directory, templater_lib, settings):
+def _template_action_iter(plugin, action, directory, templater_lib, settings,
+                          manifest=None):
     settings = _add_env_meta_to_settings(settings)
 
     filename = templater_lib.make_action_template_id(
@@ -49,6 +64,12 @@ def _template_action_iter(plugin, action, directory, templater_lib, settings):
     filepath = os.path.join(directory, filename)
     test_dir = os.path.join(directory, 'test-data', '')
 
+    fingerprint = _manifest.fingerprint_action(
+        plugin, action, templater_lib, settings)
+    if manifest is not None and manifest.is_current(filepath, fingerprint):
+        yield {'status': 'unchanged', 'type': 'file', 'path': filepath}
+        return
+
     action_template_str = None
     try:
         # generate a string holding the action template in the relevant language
@@ -62,7 +83,7 @@ def _template_action_iter(plugin, action, directory, templater_lib, settings):
         # write out the action template string to the filepath specified;
         # the enclosing dirs will be created if they don't exist yet
         yield from _store_action_template_str_iter(
-            action_template_str, filepath, templater_lib)
+            action_template_str, filepath, templater_lib, fingerprint)
 
         # TODO: does this test dir actually need to be created if
         #  COLLECTABLE_TEST_USAGE is not true?
@@ -71,57 +92,223 @@ def _template_action_iter(plugin, action, directory, templater_lib, settings):
             yield from _collect_test_data_iter(action, test_dir, templater_lib)
 
 
-def template_plugin_iter(plugin, directory, templater_lib_name, settings):
+def _get_suite_dir(directory, plugin_id):
+    suite_name = f'suite_qiime2_{plugin_id.replace("_", "-")}'
+    return os.path.join(directory, suite_name, '')
+
+
+def get_plugin(plugin_id, snapshot_fp=None):
+    """The plugin, or its stand-in from a signature snapshot"""
+    if snapshot_fp is not None:
+        return _get_snapshot(snapshot_fp).get_plugin(plugin_id)
+
+    import qiime2.sdk as _sdk
+
+    return _sdk.PluginManager().get_plugin(id=plugin_id)
+
+
+def _get_plugins(snapshot_fp=None):
+    if snapshot_fp is not None:
+        return list(_get_snapshot(snapshot_fp).plugins.values())
+
+    import qiime2.sdk as _sdk
+
+    return list(_sdk.PluginManager().plugins.values())
+
+
+@functools.lru_cache(maxsize=None)
+def _get_snapshot(snapshot_fp):
+    # read once per process (forked template workers inherit it)
+    return _snapshot.load_snapshot(snapshot_fp)
+
+
+def template_plugin_iter(plugin, directory, templater_lib_name, settings,
+                         jobs=1, actions=None, snapshot_fp=None):
+    manifest = _manifest.TemplateManifest(directory)
+    yield from _record_manifest_iter(manifest, _template_plugin_iter(
+        plugin, directory, templater_lib_name, settings, manifest,
+        jobs=jobs, actions=actions, snapshot_fp=snapshot_fp))
+
+
+def _template_plugin_iter(plugin, directory, templater_lib_name, settings,
+                          manifest, jobs=1, actions=None, snapshot_fp=None):
     templater_lib = importlib.import_module(templater_lib_name)
+    suite_dir = _get_suite_dir(directory, plugin.id)
 
-    suite_name = f'suite_qiime2_{plugin.id.replace("_", "-")}'
-    suite_dir = os.path.join(directory, suite_name, '')
+    action_ids = [action_id for action_id in sorted(plugin.actions)
+                  if _manifest.action_selected(actions, plugin.id, action_id)]
 
     # if there are any actions, make a dir to hold their templates
-    if plugin.actions:
+    if action_ids:
         yield from _create_dir_iter(suite_dir, templater_lib)
 
+    if jobs > 1 and len(action_ids) > 1:
+        # create the shared test dir up front so that the status stream does
+        # not depend on which worker finishes first
+        yield from _create_dir_iter(
+            os.path.join(suite_dir, 'test-data', ''), templater_lib)
+        tasks = [(plugin.id, [action_id]) for action_id in action_ids]
+        yield from _map_template_tasks(
+            tasks, jobs, directory, templater_lib_name, settings, manifest,
+            snapshot_fp=snapshot_fp)
+        return
+
     # generate and store a template string for each action
-    for action in plugin.actions.values():
+    for action_id in action_ids:
         yield from _template_action_iter(
-            plugin, action, suite_dir, templater_lib, settings)
+            plugin, plugin.actions[action_id], suite_dir, templater_lib,
+            settings, manifest)
+
+
+def template_builtins_iter(directory, templater_lib_name, settings,
+                           actions=None):
+    manifest = _manifest.TemplateManifest(directory)
+    yield from _record_manifest_iter(manifest, _template_builtins_iter(
+        directory, templater_lib_name, settings, manifest, actions=actions))
 
 
-def template_builtins_iter(directory, templater_lib_name, settings):
+def _template_builtins_iter(directory, templater_lib_name, settings, manifest,
+                            actions=None):
     templater_lib = importlib.import_module(templater_lib_name)
 
     settings = _add_env_meta_to_settings(settings)
 
+    template_ids = [
+        template_id for template_id in templater_lib.BUILTIN_MAKERS
+        if _manifest.action_selected(
+            actions, 'tools', _builtin_action_id(template_id), template_id)]
+    if not template_ids:
+        return
+
     # create a dir to store the templates for the builtin actions
     suite_name = 'suite_qiime2_tools'
     suite_dir = os.path.join(directory, suite_name, '')
     yield from _create_dir_iter(suite_dir, templater_lib)
 
-    for action_template_id, action_template_str_maker in \
-            templater_lib.BUILTIN_MAKERS.items():
+    for action_template_id in template_ids:
+        action_template_str_maker = \
+            templater_lib.BUILTIN_MAKERS[action_template_id]
+        filepath = os.path.join(
+            suite_dir, action_template_id + templater_lib.get_extension())
+
+        fingerprint = _manifest.fingerprint_builtin(
+            action_template_id, templater_lib, settings)
+        if manifest.is_current(filepath, fingerprint):
+            yield {'status': 'unchanged', 'type': 'file', 'path': filepath}
+            continue
+
         # generate string holding the action template in the relevant language
         action_template_str = action_template_str_maker(
             action_template_id, settings)
 
         # write out the tool template string to the filepath specified;
         # the enclosing dirs will be created if they don't exist yet
-        filepath = os.path.join(
-            suite_dir, action_template_id + templater_lib.get_extension())
         yield from _store_action_template_str_iter(
-            action_template_str, filepath, templater_lib)
+            action_template_str, filepath, templater_lib, fingerprint)
 
 
-def template_all_iter(directory, templater_lib_name, settings):
-    pm = _sdk.PluginManager()
-    for plugin in pm.plugins.values():
-        yield from template_plugin_iter(
-            plugin, directory, templater_lib_name, settings)
+def _builtin_action_id(template_id):
+    # 'qiime2_tools_import' -> 'import',
+    # 'qiime2_tools_qza-to-tabular' -> 'qza_to_tabular'
+    return template_id.split('_', 2)[-1].replace('-', '_')
 
-    yield from template_builtins_iter(directory, templater_lib_name, settings)
 
+def template_all_iter(directory, templater_lib_name, settings, jobs=1,
+                      actions=None, snapshot_fp=None):
+    manifest = _manifest.TemplateManifest(directory)
+    yield from _record_manifest_iter(manifest, _template_all_iter(
+        directory, templater_lib_name, settings, manifest, jobs=jobs,
+        actions=actions, snapshot_fp=snapshot_fp))
 
-def _add_env_meta_to_settings(settings):
+
+def _template_all_iter(directory, templater_lib_name, settings, manifest,
+                       jobs=1, actions=None, snapshot_fp=None):
+    plugins = sorted(_get_plugins(snapshot_fp), key=lambda p: p.id)
+
+    if jobs > 1:
+        tasks = [(plugin.id, None) for plugin in plugins]
+        yield from _map_template_tasks(
+            tasks, jobs, directory, templater_lib_name, settings, manifest,
+            actions=actions, snapshot_fp=snapshot_fp)
+    else:
+        for plugin in plugins:
+            yield from _template_plugin_iter(
+                plugin, directory, templater_lib_name, settings, manifest,
+                actions=actions)
+
+    yield from _template_builtins_iter(
+        directory, templater_lib_name, settings, manifest, actions=actions)
+
+
+def _record_manifest_iter(manifest, statuses):
+    try:
+        for status in statuses:
+            fingerprint = status.pop('fingerprint', None)
+            if fingerprint is not None:
+                manifest.record(status['path'], fingerprint)
+            yield status
+    finally:
+        # keep whatever was written, even if templating stopped early
+        manifest.save()
+
+
+def _map_template_tasks(tasks, jobs, directory, templater_lib_name, settings,
+                        manifest, actions=None, snapshot_fp=None):
+    # statuses are gathered per task and emitted in task order, so the
+    # stream is identical however the work is scheduled
+    shared = (directory, templater_lib_name, _portable_settings(settings),
+              manifest, actions, snapshot_fp)
+    tasks = [(plugin_id, action_ids) + shared
+             for plugin_id, action_ids in tasks]
+
+    ctx = multiprocessing.get_context()
+    with ctx.Pool(processes=min(jobs, len(tasks)),
+                  maxtasksperchild=MAX_TASKS_PER_CHILD) as pool:
+        for statuses in pool.imap(_template_task, tasks):
+            yield from statuses
+
+
+def _get_worker_plugin(plugin_id, snapshot_fp=None):
+    # a forked worker inherits the parent's plugins, but a spawned one would
+    # otherwise discover (import) every installed plugin for each task
+    if snapshot_fp is not None:
+        return get_plugin(plugin_id, snapshot_fp)
+
+    from q2dataflow.core.description_language.drivers import plugin_loader
+
+    return plugin_loader.load_plugin(plugin_id)
+
+
+def _template_task(task):
+    (plugin_id, action_ids, directory, templater_lib_name, settings,
+     manifest, actions, snapshot_fp) = task
+    plugin = _get_worker_plugin(plugin_id, snapshot_fp)
+
+    if action_ids is None:
+        return list(_template_plugin_iter(
+            plugin, directory, templater_lib_name, settings, manifest,
+            actions=actions))
+
+    templater_lib = importlib.import_module(templater_lib_name)
+    suite_dir = _get_suite_dir(directory, plugin.id)
+    statuses = []
+    for action_id in action_ids:
+        statuses.extend(_template_action_iter(
+            plugin, plugin.actions[action_id], suite_dir, templater_lib,
+            settings, manifest))
+    return statuses
+
+
+def _portable_settings(settings):
+    # the conda metadata is looked up again (once) in each worker
     if settings is None:
-        settings = {}
+        return None
+    return {k: v for k, v in settings.items() if k != 'conda_meta'}
+
+
+def _add_env_meta_to_settings(settings):
+    # never mutate the caller's settings: they are shared between actions
+    # (and, when templating in parallel, handed to other processes)
+    settings = {} if settings is None else dict(settings)
     settings["conda_meta"] = _environment.find_conda_meta()
-    return settings
\ No newline at end of file
+    return settings
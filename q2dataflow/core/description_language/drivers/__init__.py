@@ -9,5 +9,8 @@ from q2dataflow.core.description_language.drivers.action import \
     action_runner, get_version
 from q2dataflow.core.description_language.drivers.builtins import \
     builtin_runner
+from q2dataflow.core.description_language.drivers.batch import \
+    batch_runner, read_batch_manifest
 
-__all__ = ['action_runner', 'builtin_runner', 'get_version']
+__all__ = ['action_runner', 'builtin_runner', 'get_version', 'batch_runner',
+           'read_batch_manifest']
@@ -5,34 +5,162 @@
 #
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
+import os
 import sys
+import tempfile
+import itertools
+import concurrent.futures
 
 import qiime2
 import qiime2.sdk as sdk
 from qiime2.core.type.util import parse_primitive
 
+from q2dataflow.core.runtime.archive import peek_archive
+from q2dataflow.core.runtime.metadata_tsv import project_metadata_tsv
+from q2dataflow.core.runtime.diagnostics import diagnosed_run
+from q2dataflow.core.runtime.ledger import params_digest
+from q2dataflow.core.runtime.plan import (
+    ARTIFACT_KINDS, METADATA_KINDS, get_kinds, check_arguments)
+from q2dataflow.core.runtime.tracing import span
 from q2dataflow.core.signature_converter.util import get_mystery_stew
+from q2dataflow.core.description_language.drivers import plugin_loader
+from q2dataflow.core.description_language.drivers.artifact_cache import \
+    get_artifact_cache, load_artifact
+from q2dataflow.core.description_language.drivers.artifact_loader import \
+    load_artifacts, get_load_threads
+from q2dataflow.core.description_language.drivers.cache_refs import \
+    is_cache_ref, load_cache_ref, load_collection_cache_ref
+from q2dataflow.core.description_language.drivers.metadata_cache import \
+    get_metadata_cache, load_metadata, view_metadata
+from q2dataflow.core.description_language.drivers.saving import save_result
 from q2dataflow.core.description_language.drivers.stdio import (
     error_handler, stdio_files, GALAXY_TRIMMED_STRING_LEN)
 
+# how many elements of a list or set argument are echoed before running
+MAX_ECHOED_ELEMENTS = 20
 
-def action_runner(plugin_id, action_id, inputs, parse_primitives=False):
+
+def action_runner(plugin_id, action_id, inputs, parse_primitives=False,
+                  preloaded=None, plan=None):
     # Each helper below is decorated to accept stdout and stderr, the goal is
     # to catch issues and promote the error message to the start of stdout and
     # stderr so that Galaxy's misc_info block will be the most relevant info.
     # Otherwise, you tend to end up with a traceback or the start of stdout
     # for noisy actions. To preserve stdout and stderr, we do want to log them
     # and then emit them at the end after writing out the relevant error first
-    with stdio_files() as stdio:
-        action = _get_action(plugin_id, action_id,
-                             _stdio=stdio)
-        results_kwargs, inputs_only = _extract_output_args(
-            action.signature, inputs, _stdio=stdio)
-        action_kwargs = _convert_arguments(action.signature, inputs_only,
-                                           _stdio=stdio,
-                                           parse_primitives=parse_primitives)
-        results = _execute_action(action, action_kwargs, _stdio=stdio)
-        _save_results(results, output_fps=results_kwargs, _stdio=stdio)
+    with diagnosed_run(f'{plugin_id} {action_id}', plugin=plugin_id,
+                       action=action_id) as run, stdio_files() as stdio:
+        with span('get_action'):
+            action = _get_action(plugin_id, action_id,
+                                 _stdio=stdio)
+        if run is not None:
+            run.args['plugin_version'] = _get_plugin(plugin_id).version
+            run.args['params_digest'] = params_digest(
+                {k: v for k, v in inputs.items()
+                 if k in action.signature.parameters})
+        with span('extract_output_args'):
+            results_kwargs, inputs_only = _extract_output_args(
+                action.signature, inputs, _stdio=stdio)
+        kinds = _get_argument_kinds(action.signature, plan)
+        with span('preflight'):
+            _preflight(action.signature, inputs_only, kinds, plan,
+                       _stdio=stdio)
+        with span('convert_arguments'):
+            action_kwargs = _convert_arguments(
+                action.signature, inputs_only, kinds, _stdio=stdio,
+                parse_primitives=parse_primitives, preloaded=preloaded)
+        with span('execute_action'):
+            results = _execute_action(action, action_kwargs, _stdio=stdio)
+        with span('save_results'):
+            _save_results(results, output_fps=results_kwargs, _stdio=stdio)
+
+
+def preload_artifacts(plugin_id, action_id, inputs):
+    """Load the artifact inputs of an invocation ahead of running it
+
+    Returns a dict of filepath to loaded artifact, suitable for the
+    `preloaded` argument of `action_runner`.
+    """
+    action = _get_plugin(plugin_id).actions[action_id]
+    kinds = _get_argument_kinds(action.signature)
+    fps = [fp for _, fp in _iter_artifact_inputs(kinds, inputs)]
+    return load_artifacts(fps, _load_artifact).artifacts
+
+
+def _get_argument_kinds(signature, plan=None):
+    """The (kind, collection) of each input and parameter
+
+    From the template's conversion plan, if it has one, else from the types
+    of the signature; the kinds of plain parameters are not told apart.
+    """
+    if plan is not None:
+        return get_kinds(plan)
+
+    kinds = {}
+    for k, spec in signature.inputs.items():
+        type_ = spec.qiime_type
+        if qiime2.sdk.util.is_collection_type(type_):
+            kinds[k] = ('multiple_input', type_.name)
+        else:
+            kinds[k] = ('input', None)
+    for k, spec in signature.parameters.items():
+        type_ = spec.qiime_type
+        if qiime2.sdk.util.is_collection_type(type_):
+            kinds[k] = ('simple_collection', type_.name)
+        elif qiime2.sdk.util.is_metadata_column_type(type_):
+            kinds[k] = ('column_tabular', None)
+        elif qiime2.sdk.util.is_metadata_type(type_):
+            kinds[k] = ('metadata_tabular', None)
+        else:
+            kinds[k] = ('primitive', None)
+    return kinds
+
+
+def _iter_artifact_inputs(kinds, inputs):
+    """(input name, filepath) of every artifact to load for `inputs`"""
+    for k, v in inputs.items():
+        if v is None or k not in kinds or kinds[k][0] not in ARTIFACT_KINDS:
+            continue
+
+        collection = kinds[k][1]
+        if collection is None:
+            yield k, v
+        elif collection != 'Collection':  # a Collection is a directory
+            yield from ((k, fp) for fp in v if fp is not None)
+
+
+def _load_input_artifacts(kinds, inputs, preloaded=None):
+    """Load every artifact input at once, reporting the time per input"""
+    if preloaded is None:
+        preloaded = {}
+
+    fps_by_input = {}
+    for k, fp in _iter_artifact_inputs(kinds, inputs):
+        fps_by_input.setdefault(k, []).append(fp)
+    to_load = [fp for fps in fps_by_input.values() for fp in fps
+               if fp not in preloaded]
+    if not to_load:
+        return preloaded
+
+    loaded = load_artifacts(to_load, _load_artifact)
+    for k, fps in fps_by_input.items():
+        seconds = sum(loaded.seconds.get(fp, 0) for fp in set(fps))
+        print(f"Loaded {k}: {len(fps)} artifact(s) in {seconds:.2f}s",
+              file=sys.stdout)
+    print(f"Loaded {loaded.distinct} distinct artifact(s) from "
+          f"{len(to_load)} path(s) in {loaded.elapsed:.2f}s on "
+          f"{loaded.threads} thread(s)", file=sys.stdout)
+
+    return dict(preloaded, **loaded.artifacts)
+
+
+def _load_artifact(fp, preloaded=None):
+    if preloaded is not None and fp in preloaded:
+        return preloaded[fp]
+    with span(os.path.basename(fp), 'load', path=fp):
+        if is_cache_ref(fp):
+            return load_cache_ref(fp)
+        return load_artifact(fp)
 
 
 def get_version(plugin_id):
@@ -44,8 +172,7 @@ def _get_plugin(plugin_id):
     if plugin_id == 'mystery_stew':
         return get_mystery_stew()
     else:
-        pm = sdk.PluginManager()
-        return pm.get_plugin(id=plugin_id)
+        return plugin_loader.load_plugin(plugin_id)
 
 
 @error_handler(header="Unexpected error finding the action in q2description_language: ")
@@ -68,36 +195,157 @@ def _extract_output_args(signature, inputs):
     return output_kwargs, inputs_only
 
 
+@error_handler(header="Invalid inputs:\n")
+def _preflight(signature, inputs, kinds, plan=None):
+    """Check what can be checked of the inputs without loading any
+
+    Every argument must be of the shape its conversion plan (if any) says,
+    every artifact must exist and be of a type the action accepts, as its
+    metadata.yaml says, and every metadata source must be readable; all
+    that fails is reported at once.
+    """
+    if plan is not None:
+        errors = check_arguments(inputs, plan)
+        if errors:
+            # nothing more can be made of arguments of the wrong shape
+            raise ValueError('\n'.join(errors))
+
+    errors = []
+    for k, fp in _iter_artifact_inputs(kinds, inputs):
+        if is_cache_ref(fp):
+            continue
+        error = _check_artifact(fp, signature.inputs[k].qiime_type,
+                                kinds[k][1])
+        if error is not None:
+            errors.append(f"{k}: {error}")
+
+    for k, v in inputs.items():
+        if v is None or k not in kinds:
+            continue
+        kind, collection = kinds[k]
+        if kind in ARTIFACT_KINDS:
+            if (collection == 'Collection' and not is_cache_ref(v)
+                    and not os.path.isdir(v)):
+                errors.append(f"{k}: {v} is not a directory")
+        elif kind in METADATA_KINDS:
+            entries = [v] if isinstance(v, dict) else v
+            for entry in entries:
+                error = _check_metadata_source(entry)
+                if error is not None:
+                    errors.append(f"{k}: {error}")
+
+    if errors:
+        raise ValueError('\n'.join(errors))
+
+
+def _check_artifact(fp, expected, collection=None):
+    if not os.path.isfile(fp):
+        return f"{fp} does not exist"
+    try:
+        peek = peek_archive(fp)
+    except ValueError as e:
+        return str(e)
+
+    if collection is not None:
+        expected = expected.fields[0]
+    try:
+        matches = qiime2.sdk.parse_type(peek.type) <= expected
+    except Exception:
+        # e.g. a type of a plugin that is not loaded: the action decides
+        return None
+    if not matches:
+        return f"{fp} is a {peek.type}, but {expected} is expected"
+    return None
+
+
+def _check_metadata_source(entry):
+    if entry.get('type') == 'none':
+        return None
+    source = entry['source']
+    if is_cache_ref(source):
+        return None
+    if not os.path.isfile(source):
+        return f"{source} does not exist"
+    if entry['type'] == 'tsv':
+        try:
+            with open(source, 'rb') as fh:
+                fh.read(1)
+        except OSError as e:
+            return f"{source} cannot be read: {e}"
+        return None
+    try:
+        peek_archive(source)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
 @error_handler(header="Unexpected error loading arguments in q2description_language: ")
-def _convert_arguments(signature, inputs, parse_primitives=False):
+def _convert_arguments(signature, inputs, kinds, parse_primitives=False,
+                       preloaded=None):
+    try:
+        processed_inputs = _convert_arguments_once(
+            signature, inputs, kinds, parse_primitives, preloaded)
+    except Exception as e:
+        if not (plugin_loader.is_partial()
+                and plugin_loader.is_missing_registration(e)):
+            raise
+        # an input's format or transformer may belong to a plugin that was
+        # not loaded; loading has no side effects, so try again with all
+        plugin_loader.load_all_plugins()
+        processed_inputs = _convert_arguments_once(
+            signature, inputs, kinds, parse_primitives, preloaded)
+
+    cache = get_artifact_cache()
+    if cache is not None:
+        print(f"Artifact cache {cache.root}: {cache.hits} hit(s), "
+              f"{cache.misses} miss(es)", file=sys.stdout)
+    cache = get_metadata_cache()
+    if cache is not None:
+        print(f"Metadata cache {cache.root}: {cache.hits} hit(s), "
+              f"{cache.misses} miss(es)", file=sys.stdout)
+
+    return processed_inputs
+
+
+def _convert_arguments_once(signature, inputs, kinds, parse_primitives,
+                            preloaded):
     processed_inputs = {}
+    preloaded = _load_input_artifacts(kinds, inputs, preloaded)
+    # a source given to several metadata parameters is loaded once
+    loaded_metadata = {}
 
     all_inputs_params = {}
     all_inputs_params.update(signature.parameters)
     all_inputs_params.update(signature.inputs)
     for k, v in inputs.items():
         type_ = all_inputs_params[k].qiime_type
+        kind, collection = kinds[k]
 
         if v is None:
             processed_inputs[k] = None
 
-        elif qiime2.sdk.util.is_collection_type(type_):
-            if k in signature.inputs:
-                if type_.name == 'List' or type_.name == 'Set':
+        elif collection is not None:
+            if kind in ARTIFACT_KINDS:
+                if collection == 'List' or collection == 'Set':
                     processed_input = []
 
                     for curr_fp in v:
                         if curr_fp is not None:
-                            processed_input.append(sdk.Artifact.load(curr_fp))
+                            processed_input.append(
+                                _load_artifact(curr_fp, preloaded))
 
                     # Handle unprovided optional lists or sets
                     if processed_input == []:
                         processed_input = None
 
                     processed_inputs[k] = processed_input
-                elif type_.name == 'Collection':
-                    # here, v should be a directory path
-                    processed_input = sdk.ResultCollection.load(v)
+                elif collection == 'Collection':
+                    # here, v should be a directory path (or a cache key)
+                    if is_cache_ref(v):
+                        processed_input = load_collection_cache_ref(v)
+                    else:
+                        processed_input = sdk.ResultCollection.load(v)
 
                     # Handle unprovided optional collections
                     if processed_input.collection == {}:
@@ -106,7 +354,7 @@ def _convert_arguments(signature, inputs, parse_primitives=False):
                     processed_inputs[k] = processed_input
                 else:
                     raise NotImplementedError(
-                        f"Collection type '{type}' not supported")
+                        f"Collection type '{collection}' not supported")
             elif v == []:
                 if signature.parameters[k].has_default():
                     processed_inputs[k] = signature.parameters[k].default
@@ -117,18 +365,19 @@ def _convert_arguments(signature, inputs, parse_primitives=False):
                 v_val = parse_primitive(type_, v) if parse_primitives else v
                 processed_inputs[k] = v_val
 
-            if type_.name == 'Set' and processed_inputs[k] is not None:
+            if collection == 'Set' and processed_inputs[k] is not None:
                 processed_inputs[k] = set(processed_inputs[k])
 
-        elif qiime2.sdk.util.is_metadata_type(type_):
-            processed_inputs[k] = _convert_metadata(type_, inputs[k], k)
+        elif kind in METADATA_KINDS:
+            processed_inputs[k] = _convert_metadata(
+                type_, inputs[k], k, loaded=loaded_metadata)
 
-        elif k in signature.inputs:
+        elif kind in ARTIFACT_KINDS:
             # Handle unprovided artifact
             if v is None:
                 processed_inputs[k] = None
             else:
-                processed_inputs[k] = sdk.Artifact.load(v)
+                processed_inputs[k] = _load_artifact(v, preloaded)
         else:
             v_val = parse_primitive(type_, v) if parse_primitives else v
             processed_inputs[k] = v_val
@@ -139,22 +388,46 @@ def _convert_arguments(signature, inputs, parse_primitives=False):
 @error_handler(header="This plugin encountered an error:\n")
 def _execute_action(action, action_kwargs):
     for param, arg in action_kwargs.items():
-        pretty_arg = repr(arg)
-        if isinstance(arg, qiime2.sdk.Result):
-            pretty_arg = str(arg.uuid)
-        elif isinstance(arg, qiime2.Metadata):
-            pretty_arg = "<Metadata>"
-        elif isinstance(arg, list) or isinstance(arg, set):
-            if len(arg) > 0 and isinstance(list(arg)[0], qiime2.sdk.Result):
-                pretty_arg = ',\n'.join(str(a.uuid) for a in arg)
-            else:
-                pretty_arg = ', '.join(repr(a) for a in arg)
-        line = f'｢{param}: {pretty_arg}｣'
+        line = f'｢{param}: {_pretty_arg(arg)}｣'
         print(line, file=sys.stdout, flush=True)
     # see _error_handler for rational
     print(" " * GALAXY_TRIMMED_STRING_LEN, file=sys.stdout, flush=True)
 
-    return action(**action_kwargs)
+    try:
+        return action(**action_kwargs)
+    except Exception as e:
+        # a method's inputs are transformed before the plugin's code runs,
+        # so a transformer from a plugin that was not loaded fails before
+        # anything has happened (a pipeline may be part way through)
+        if not (plugin_loader.is_partial() and action.type != 'pipeline'
+                and plugin_loader.is_missing_transformation(e)):
+            raise
+        plugin_loader.load_all_plugins()
+        return action(**action_kwargs)
+
+
+def _pretty_arg(arg):
+    if isinstance(arg, qiime2.sdk.Result):
+        return str(arg.uuid)
+    elif isinstance(arg, qiime2.Metadata):
+        return "<Metadata>"
+    elif isinstance(arg, list) or isinstance(arg, set):
+        # only the first few of what may be thousands of elements
+        shown = list(itertools.islice(arg, MAX_ECHOED_ELEMENTS))
+        if shown and isinstance(shown[0], qiime2.sdk.Result):
+            sep, pretty = ',\n', [str(a.uuid) for a in shown]
+        else:
+            sep, pretty = ', ', [_truncate(repr(a)) for a in shown]
+        if len(arg) > len(shown):
+            pretty.append(f'... ({len(arg) - len(shown)} more)')
+        return sep.join(pretty)
+    return _truncate(repr(arg))
+
+
+def _truncate(text):
+    if len(text) <= GALAXY_TRIMMED_STRING_LEN:
+        return text
+    return text[:GALAXY_TRIMMED_STRING_LEN - 3] + '...'
 
 
 @error_handler(header="Unexpected error saving results in q2description_language: ")
@@ -164,43 +437,51 @@ def _save_results(results, output_fps=None):
 
     for name, result in zip(results._fields, results):
         fp = output_fps.get(name, name)
-        location = result.save(fp)
+        with span(name, 'save', path=fp) as current:
+            location = save_result(result, fp)
+            if current is not None:
+                current.args['location'] = location
         print(f"Saved {result.type} to: {location}", file=sys.stdout)
 
 
-def _convert_metadata(input_, value, param):
+def _convert_metadata(input_, value, param, loaded=None):
+    """`loaded` maps sources already loaded in this invocation to metadata"""
+    if loaded is None:
+        loaded = {}
     if not value:
         return None
 
+    metadata = None
     if input_.name == 'MetadataColumn':
         if value['type'] == 'none':
             return None
         value = [value]
-
-    mds = []
-    for entry in value:
-        if entry['type'] == 'tsv':
-            try:
-                md = qiime2.Metadata.load(entry['source'])
-            except Exception as e:
-                raise ValueError(
-                    "There was an issue with loading the file provided to %r"
-                    " as metadata:" % param) from e
+    # a cache key holds an artifact, whatever type its entry was given
+    value = [dict(entry, type='qza') if is_cache_ref(entry.get('source'))
+             else entry for entry in value]
+    if input_.name == 'MetadataColumn':
+        metadata = _load_projected_metadata(value[0], param, loaded)
+
+    if metadata is None:
+        # sources load independently (parsing and unzipping mostly outside the
+        # GIL); the first to fail, in the given order, is the one reported
+        to_load = list(dict.fromkeys(
+            (entry['type'], entry['source']) for entry in value
+            if (entry['type'], entry['source']) not in loaded))
+        if to_load:
+            threads = max(min(get_load_threads(), len(to_load)), 1)
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=threads,
+                    thread_name_prefix='q2dataflow-metadata') as pool:
+                loaded.update(zip(to_load, pool.map(
+                    lambda source: _load_metadata(*source, param), to_load)))
+        mds = [loaded[(entry['type'], entry['source'])] for entry in value]
+
+        if len(mds) > 1:
+            # a single inner join of all the sources on their IDs
+            return mds[0].merge(*mds[1:])
         else:
-            art = qiime2.Artifact.load(entry['source'])
-            try:
-                md = art.view(qiime2.Metadata)
-            except Exception as e:
-                raise ValueError(
-                    "There was an issue with viewing the artifact provided to "
-                    "%r as QIIME 2 Metadata:" % param) from e
-
-        mds.append(md)
-
-    if len(mds) > 1:
-        return mds[0].merge(*mds[1:])
-    else:
-        metadata = mds[0]
+            metadata = mds[0]
 
     if input_.name == 'MetadataColumn':
         try:
@@ -229,3 +510,44 @@ def _convert_metadata(input_, value, param):
 
     else:
         return metadata
+
+
+def _load_projected_metadata(entry, param, loaded):
+    """Only the ID column and the named column of a TSV, or None
+
+    None when the column is referenced by position (as Galaxy does, which
+    needs every column) or the source is an artifact, which can only be
+    viewed as a whole; the whole source is then loaded instead.
+    """
+    column = entry.get('column')
+    if entry['type'] != 'tsv' or not isinstance(column, str):
+        return None
+
+    key = ('tsv', entry['source'], column)
+    if key not in loaded:
+        with tempfile.TemporaryDirectory(prefix='q2dataflow-metadata') as dir_:
+            fp = os.path.join(dir_, os.path.basename(entry['source']))
+            if not project_metadata_tsv(entry['source'], fp, column):
+                return None
+            loaded[key] = _load_metadata('tsv', fp, param)
+    return loaded[key]
+
+
+def _load_metadata(type_, source, param):
+    with span(os.path.basename(source), 'metadata', path=source,
+              parameter=param):
+        if type_ == 'tsv':
+            try:
+                return load_metadata(source)
+            except Exception as e:
+                raise ValueError(
+                    "There was an issue with loading the file provided to %r"
+                    " as metadata:" % param) from e
+        else:
+            art = _load_artifact(source)
+            try:
+                return view_metadata(art)
+            except Exception as e:
+                raise ValueError(
+                    "There was an issue with viewing the artifact provided to "
+                    "%r as QIIME 2 Metadata:" % param) from e
@@ -0,0 +1,100 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Opt-in node-local cache of extracted input artifacts
+
+With $Q2DATAFLOW_ARTIFACT_CACHE set to a directory on local disk, each input
+.qza is extracted once per node (into a QIIME 2 Cache kept there) and later
+tasks load the extracted copy. Entries are keyed by the archive's UUID and a
+checksum of its zip directory, and are evicted least recently used first
+once they exceed $Q2DATAFLOW_ARTIFACT_CACHE_MAX_SIZE (e.g. '200G').
+"""
+import os
+import threading
+
+import qiime2.sdk as sdk
+from qiime2.core.cache import Cache
+
+from q2dataflow.core.runtime.archive import summarize_archive
+from q2dataflow.core.runtime.node_cache import NodeCache
+from q2dataflow.core.runtime.util import parse_size
+
+CACHE_ENV_VAR = 'Q2DATAFLOW_ARTIFACT_CACHE'
+MAX_SIZE_ENV_VAR = 'Q2DATAFLOW_ARTIFACT_CACHE_MAX_SIZE'
+
+# one cache per root, created at most once per process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class ArtifactCache:
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self._counts_lock = threading.Lock()
+        # checks that the root is private, before anything is put in it
+        self._entries = NodeCache(root, max_bytes, remove=self._remove)
+        self._store = Cache(os.path.join(root, 'artifacts'))
+
+    def load(self, filepath):
+        try:
+            summary = summarize_archive(filepath)
+        except ValueError:
+            # not ours to judge: let qiime2 report what is wrong with it
+            return sdk.Artifact.load(filepath)
+
+        # cache keys must be valid identifiers
+        key = 'a%s_%s' % (summary.uuid.replace('-', '_'),
+                          summary.checksum[:16])
+
+        def fill():
+            self._store.save(sdk.Artifact.load(filepath), key)
+            return summary.size
+
+        hit = self._entries.acquire(key, fill)
+        with self._counts_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        try:
+            return self._store.load(key)
+        except Exception:
+            # e.g. the cache directory was cleaned up underneath us
+            self._entries.discard(key)
+            return sdk.Artifact.load(filepath)
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                self._store.remove(key)
+            except KeyError:
+                pass
+        self._store.garbage_collection()
+
+
+def get_artifact_cache():
+    """The cache configured in the environment, or None"""
+    root = os.environ.get(CACHE_ENV_VAR)
+    if not root:
+        return None
+
+    # called from the loading threads (and the batch prefetch thread)
+    with _caches_lock:
+        if root not in _caches:
+            max_bytes = parse_size(os.environ.get(MAX_SIZE_ENV_VAR))
+            _caches[root] = ArtifactCache(root, max_bytes)
+        return _caches[root]
+
+
+def load_artifact(filepath):
+    cache = get_artifact_cache()
+    if cache is None:
+        return sdk.Artifact.load(filepath)
+    return cache.load(filepath)
@@ -0,0 +1,105 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Loading all of an invocation's artifact inputs at once
+
+Every path is loaded once, however many parameters (or list entries) name it,
+and so is every archive: paths to copies of the same artifact (same UUID and
+contents) share one loaded object. Loading is mostly unzipping and hashing,
+which release the GIL, so the artifacts are loaded on a thread pool of
+$Q2DATAFLOW_LOAD_THREADS threads (default: all available cores).
+"""
+import os
+import time
+import concurrent.futures
+
+from q2dataflow.core.runtime.archive import summarize_archive
+from q2dataflow.core.runtime.util import get_available_cores
+from q2dataflow.core.description_language.drivers.cache_refs import \
+    is_cache_ref
+
+LOAD_THREADS_ENV_VAR = 'Q2DATAFLOW_LOAD_THREADS'
+
+
+def get_load_threads():
+    threads = os.environ.get(LOAD_THREADS_ENV_VAR)
+    if threads:
+        return max(int(threads), 1)
+    return get_available_cores()
+
+
+class LoadedArtifacts:
+    def __init__(self, artifacts, seconds, distinct, elapsed, threads):
+        # {path: loaded artifact}
+        self.artifacts = artifacts
+        # {path: seconds spent loading it}; shared loads count for each path
+        self.seconds = seconds
+        self.distinct = distinct
+        self.elapsed = elapsed
+        self.threads = threads
+
+
+def load_artifacts(fps, load, threads=None):
+    """Load the artifacts at `fps` with `load(fp)`, each distinct one once"""
+    start = time.perf_counter()
+    fps = list(dict.fromkeys(fps))
+    if threads is None:
+        threads = get_load_threads()
+    threads = max(min(threads, len(fps)), 1)
+
+    with _executor(threads) as pool:
+        keys = dict(zip(fps, pool.map(_identify, fps)))
+
+        # the first path seen for each artifact is the one loaded
+        by_key = {}
+        for fp in fps:
+            by_key.setdefault(keys[fp], fp)
+        loads = dict(zip(by_key.values(),
+                         pool.map(lambda fp: _timed(load, fp),
+                                  by_key.values())))
+
+    artifacts = {}
+    seconds = {}
+    for fp in fps:
+        artifacts[fp], seconds[fp] = loads[by_key[keys[fp]]]
+    return LoadedArtifacts(artifacts, seconds, len(by_key),
+                           time.perf_counter() - start, threads)
+
+
+def _identify(fp):
+    if is_cache_ref(fp):
+        return fp
+    try:
+        summary = summarize_archive(fp)
+    except (OSError, ValueError):
+        # loading it will say what is wrong
+        return os.path.realpath(fp)
+    return summary.uuid, summary.checksum
+
+
+def _timed(load, fp):
+    start = time.perf_counter()
+    result = load(fp)
+    return result, time.perf_counter() - start
+
+
+class _InlineExecutor:
+    def map(self, fn, iterable):
+        return map(fn, iterable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _executor(threads):
+    if threads == 1:
+        return _InlineExecutor()
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=threads, thread_name_prefix='q2dataflow-load')
@@ -0,0 +1,210 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import json
+import time
+import collections
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+from q2dataflow.core.runtime.util import get_available_cores
+from q2dataflow.core.description_language.drivers.action import \
+    action_runner, preload_artifacts, _get_plugin
+from q2dataflow.core.description_language.drivers.builtins import \
+    builtin_runner
+
+# upper bound on the number of consecutive records handed to a worker at once;
+# within such a chunk the next record's inputs are loaded while the current
+# record computes
+MAX_CHUNK_SIZE = 16
+
+
+def read_batch_manifest(manifest_fp):
+    with open(manifest_fp, 'r') as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def batch_runner(lines, jobs=None, parse_primitives=True):
+    """Run every record of a JSONL batch manifest and yield a status per record
+
+    Statuses are yielded in manifest order.  A failing record is reported and
+    does not stop the remaining records.
+    """
+    records = list(enumerate(lines))
+    if not records:
+        return
+
+    if jobs is None or jobs < 1:
+        jobs = get_available_cores()
+    jobs = min(jobs, len(records))
+
+    chunk_size = max(1, min(MAX_CHUNK_SIZE, len(records) // (jobs * 4)))
+    chunks = collections.deque(records[i:i + chunk_size]
+                               for i in range(0, len(records), chunk_size))
+
+    ctx = multiprocessing.get_context()
+    if ctx.get_start_method() == 'fork':
+        # discover the plugins once here; the workers inherit them
+        _warm_plugins(records)
+
+    # A worker that dies (e.g. killed for its memory) without reporting
+    # breaks the pool, and every chunk then running with it. The pool is
+    # restarted; the records of those chunks are run again, each alone, so
+    # that only a record that breaks the pool by itself is reported lost.
+    suspects = collections.deque()
+    done = {}
+    next_index = 0
+    while chunks or suspects:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs, mp_context=ctx) as executor:
+            running = {}
+            broken = None
+            while broken is None and (chunks or suspects or running):
+                if suspects:
+                    if not running:
+                        chunk = [suspects.popleft()]
+                        running[executor.submit(
+                            _run_chunk, (chunk, parse_primitives))] = \
+                            (chunk, True)
+                else:
+                    # no more than can run at once, so that a chunk not yet
+                    # started is never lost with the pool
+                    while chunks and len(running) < jobs:
+                        chunk = chunks.popleft()
+                        running[executor.submit(
+                            _run_chunk, (chunk, parse_primitives))] = \
+                            (chunk, False)
+
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    chunk, alone = running.pop(future)
+                    try:
+                        statuses = future.result()
+                    except BrokenProcessPool as ex:
+                        broken = ex
+                        running[future] = (chunk, alone)
+                        continue
+                    done.update((status['index'], status)
+                                for status in statuses)
+
+                while next_index in done:
+                    yield done.pop(next_index)
+                    next_index += 1
+
+            if broken is not None:
+                concurrent.futures.wait(running)
+                for future, (chunk, alone) in running.items():
+                    if future.exception() is None:
+                        done.update((status['index'], status)
+                                    for status in future.result())
+                    elif alone:
+                        done.update((index, _lost_record_status(
+                            index, line, future.exception()))
+                            for index, line in chunk)
+                    else:
+                        suspects.extend(chunk)
+
+    while next_index in done:
+        yield done.pop(next_index)
+        next_index += 1
+
+
+def _warm_plugins(records):
+    plugin_ids = set()
+    for _, line in records:
+        try:
+            plugin_ids.add(json.loads(line)['plugin'])
+        except Exception:
+            continue
+
+    for plugin_id in sorted(plugin_ids - {'tools'}):
+        try:
+            _get_plugin(plugin_id)
+        except Exception:
+            # reported per record by the worker
+            continue
+
+
+def _parse_record(line):
+    record = json.loads(line)
+    missing = [k for k in ('plugin', 'action', 'inputs') if k not in record]
+    if missing:
+        raise ValueError("Batch record is missing: %s" % ', '.join(missing))
+    return record['plugin'], record['action'], record['inputs']
+
+
+def _prefetch(line):
+    try:
+        plugin_id, action_id, inputs = _parse_record(line)
+        if plugin_id == 'tools':
+            return None
+        return preload_artifacts(plugin_id, action_id, inputs)
+    except Exception:
+        # let the record fail (and be reported) when it actually runs
+        return None
+
+
+def _run_chunk(args):
+    records, parse_primitives = args
+
+    statuses = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as prefetcher:
+        upcoming = prefetcher.submit(_prefetch, records[0][1])
+        for position, (index, line) in enumerate(records):
+            current = upcoming
+            if position + 1 < len(records):
+                upcoming = prefetcher.submit(
+                    _prefetch, records[position + 1][1])
+
+            statuses.append(
+                _run_record(index, line, current, parse_primitives))
+
+    return statuses
+
+
+def _lost_record_status(index, line, ex):
+    status = {'status': 'error', 'type': 'record', 'index': index,
+              'plugin': None, 'action': None,
+              'msg': 'The worker running this record exited unexpectedly: '
+                     '%r' % ex}
+    try:
+        status['plugin'], status['action'], _ = _parse_record(line)
+    except Exception:
+        pass
+    return status
+
+
+def _run_record(index, line, prefetched, parse_primitives):
+    status = {'status': 'completed', 'type': 'record', 'index': index,
+              'plugin': None, 'action': None}
+    start = time.time()
+    try:
+        plugin_id, action_id, inputs = _parse_record(line)
+        status['plugin'] = plugin_id
+        status['action'] = action_id
+
+        waited = time.time()
+        preloaded = prefetched.result()
+        status['prefetch_wait'] = round(time.time() - waited, 3)
+
+        if plugin_id == 'tools':
+            builtin_runner(action_id, inputs)
+        else:
+            action_runner(plugin_id, action_id, inputs,
+                          parse_primitives=parse_primitives,
+                          preloaded=preloaded)
+    except (Exception, SystemExit) as ex:
+        status['status'] = 'error'
+        status['msg'] = repr(ex)
+
+    status['elapsed'] = round(time.time() - start, 3)
+    return status
@@ -7,26 +7,54 @@
 # ----------------------------------------------------------------------------
 import os
 import sys
+import time
 import tempfile
-import distutils
 
 import qiime2
 import qiime2.sdk
 import qiime2.util
 
+from q2dataflow.core.runtime.diagnostics import diagnosed_run
+from q2dataflow.core.runtime.ledger import params_digest
+from q2dataflow.core.runtime.archive import extract_data, tar_data, \
+    write_tar
+from q2dataflow.core.runtime.staging import stage_files, copy_tree, \
+    read_staging_manifest, get_staging_threads
+from q2dataflow.core.runtime.tabular import read_ids, write_biom_tsv, \
+    write_dataframe_tsv
+from q2dataflow.core.runtime.tracing import span
 from q2dataflow.core.description_language.drivers.stdio import \
     error_handler, stdio_files
+from q2dataflow.core.description_language.drivers.plugin_loader import \
+    load_all_plugins
+from q2dataflow.core.description_language.drivers.cache_refs import \
+    is_cache_ref, load_cache_ref
+from q2dataflow.core.description_language.drivers.saving import \
+    save_result, get_archive_root
 
 output_location_key = 'output_location'
 import_location_key = 'import_location'
 input_location_key = 'input_location'
+# a staging manifest (see runtime.staging) of the files to import; having
+# two underscores, it cannot be the `import_<attr>` of a directory format
+import_manifest_key = 'import_file_manifest'
+export_tar_key = 'tar'
 
 
 def builtin_runner(action_id, inputs):
-    with stdio_files() as stdio:
-        tool = _get_tool(action_id,
-                         _stdio=stdio)
-        tool(inputs, stdio=stdio)
+    # types and formats are parsed from strings, so any plugin's may be named
+    with diagnosed_run(f'tools {action_id}', plugin='tools',
+                       action=action_id) as run:
+        if run is not None:
+            run.args['plugin_version'] = qiime2.__version__
+            run.args['params_digest'] = params_digest(inputs)
+        with span('load_plugins'):
+            load_all_plugins()
+        with stdio_files() as stdio:
+            tool = _get_tool(action_id,
+                             _stdio=stdio)
+            with span(action_id):
+                tool(inputs, stdio=stdio)
 
 
 @error_handler("Unexpected error finding tool: ")
@@ -34,7 +62,8 @@ def _get_tool(action_id):
     builtin_map = {
         'import': import_data,
         'export': export_data,
-        'qza_to_tabular': qza_to_tabular
+        'qza_to_tabular': qza_to_tabular,
+        'materialize': materialize
     }
     try:
         return builtin_map[action_id]
@@ -72,6 +101,12 @@ def _import_get_args(inputs):
     for key, value in inputs.items():
         if not key.startswith('import'):
             raise ValueError(f"Unknown instruction in JSON: {key}")
+        elif key == import_manifest_key:
+            try:
+                manifest = value['data']
+            except TypeError:
+                manifest = value
+            files_to_move.extend(read_staging_manifest(manifest))
         elif key == 'import' or key == import_location_key:
             try:
                 input_val = value['data']
@@ -100,8 +135,13 @@ def _import_name_data(type_, format_, files_to_move):
 
     with tempfile.TemporaryDirectory(prefix='q2description_language-import',
                                      dir=os.getcwd()) as dir_:
-        for src, dst in files_to_move:
-            qiime2.util.duplicate(src, os.path.join(dir_, dst))
+        start = time.perf_counter()
+        methods = stage_files(files_to_move, dir_)
+        print('｢staged: %d file(s) (%s) in %.2fs｣'
+              % (sum(methods.values()),
+                 ', '.join('%d %s' % (n, method)
+                           for method, n in methods.most_common()),
+                 time.perf_counter() - start), file=sys.stdout)
         return qiime2.Artifact.import_data(type_, dir_, view_type=format_)
 
 
@@ -109,15 +149,24 @@ def _import_name_data(type_, format_, files_to_move):
 def _import_save(artifact, output_location=None):
     if not output_location:
         output_location = 'imported_data'
-    artifact.save(output_location)
+    with span('imported_data', 'save', path=output_location) as current:
+        location = save_result(artifact, output_location)
+        if current is not None:
+            current.args['location'] = location
 
 
 def export_data(inputs, stdio):
-    output_format, result, output_location = _export_get_args(
+    input_, output_format, output_location, as_tar = _export_get_args(
         inputs, _stdio=stdio)
+    if output_format is None and not is_cache_ref(input_):
+        # nothing to transform: the data is taken straight from the archive
+        _export_archive_data(input_, output_location, as_tar, _stdio=stdio)
+        return
+
+    result = _export_load(input_, _stdio=stdio)
     output_format = _export_transform(result, output_format, output_location,
                                       _stdio=stdio)
-    _export_save(output_format, output_location,
+    _export_save(output_format, output_location, as_tar,
                  _stdio=stdio)
 
 
@@ -142,11 +191,39 @@ def _export_get_args(inputs):
     if output_location_key in inputs:
         output_location = inputs[output_location_key]
 
+    # a single tar file, rather than a directory of files, for the engine
+    as_tar = inputs.get(export_tar_key) in (True, 'true', 'True')
+    if as_tar and not output_location:
+        output_location = 'data.tar'
+
+    return input_, output_format, output_location, as_tar
+
+
+@error_handler(header='Unexpected error collecting arguments: ')
+def _export_load(input_):
     # TODO: Result.load will die if the format is unknown, there may be a
     #  better way to handle unknown /data/ directories
-    result = qiime2.sdk.Result.load(input_)
+    with span(os.path.basename(input_), 'load', path=input_):
+        if is_cache_ref(input_):
+            return load_cache_ref(input_)
+        return qiime2.sdk.Result.load(input_)
+
 
-    return output_format, result, output_location
+@error_handler(header='Unexpected error exporting data: ')
+def _export_archive_data(input_, output_location=None, as_tar=False):
+    if output_location is None:
+        output_location = os.getcwd()
+
+    start = time.perf_counter()
+    with span(os.path.basename(input_), 'load', path=input_):
+        if as_tar:
+            n_files, n_bytes = tar_data(input_, output_location)
+        else:
+            n_files, n_bytes = extract_data(input_, output_location,
+                                            threads=get_staging_threads())
+    print('｢exported: %d file(s), %.1f MB in %.2fs｣'
+          % (n_files, n_bytes / 1e6, time.perf_counter() - start),
+          file=sys.stdout)
 
 
 @error_handler(header='Error converting format:\n')
@@ -161,18 +238,95 @@ def _export_transform(result, output_format, output_location=None):
 
 
 @error_handler(header='Unexpected error saving output: ')
-def _export_save(format_obj, output_location=None):
+def _export_save(format_obj, output_location=None, as_tar=False):
     if format_obj is None:
         pass  # from default output_format in _export_transform (return None)
+    elif as_tar:
+        if format_obj.path.is_dir():
+            members = [(str(path), path.name)
+                       for path in sorted(format_obj.path.iterdir())]
+        else:
+            members = [(str(format_obj), format_obj.path.name)]
+        write_tar(members, output_location)
     elif format_obj.path.is_dir():
         if not output_location:
             output_location = os.getcwd()
-        distutils.dir_util.copy_tree(str(format_obj), output_location)
+        copy_tree(str(format_obj), output_location)
     else:
         if not output_location:
             output_location = format_obj.path.name
         qiime2.util.duplicate(str(format_obj), output_location)
 
 
+def materialize(inputs, stdio):
+    result, output_location = _materialize_get_args(inputs, _stdio=stdio)
+    _materialize_save(result, output_location, _stdio=stdio)
+
+
+@error_handler(header='Unexpected error collecting arguments: ')
+def _materialize_get_args(inputs):
+    input_ = inputs[input_location_key]
+    if not is_cache_ref(input_):
+        raise ValueError(f"Expected 'cache:/path/to/cache:key', not {input_!r}")
+
+    output_location = inputs.get(output_location_key)
+
+    print(f'｢{input_location_key}: {input_}｣', file=sys.stdout)
+    print(f'｢{output_location_key}: {output_location}｣', file=sys.stdout)
+
+    return load_cache_ref(input_), output_location
+
+
+@error_handler(header='Unexpected error saving QZA: ')
+def _materialize_save(result, output_location=None):
+    if not output_location:
+        output_location = 'materialized_data'
+    with span('materialized_data', 'save', path=output_location) as current:
+        location = save_result(result, output_location)
+        if current is not None:
+            current.args['location'] = location
+    print(f"Saved {result.type} to: {location}", file=sys.stdout)
+
+
 def qza_to_tabular(inputs, stdio):
-    raise NotImplementedError("TODO")
+    input_, output_location, rows, columns = _tabular_get_args(
+        inputs, _stdio=stdio)
+    result = _export_load(input_, _stdio=stdio)
+    _tabular_write(result, output_location, rows, columns, _stdio=stdio)
+
+
+@error_handler(header='Unexpected error collecting arguments: ')
+def _tabular_get_args(inputs):
+    input_ = inputs.get(input_location_key, None)
+    if not input_:
+        input_ = inputs['input']
+
+    output_location = inputs.get(output_location_key) or 'table.tsv'
+    # lists of IDs, or files of one ID per line
+    rows = read_ids(inputs.get('rows'))
+    columns = read_ids(inputs.get('columns'))
+
+    print(f'｢{input_location_key}: {input_}｣', file=sys.stdout)
+    print(f'｢{output_location_key}: {output_location}｣', file=sys.stdout)
+
+    return input_, output_location, rows, columns
+
+
+@error_handler(header='Unexpected error writing table: ')
+def _tabular_write(result, output_location, rows=None, columns=None):
+    start = time.perf_counter()
+    root = get_archive_root(result)
+    format_ = getattr(result, 'format', None)
+    if (root is not None and format_ is not None
+            and format_.__name__ == 'BIOMV210DirFmt'):
+        # read in place: a view would first copy the whole file
+        biom_fp = os.path.join(root, str(result.uuid), 'data',
+                               'feature-table.biom')
+        shape = write_biom_tsv(biom_fp, output_location, rows, columns)
+    else:
+        import pandas as pd
+
+        shape = write_dataframe_tsv(result.view(pd.DataFrame),
+                                    output_location, rows, columns)
+    print('｢tabulated: %d row(s), %d column(s) in %.2fs｣'
+          % (shape + (time.perf_counter() - start,)), file=sys.stdout)
@@ -0,0 +1,51 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Arguments of the form 'cache:/path/to/cache:key'
+
+Such an argument names a key in a QIIME 2 Cache instead of a .qza, so that
+consecutive workflow steps sharing the cache skip zipping and unzipping
+their intermediate results.
+"""
+import threading
+
+from qiime2.core.cache import Cache
+import qiime2.sdk as sdk
+
+from q2dataflow.core.runtime.cache_refs import (  # noqa: F401
+    CACHE_REF_PREFIX, is_cache_ref, parse_cache_ref)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _get_cache(path):
+    # artifacts are loaded on several threads
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = Cache(path)
+        return _caches[path]
+
+
+def load_cache_ref(value):
+    path, key = parse_cache_ref(value)
+    return _get_cache(path).load(key)
+
+
+def load_collection_cache_ref(value):
+    path, key = parse_cache_ref(value)
+    return _get_cache(path).load_collection(key)
+
+
+def save_cache_ref(result, value):
+    path, key = parse_cache_ref(value)
+    cache = _get_cache(path)
+    if isinstance(result, sdk.ResultCollection):
+        cache.save_collection(result, key)
+    else:
+        cache.save(result, key)
+    return value
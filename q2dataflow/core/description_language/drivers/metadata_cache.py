@@ -0,0 +1,151 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Opt-in node-local cache of parsed metadata
+
+With $Q2DATAFLOW_METADATA_CACHE set to a directory on local disk, metadata
+parsed from a TSV (keyed by a hash of the file's contents) or viewed from an
+artifact (keyed by its UUID) is pickled there, and later tasks unpickle it
+instead of parsing and validating it again, if they have the same versions
+of qiime2, pandas and numpy. The pickled DataFrame is stored
+column block by column block, so it reloads at close to disk speed. Entries
+are evicted least recently used first once they exceed
+$Q2DATAFLOW_METADATA_CACHE_MAX_SIZE (e.g. '20G').
+"""
+import os
+import pickle
+import hashlib
+import threading
+
+import qiime2
+
+from q2dataflow.core.runtime.node_cache import NodeCache
+from q2dataflow.core.runtime.util import parse_size
+
+CACHE_ENV_VAR = 'Q2DATAFLOW_METADATA_CACHE'
+MAX_SIZE_ENV_VAR = 'Q2DATAFLOW_METADATA_CACHE_MAX_SIZE'
+
+# one cache per root, created at most once per process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class MetadataCache:
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self._counts_lock = threading.Lock()
+        # checks that the root is private, before anything is put in it
+        self._entries = NodeCache(root, max_bytes, remove=self._remove)
+        self._entries_dir = os.path.join(root, 'entries')
+        os.makedirs(self._entries_dir, mode=0o700, exist_ok=True)
+
+    def load(self, filepath):
+        """Metadata.load(filepath), from the cache when possible"""
+        key = 'tsv_' + _hash_file(filepath)
+        return self._get(key, lambda: qiime2.Metadata.load(filepath))
+
+    def view(self, artifact):
+        """artifact.view(Metadata), from the cache when possible"""
+        key = 'qza_' + str(artifact.uuid).replace('-', '_')
+        metadata = self._get(key, lambda: _without_artifacts(
+            artifact.view(qiime2.Metadata)))
+        # the artifact is recorded in the provenance of anything the
+        # metadata is used for, as a view would have done
+        metadata._add_artifacts([artifact])
+        return metadata
+
+    def _get(self, key, parse):
+        key = '%s_%s' % (key, _pickle_versions())
+        filepath = os.path.join(self._entries_dir, key + '.pickle')
+        parsed = []
+
+        def fill():
+            metadata = parse()
+            parsed.append(metadata)
+            tmp_fp = '%s.%d' % (filepath, os.getpid())
+            with open(tmp_fp, 'wb') as fh:
+                pickle.dump(metadata, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_fp, filepath)
+            return os.path.getsize(filepath)
+
+        hit = self._entries.acquire(key, fill)
+        with self._counts_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if parsed:
+            return parsed[0]
+        try:
+            with open(filepath, 'rb') as fh:
+                return pickle.load(fh)
+        except Exception:
+            # e.g. the cache directory was cleaned up underneath us
+            self._entries.discard(key)
+            return parse()
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                os.remove(os.path.join(self._entries_dir, key + '.pickle'))
+            except FileNotFoundError:
+                pass
+
+
+def _pickle_versions():
+    """A digest of what a pickle is only good for: the versions it came from"""
+    import numpy
+    import pandas
+
+    versions = '%s %s %s' % (qiime2.__version__, pandas.__version__,
+                             numpy.__version__)
+    return hashlib.sha256(versions.encode('utf8')).hexdigest()[:8]
+
+
+def _hash_file(filepath):
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()[:32]
+
+
+def _without_artifacts(metadata):
+    # artifacts are not pickled; the one viewed is added back on load
+    metadata._artifacts = []
+    return metadata
+
+
+def get_metadata_cache():
+    """The cache configured in the environment, or None"""
+    root = os.environ.get(CACHE_ENV_VAR)
+    if not root:
+        return None
+
+    # called from the loading threads (and the batch prefetch thread)
+    with _caches_lock:
+        if root not in _caches:
+            max_bytes = parse_size(os.environ.get(MAX_SIZE_ENV_VAR))
+            _caches[root] = MetadataCache(root, max_bytes)
+        return _caches[root]
+
+
+def load_metadata(filepath):
+    cache = get_metadata_cache()
+    if cache is None:
+        return qiime2.Metadata.load(filepath)
+    return cache.load(filepath)
+
+
+def view_metadata(artifact):
+    cache = get_metadata_cache()
+    if cache is None:
+        return artifact.view(qiime2.Metadata)
+    return cache.view(artifact)
@@ -0,0 +1,152 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Register only the plugins an action needs
+
+`sdk.PluginManager()` imports every installed plugin. Running one action only
+needs its own plugin, plus the plugins (usually q2-types) whose packages it
+imports, since those register the formats and transformers for its types.
+`load_plugin` registers just those, into the same PluginManager singleton;
+`load_all_plugins` completes it when something turns out to be missing.
+"""
+import os
+import sys
+
+import qiime2.sdk as sdk
+
+from q2dataflow.core.runtime.plugins import \
+    find_plugin_entry_point, iter_plugin_entry_points
+
+# 'full' always discovers every installed plugin
+DISCOVERY_ENV_VAR = 'Q2DATAFLOW_PLUGIN_DISCOVERY'
+
+# whether the PluginManager singleton was made here with only some plugins
+_partial = False
+
+
+def load_plugin(plugin_id):
+    """The plugin `plugin_id`, registering as few other plugins as possible"""
+    global _partial
+
+    existing = _existing_plugin_manager()
+    if existing is not None:
+        if plugin_id in existing.plugins:
+            return existing.plugins[plugin_id]
+        if not _partial:
+            # the manager was already built by full discovery
+            return existing.get_plugin(id=plugin_id)
+
+    if os.environ.get(DISCOVERY_ENV_VAR) == 'full':
+        return load_all_plugins().get_plugin(id=plugin_id)
+
+    entry_point, _ = find_plugin_entry_point(plugin_id)
+    if entry_point is None:
+        return load_all_plugins().get_plugin(id=plugin_id)
+
+    plugin = entry_point.load()
+    if plugin.id != plugin_id:
+        # the entry point was only a guess from its name
+        return load_all_plugins().get_plugin(id=plugin_id)
+
+    pm = existing
+    if pm is None:
+        pm = sdk.PluginManager(add_plugins=False)
+        _partial = True
+
+    try:
+        for dependency in _iter_imported_plugins(pm, plugin):
+            pm.add_plugin(dependency)
+        pm.add_plugin(plugin)
+    except Exception:
+        # e.g. a registration that refers to a plugin not loaded yet
+        return load_all_plugins().get_plugin(id=plugin_id)
+
+    return plugin
+
+
+def load_all_plugins():
+    """The PluginManager, with every installed plugin registered
+
+    Returns whichever manager exists, after adding any plugins that
+    `load_plugin` skipped.
+    """
+    global _partial
+
+    existing = _existing_plugin_manager()
+    if existing is None:
+        return sdk.PluginManager()
+    if not _partial:
+        return existing
+
+    for entry_point, _ in iter_plugin_entry_points():
+        plugin = entry_point.load()
+        if plugin.id not in existing.plugins:
+            existing.add_plugin(plugin)
+    _partial = False
+    return existing
+
+
+def is_partial():
+    return _partial
+
+
+def is_missing_transformation(error):
+    # qiime2.core.transform raises a bare Exception for this
+    return str(error).startswith('No transformation from')
+
+
+def is_missing_registration(error):
+    """Whether `error`, or an error it was raised from, is for want of a
+    plugin that was not loaded: a transformation, a semantic type or a
+    format that only another plugin registers"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if (is_missing_transformation(error)
+                or _is_unknown_type(error) or _is_unknown_format(error)):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _is_unknown_type(error):
+    # qiime2.sdk.util.parse_type, for a name no plugin has defined
+    return 'is not a defined QIIME type' in str(error)
+
+
+def _is_unknown_format(error):
+    # a format name looked up among those the PluginManager knows
+    return (isinstance(error, KeyError) and len(error.args) == 1
+            and isinstance(error.args[0], str)
+            and error.args[0].endswith('Format'))
+
+
+def _existing_plugin_manager():
+    try:
+        return sdk.PluginManager.reuse_existing()
+    except sdk.UninitializedPluginManagerError:
+        return None
+
+
+def _iter_imported_plugins(pm, plugin):
+    # A plugin that imports another plugin's package (e.g. q2_types) uses
+    # its types, so that plugin's registrations are needed too. Loading one
+    # of those may import further plugins' packages.
+    found = {plugin.id}
+    changed = True
+    while changed:
+        changed = False
+        for entry_point, _ in iter_plugin_entry_points():
+            module_name = entry_point.value.split(':')[0]
+            if module_name.split('.')[0] not in sys.modules:
+                continue
+            dependency = entry_point.load()
+            if dependency.id in found or dependency.id in pm.plugins:
+                continue
+            found.add(dependency.id)
+            changed = True
+            yield dependency
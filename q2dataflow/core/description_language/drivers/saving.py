@@ -0,0 +1,82 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Saving results, optionally with a chosen compression level
+
+With $Q2DATAFLOW_COMPRESSION_LEVEL set (0-9, or 'stored' for 0), results are
+zipped by q2dataflow's own writer at that level, deflating large members on
+$Q2DATAFLOW_ARCHIVE_THREADS threads (default: all available cores). The
+archives are ordinary .qza/.qzv files. Without it, qiime2 saves them as usual.
+"""
+import os
+
+import qiime2.sdk as sdk
+
+from q2dataflow.core.runtime.archive import write_archive
+from q2dataflow.core.runtime.util import get_available_cores
+from q2dataflow.core.description_language.drivers.cache_refs import \
+    is_cache_ref, save_cache_ref
+
+COMPRESSION_LEVEL_ENV_VAR = 'Q2DATAFLOW_COMPRESSION_LEVEL'
+THREADS_ENV_VAR = 'Q2DATAFLOW_ARCHIVE_THREADS'
+
+
+def get_compression_level():
+    """The configured compression level, or None for qiime2's default"""
+    level = os.environ.get(COMPRESSION_LEVEL_ENV_VAR, '').strip().lower()
+    if not level:
+        return None
+    if level == 'stored':
+        return 0
+    if not level.isdigit() or int(level) > 9:
+        raise ValueError("$%s must be 0-9 or 'stored', not %r"
+                         % (COMPRESSION_LEVEL_ENV_VAR, level))
+    return int(level)
+
+
+def get_archive_threads():
+    threads = os.environ.get(THREADS_ENV_VAR)
+    if threads:
+        return max(int(threads), 1)
+    return get_available_cores()
+
+
+def save_result(result, location):
+    """Save to a filepath or a cache ref, returning where it went"""
+    if is_cache_ref(location):
+        return save_cache_ref(result, location)
+
+    level = get_compression_level()
+    if level is None or isinstance(result, sdk.ResultCollection):
+        return result.save(location)
+
+    root = get_archive_root(result)
+    if root is None:
+        return result.save(location)
+
+    location = str(location)
+    if not location.endswith(result.extension):
+        location += result.extension
+    write_archive(root, str(result.uuid), location, compresslevel=level,
+                  threads=get_archive_threads())
+    return location
+
+
+def get_archive_root(result):
+    # The directory holding the result's extracted `<uuid>/` tree, which is
+    # what qiime2 zips on save. That is internal to qiime2, so anything
+    # unexpected leaves the saving to qiime2.
+    path = getattr(getattr(result, '_archiver', None), 'path', None)
+    if path is None:
+        return None
+    path = str(path)
+    uuid = str(result.uuid)
+    if os.path.basename(path.rstrip(os.sep)) == uuid:
+        path = os.path.dirname(path.rstrip(os.sep))
+    if not os.path.isfile(os.path.join(path, uuid, 'metadata.yaml')):
+        return None
+    return path
@@ -5,9 +5,18 @@
 #
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
+import os
 import sys
+import codecs
+import time
+import fcntl
+import select
+import shutil
+import struct
+import termios
 import textwrap
 import tempfile
+import threading
 import contextlib
 
 import qiime2.util
@@ -17,9 +26,24 @@ GALAXY_TRIMMED_STRING_LEN = 255
 # the width can be adjusted in the UI, but the default + kerning is about this
 MISC_INFO_WIDTH = 37
 
+# 'replay' (the default) holds the output of each step back and prints it
+# after the error message, if any; 'stream' passes it through as it comes
+STDIO_MODE_ENV_VAR = 'Q2DATAFLOW_STDIO'
+# how much of the start and of the end of streamed output is kept, to be
+# printed again after an error message
+STREAM_HEAD_BYTES = 64 * 1024
+STREAM_TAIL_BYTES = 256 * 1024
+COPY_CHUNK_BYTES = 1024 * 1024
+
 
 @contextlib.contextmanager
 def stdio_files():
+    if (os.environ.get(STDIO_MODE_ENV_VAR, 'replay') == 'stream'
+            and _has_fileno(sys.stdout) and _has_fileno(sys.stderr)):
+        with _stream_relays() as stdio:
+            yield stdio
+        return
+
     out = tempfile.NamedTemporaryFile(prefix='q2description_language-stdout-', suffix='.log')
     err = tempfile.NamedTemporaryFile(prefix='q2description_language-stderr-', suffix='.log')
 
@@ -29,6 +53,104 @@ def stdio_files():
         _print_stdio((out, err))
 
 
+def _has_fileno(stream):
+    try:
+        stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return False
+    return True
+
+
+@contextlib.contextmanager
+def _stream_relays():
+    out = StreamRelay(sys.stdout)
+    try:
+        err = StreamRelay(sys.stderr)
+        try:
+            yield (out, err)
+        finally:
+            err.close()
+    finally:
+        out.close()
+
+
+class StreamRelay:
+    """A pipe to redirect output into, copied to a stream as it arrives
+
+    Only the first STREAM_HEAD_BYTES and the last STREAM_TAIL_BYTES of what
+    went through are kept, for `summary()`.
+    """
+    def __init__(self, stream):
+        stream.flush()
+        self._target_fd = os.dup(stream.fileno())
+        self._read_fd, write_fd = os.pipe()
+        self._write = os.fdopen(write_fd, 'wb')
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._total = 0
+        # held while a chunk is read and handled, see `sync()`
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._relay, daemon=True,
+                                        name='q2dataflow-stdio-relay')
+        self._thread.start()
+
+    def fileno(self):
+        return self._write.fileno()
+
+    def _relay(self):
+        while True:
+            select.select([self._read_fd], [], [])
+            with self._lock:
+                chunk = os.read(self._read_fd, COPY_CHUNK_BYTES)
+                if not chunk:
+                    return
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(self._target_fd, view):]
+                self._keep(chunk)
+
+    def _keep(self, chunk):
+        self._total += len(chunk)
+        if len(self._head) < STREAM_HEAD_BYTES:
+            taken = STREAM_HEAD_BYTES - len(self._head)
+            self._head += chunk[:taken]
+            chunk = chunk[taken:]
+        self._tail += chunk
+        if len(self._tail) > STREAM_TAIL_BYTES:
+            del self._tail[:len(self._tail) - STREAM_TAIL_BYTES]
+
+    def sync(self, timeout=5):
+        """Wait until what was written so far has been relayed"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if _unread_bytes(self._read_fd) == 0:
+                    return
+            time.sleep(0.001)
+
+    def summary(self):
+        """The start and the end of the output, as bytes"""
+        self.sync()
+        with self._lock:
+            omitted = self._total - len(self._head) - len(self._tail)
+            if omitted <= 0:
+                return bytes(self._head + self._tail)
+            return b''.join([bytes(self._head),
+                             b'\n[... %d bytes omitted ...]\n' % omitted,
+                             bytes(self._tail)])
+
+    def close(self):
+        self._write.close()
+        self._thread.join()
+        os.close(self._read_fd)
+        os.close(self._target_fd)
+
+
+def _unread_bytes(fd):
+    buf = fcntl.ioctl(fd, termios.FIONREAD, struct.pack('i', 0))
+    return struct.unpack('i', buf)[0]
+
+
 def error_handler(header=''):
     def _decorator(function):
         def wrapped(*args, _stdio=(None, None), **kwargs):
@@ -62,10 +184,35 @@ def error_handler(header=''):
 
 def _print_stdio(stdio):
     out, err = stdio
+    if isinstance(out, StreamRelay):
+        # it was all shown already, repeat enough to go with the error
+        _write_bytes(out.summary(), sys.stdout)
+        _write_bytes(err.summary(), sys.stderr)
+        return
+
     out.seek(0)
     err.seek(0)
-    for line in out:  # loop, just in case it's very big (like MAFFT)
-        print(line.decode('utf8'), file=sys.stdout, end='')
+    # copied in chunks, just in case it's very big (like MAFFT)
+    _copy_bytes(out, sys.stdout)
+    _copy_bytes(err, sys.stderr)
+
+
+def _copy_bytes(src, stream):
+    stream.flush()
+    if hasattr(stream, 'buffer'):
+        shutil.copyfileobj(src, stream.buffer, COPY_CHUNK_BYTES)
+        stream.buffer.flush()
+    else:  # a text-only stream, e.g. when captured in tests
+        decoder = codecs.getincrementaldecoder('utf8')(errors='replace')
+        for chunk in iter(lambda: src.read(COPY_CHUNK_BYTES), b''):
+            stream.write(decoder.decode(chunk))
+        stream.write(decoder.decode(b'', final=True))
+
 
-    for line in err:
-        print(line.decode('utf8'), file=sys.stderr, end='')
+def _write_bytes(data, stream):
+    stream.flush()
+    if hasattr(stream, 'buffer'):
+        stream.buffer.write(data)
+        stream.buffer.flush()
+    else:
+        stream.write(data.decode('utf8', errors='replace'))
@@ -7,7 +7,7 @@
 # ----------------------------------------------------------------------------
 import os
 import json
-import importlib
+import threading
 
 
 class CondaMeta:
@@ -22,7 +22,9 @@ class CondaMeta:
                 name = filename.rsplit('-', 2)[0]
                 self.meta_lookup[name] = os.path.join(self.meta, filename)
 
-        self.backup = {d.project_name: d.version
+        # importlib.metadata is slow to import; only templating needs it
+        import importlib.metadata
+        self.backup = {d.metadata['Name']: d.version
                        for d in importlib.metadata.distributions()}
 
     def __getitem__(self, package):
@@ -71,12 +73,14 @@ def get_conda_prefix():
     return conda_prefix
 
 
-_CURRENT_META = None
+# one CondaMeta per conda prefix, created at most once per process
+_CURRENT_META = {}
+_CURRENT_META_LOCK = threading.Lock()
 
 
 def find_conda_meta():
-    global _CURRENT_META
-    if _CURRENT_META is None:
-        prefix = get_conda_prefix()
-        _CURRENT_META = CondaMeta(prefix)
-    return _CURRENT_META
+    prefix = get_conda_prefix()
+    with _CURRENT_META_LOCK:
+        if prefix not in _CURRENT_META:
+            _CURRENT_META[prefix] = CondaMeta(prefix)
+        return _CURRENT_META[prefix]
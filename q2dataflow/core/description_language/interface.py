@@ -5,15 +5,14 @@
 #
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
+import os
 import json
 import click
 
-import qiime2.sdk as sdk
+from q2dataflow.core.runtime.plugins import get_distribution_version
 
-from q2dataflow.core.description_language.drivers import \
-    action_runner, builtin_runner, get_version
-from q2dataflow.core.description_language import \
-    (template_plugin_iter, template_all_iter, template_builtins_iter)
+# qiime2, the drivers and the templaters are imported by the functions that
+# use them, so that each subcommand pays only for its own imports
 
 OUTPUT_DIR = click.Path(file_okay=False, dir_okay=True, exists=True)
 
@@ -25,38 +24,99 @@ def _echo_status(status, quiet: bool = False):
     line = json.dumps(status)
     if status['status'] == 'error':
         click.secho(line, fg='red', err=True)
-    elif status['status'] == 'created' and not quiet:
+    elif status['status'] in ('created', 'completed') and not quiet:
         click.secho(line, fg='green')
+    elif status['status'] == 'unchanged':
+        if not quiet:
+            click.secho(line)
     else:
         click.secho(line, fg='yellow')
 
 
-def plugin(plugin, output, templater_lib_name, quiet, settings=None):
-    pm = sdk.PluginManager()
-    plugin = pm.get_plugin(id=plugin)
+def plugin(plugin, output, templater_lib_name, quiet, settings=None, jobs=1,
+           actions=None, snapshot=None):
+    from q2dataflow.core.description_language import \
+        template_plugin_iter, get_plugin
+
+    plugin = get_plugin(plugin, snapshot)
 
     for status in template_plugin_iter(
-            plugin, output, templater_lib_name, settings):
+            plugin, output, templater_lib_name, settings, jobs=jobs,
+            actions=actions, snapshot_fp=snapshot):
         _echo_status(status, quiet)
 
 
 def builtins(output, templater_lib_name, quiet, settings=None):
+    from q2dataflow.core.description_language import template_builtins_iter
+
     for status in template_builtins_iter(output, templater_lib_name, settings):
         _echo_status(status, quiet)
 
 
-def all(output, templater_lib_name, quiet, settings=None):
-    for status in template_all_iter(output, templater_lib_name, settings):
+def all(output, templater_lib_name, quiet, settings=None, jobs=1,
+        actions=None, snapshot=None):
+    from q2dataflow.core.description_language import template_all_iter
+
+    for status in template_all_iter(output, templater_lib_name, settings,
+                                    jobs=jobs, actions=actions,
+                                    snapshot_fp=snapshot):
         _echo_status(status, quiet)
 
 
-def run(plugin, action, config, parse_primitives=False):
+def snapshot(output, plugin_ids=None):
+    import qiime2.sdk as sdk
+    from q2dataflow.core.signature_converter.snapshot import write_snapshot
+
+    pm = sdk.PluginManager()
+    if plugin_ids:
+        plugins = [pm.get_plugin(id=plugin_id) for plugin_id in plugin_ids]
+    else:
+        plugins = list(pm.plugins.values())
+
+    status = 'updated' if os.path.exists(output) else 'created'
+    write_snapshot(plugins, output)
+    _echo_status({'status': status, 'type': 'file', 'path': output})
+
+
+def run(plugin, action, config, parse_primitives=False, plan=None):
+    from q2dataflow.core.description_language.drivers import \
+        action_runner, builtin_runner
+
     if plugin == 'tools':
         # TODO does this also need to parse primitives?
         builtin_runner(action, config)
     else:
-        action_runner(plugin, action, config, parse_primitives=parse_primitives)
+        action_runner(plugin, action, config, parse_primitives=parse_primitives,
+                      plan=plan)
+
+
+def run_batch(manifest, jobs=None, status_file=None, quiet=False):
+    from q2dataflow.core.description_language.drivers import \
+        batch_runner, read_batch_manifest
+
+    failures = 0
+    status_fh = open(status_file, 'w') if status_file else None
+    try:
+        for status in batch_runner(read_batch_manifest(manifest), jobs=jobs,
+                                   parse_primitives=True):
+            if status['status'] == 'error':
+                failures += 1
+            if status_fh is not None:
+                status_fh.write(json.dumps(status) + '\n')
+                status_fh.flush()
+            _echo_status(status, quiet)
+    finally:
+        if status_fh is not None:
+            status_fh.close()
+
+    return failures
 
 
 def version(plugin):
-    print('%s version %s' % (plugin, get_version(plugin)))
+    # the installed distribution's metadata answers this without discovering
+    # (importing) every plugin
+    plugin_version = get_distribution_version(plugin)
+    if plugin_version is None:
+        from q2dataflow.core.description_language.drivers import get_version
+        plugin_version = get_version(plugin)
+    print('%s version %s' % (plugin, plugin_version))
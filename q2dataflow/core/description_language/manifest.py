@@ -0,0 +1,129 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import os
+import json
+import fnmatch
+import hashlib
+
+from q2dataflow.core.signature_converter.util import \
+    get_q2_version, open_atomic
+
+MANIFEST_FILENAME = '.q2dataflow-manifest.json'
+MANIFEST_VERSION = 1
+
+
+class TemplateManifest:
+    """Fingerprints of the templates previously written to a directory
+
+    Entries are keyed by template path relative to the output directory.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILENAME)
+        self.entries = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as fh:
+                    manifest = json.load(fh)
+            except ValueError:
+                manifest = {}
+            # an unknown manifest version just means everything is rewritten
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.entries = manifest.get('entries', {})
+
+    def _key(self, path):
+        return os.path.relpath(path, self.directory)
+
+    def is_current(self, path, fingerprint):
+        return (self.entries.get(self._key(path)) == fingerprint
+                and os.path.exists(path))
+
+    def record(self, path, fingerprint):
+        self.entries[self._key(path)] = fingerprint
+
+    def save(self):
+        with open_atomic(self.path) as fh:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries},
+                      fh, indent=1, sort_keys=True)
+
+
+def fingerprint_action(plugin, action, templater_lib, settings):
+    return _digest({
+        'plugin': plugin.id,
+        'plugin_version': plugin.version,
+        'action': describe_action(action),
+        'language_version': templater_lib.get_version(),
+        'qiime2_version': get_q2_version(),
+        'settings': _describe_settings(settings),
+    })
+
+
+def fingerprint_builtin(template_id, templater_lib, settings):
+    return _digest({
+        'builtin': template_id,
+        'language_version': templater_lib.get_version(),
+        'qiime2_version': get_q2_version(),
+        'settings': _describe_settings(settings),
+    })
+
+
+def describe_action(action):
+    signature = {}
+    for section in ('inputs', 'parameters', 'outputs'):
+        specs = []
+        for name, spec in getattr(action.signature, section).items():
+            default = _stable_repr(spec.default) if spec.has_default() \
+                else None
+            description = spec.description if spec.has_description() \
+                else None
+            specs.append([name, repr(spec.qiime_type), default, description])
+        signature[section] = specs
+
+    return {'id': action.id,
+            'name': action.name,
+            'description': action.description,
+            'type': action.type,
+            'signature': signature}
+
+
+def _describe_settings(settings):
+    if settings is None:
+        return {}
+    # the conda metadata is an environment snapshot, not a template setting
+    return {k: v for k, v in settings.items() if k != 'conda_meta'}
+
+
+def _stable_repr(value):
+    # sets of strings repr in hash order, which changes between processes
+    if isinstance(value, (set, frozenset)):
+        return repr(sorted(_stable_repr(v) for v in value))
+    return repr(value)
+
+
+def _digest(description):
+    blob = json.dumps(description, sort_keys=True, default=_stable_repr)
+    return hashlib.sha256(blob.encode('utf8')).hexdigest()
+
+
+def action_selected(patterns, plugin_id, action_id, template_id=None):
+    """Whether an action matches any of the --actions glob patterns
+
+    Patterns are matched against the action id and `plugin_id.action_id`,
+    with either underscores or dashes, and against the template id.
+    """
+    if not patterns:
+        return True
+
+    names = {action_id, f'{plugin_id}.{action_id}'}
+    names |= {name.replace('_', '-') for name in names}
+    if template_id is not None:
+        names.add(template_id)
+
+    return any(fnmatch.fnmatchcase(name, pattern)
+               for pattern in patterns for name in names)
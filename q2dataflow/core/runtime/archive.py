@@ -0,0 +1,278 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Reading facts from, and writing, .qza/.qzv archives without qiime2
+
+Summaries are read from the zip directory alone, and a peek at the
+archive's UUID, type and format from its metadata.yaml alone, without
+decompressing the archive's data. An archive's data can be extracted, or
+streamed into a tar file, without loading the archive as a Result.
+"""
+import os
+import zlib
+import time
+import shutil
+import hashlib
+import zipfile
+import collections
+import concurrent.futures
+
+
+class ArchiveSummary:
+    def __init__(self, uuid, checksum, size):
+        self.uuid = uuid
+        # of the member names, CRCs and sizes in the zip directory
+        self.checksum = checksum
+        # total uncompressed size
+        self.size = size
+
+
+def _archive_root(infos, filepath):
+    roots = {info.filename.split('/', 1)[0] for info in infos}
+    if len(roots) != 1:
+        raise ValueError("%s is not a QIIME 2 archive" % filepath)
+    return roots.pop()
+
+
+def summarize_archive(filepath):
+    """The archive's UUID, content checksum and extracted size
+
+    Raises ValueError if `filepath` is not a QIIME 2 archive.
+    """
+    try:
+        with zipfile.ZipFile(filepath) as zf:
+            infos = zf.infolist()
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ValueError("%s is not a QIIME 2 archive" % filepath) from e
+    root = _archive_root(infos, filepath)
+
+    digest = hashlib.sha256()
+    for info in sorted(infos, key=lambda i: i.filename):
+        digest.update(('%s\0%d\0%d\n' % (
+            info.filename, info.CRC, info.file_size)).encode('utf8'))
+
+    return ArchiveSummary(root, digest.hexdigest(),
+                          sum(info.file_size for info in infos))
+
+
+class ArchivePeek:
+    def __init__(self, uuid, type, format, archive_version):
+        self.uuid = uuid
+        # the semantic type, as a string (Visualization for a .qzv)
+        self.type = type
+        # the name of the directory format; None for a .qzv
+        self.format = format
+        self.archive_version = archive_version
+
+
+def peek_archive(filepath):
+    """The UUID, type and format of an archive, from its metadata.yaml
+
+    Raises ValueError if `filepath` is not a QIIME 2 archive, or its
+    metadata cannot be read.
+    """
+    import yaml
+
+    try:
+        with zipfile.ZipFile(filepath) as zf:
+            root = _archive_root(zf.infolist(), filepath)
+            metadata = yaml.safe_load(zf.read(root + '/metadata.yaml'))
+            version = zf.read(root + '/VERSION').decode('utf8')
+    except (zipfile.BadZipFile, KeyError, OSError, yaml.YAMLError,
+            UnicodeDecodeError) as e:
+        raise ValueError("%s is not a QIIME 2 archive" % filepath) from e
+    if not isinstance(metadata, dict) or 'type' not in metadata:
+        raise ValueError("%s has no type in its metadata.yaml" % filepath)
+
+    # e.g. 'QIIME 2\narchive: 5\nframework: 2023.5.1\n'
+    archive_version = None
+    for line in version.splitlines():
+        if line.startswith('archive:'):
+            archive_version = line.split(':', 1)[1].strip()
+    return ArchivePeek(str(metadata.get('uuid', root)), str(metadata['type']),
+                       metadata.get('format'), archive_version)
+
+
+# bytes compressed per task by the multithreaded writer
+DEFLATE_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def write_archive(root, uuid, filepath, compresslevel=6, threads=1):
+    """Zip `root/uuid` as a QIIME 2 archive at `filepath`
+
+    Members are named `uuid/...` and hidden files and directories are
+    skipped, as when qiime2 saves a result. A compresslevel of 0 stores the
+    members uncompressed. With threads > 1, each member is deflated in
+    independent blocks in parallel (as pigz does), which any zip reader
+    inflates as one ordinary deflate stream.
+    """
+    source = os.path.join(root, uuid)
+    if compresslevel == 0:
+        compression = zipfile.ZIP_STORED
+    else:
+        compression = zipfile.ZIP_DEFLATED
+
+    pool = None
+    if threads > 1 and compression == zipfile.ZIP_DEFLATED:
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    try:
+        with zipfile.ZipFile(filepath, mode='w', compression=compression,
+                             compresslevel=compresslevel,
+                             allowZip64=True) as zf:
+            for abspath, arcname in _iter_members(root, source):
+                size = os.path.getsize(abspath)
+                if pool is None or size <= DEFLATE_BLOCK_SIZE:
+                    zf.write(abspath, arcname=arcname)
+                else:
+                    _write_deflated(zf, abspath, arcname, compresslevel,
+                                    pool, threads)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def _iter_members(root, source):
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.startswith('.'):
+                continue
+            abspath = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(abspath, root)
+            yield abspath, relpath.replace(os.sep, '/')
+
+
+def _deflate_block(block, compresslevel, last):
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                  -zlib.MAX_WBITS)
+    # a full flush ends the block byte-aligned and without the final-block
+    # bit, so the next block's independent output can follow it directly
+    return compressor.compress(block) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+
+
+def _write_deflated(zf, abspath, arcname, compresslevel, pool, threads):
+    zinfo = zipfile.ZipInfo.from_file(abspath, arcname=arcname)
+    size = zinfo.file_size
+    # the same decision zipfile makes, so the header is rewritten in place
+    zip64 = size * 1.05 > zipfile.ZIP64_LIMIT
+
+    # The deflated blocks are written as if they were a stored member's
+    # data; the header is then corrected to describe the real member.
+    zinfo.compress_type = zipfile.ZIP_STORED
+    crc = 0
+    with zf.open(zinfo, mode='w', force_zip64=zip64) as dest, \
+            open(abspath, 'rb') as src:
+        pending = collections.deque()
+        remaining = size
+        while remaining > 0 or pending:
+            while remaining > 0 and len(pending) < threads * 2:
+                block = src.read(min(DEFLATE_BLOCK_SIZE, remaining))
+                if not block:
+                    raise OSError("%s changed while being archived" % abspath)
+                remaining -= len(block)
+                crc = zlib.crc32(block, crc)
+                pending.append(pool.submit(
+                    _deflate_block, block, compresslevel, remaining == 0))
+            dest.write(pending.popleft().result())
+
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.file_size = size
+    end = zf.fp.tell()
+    zf.fp.seek(zinfo.header_offset)
+    zf.fp.write(zinfo.FileHeader(zip64))
+    zf.fp.seek(end)
+
+
+def _data_members(zf, filepath):
+    """(member, path relative to data/) of the files of the archive's data"""
+    prefix = _archive_root(zf.infolist(), filepath) + '/data/'
+
+    members = []
+    for info in zf.infolist():
+        if not info.filename.startswith(prefix) or info.is_dir():
+            continue
+        relpath = info.filename[len(prefix):]
+        if relpath.startswith('/') or '..' in relpath.split('/'):
+            raise ValueError("%s has a member outside its data: %s"
+                             % (filepath, info.filename))
+        members.append((info, relpath))
+    return members
+
+
+def extract_data(filepath, destination, threads=1):
+    """Extract the data of an archive into `destination`
+
+    What `Result.export_data` writes without an output format, without
+    extracting and loading the rest of the archive. Existing files are
+    overwritten. Returns the number of files and bytes written.
+    """
+    try:
+        zf = zipfile.ZipFile(filepath)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ValueError("%s is not a QIIME 2 archive" % filepath) from e
+
+    def extract(member):
+        info, target = member
+        # a hardlink from an earlier export would be written through
+        if os.path.lexists(target):
+            os.unlink(target)
+        with zf.open(info) as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return info.file_size
+
+    with zf:
+        members = [(info, os.path.join(destination, *relpath.split('/')))
+                   for info, relpath in _data_members(zf, filepath)]
+        parents = {os.path.dirname(target) for _, target in members}
+        for parent in parents | {destination}:
+            os.makedirs(parent, exist_ok=True)
+        if threads > 1 and len(members) > 1:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=min(threads, len(members))) as pool:
+                sizes = list(pool.map(extract, members))
+        else:
+            sizes = [extract(member) for member in members]
+    return len(sizes), sum(sizes)
+
+
+def tar_data(filepath, tar_filepath):
+    """Stream the data of an archive into an uncompressed tar file
+
+    Returns the number of files and bytes written.
+    """
+    import tarfile
+
+    try:
+        zf = zipfile.ZipFile(filepath)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ValueError("%s is not a QIIME 2 archive" % filepath) from e
+
+    tmp_fp = '%s.%d' % (tar_filepath, os.getpid())
+    with zf, tarfile.open(tmp_fp, 'w', format=tarfile.PAX_FORMAT) as tf:
+        members = _data_members(zf, filepath)
+        for info, relpath in members:
+            tarinfo = tarfile.TarInfo(relpath)
+            tarinfo.size = info.file_size
+            tarinfo.mtime = time.mktime(info.date_time + (0, 0, -1))
+            tarinfo.mode = (info.external_attr >> 16) & 0o777 or 0o644
+            with zf.open(info) as src:
+                tf.addfile(tarinfo, src)
+    os.replace(tmp_fp, tar_filepath)
+    return len(members), sum(info.file_size for info, _ in members)
+
+
+def write_tar(members, tar_filepath):
+    """Write (path, name) `members`, directories recursively, into a tar"""
+    import tarfile
+
+    tmp_fp = '%s.%d' % (tar_filepath, os.getpid())
+    with tarfile.open(tmp_fp, 'w', format=tarfile.PAX_FORMAT) as tf:
+        for path, name in members:
+            tf.add(path, arcname=name)
+    os.replace(tmp_fp, tar_filepath)
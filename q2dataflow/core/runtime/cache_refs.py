@@ -0,0 +1,28 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Telling arguments of the form 'cache:/path/to/cache:key' apart
+
+Nothing here imports qiime2, so that `run` can recognise cache keys before
+handing the task on; loading from and saving into the cache is done by the
+driver's cache_refs module.
+"""
+CACHE_REF_PREFIX = 'cache:'
+
+
+def is_cache_ref(value):
+    return isinstance(value, str) and value.startswith(CACHE_REF_PREFIX)
+
+
+def parse_cache_ref(value):
+    """The (cache path, key) of a 'cache:/path/to/cache:key' argument"""
+    if is_cache_ref(value):
+        path, sep, key = value[len(CACHE_REF_PREFIX):].rpartition(':')
+        if sep and path and key:
+            return path, key
+    raise ValueError("Expected an argument of the form "
+                     "'cache:/path/to/cache:key', not %r" % (value,))
@@ -0,0 +1,142 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Diagnostic files a run can write next to its outputs
+
+Each is switched on by an environment variable (naming the file, for most)
+and is written by a listener of `tracing.span` for the duration of
+`diagnosed_run`.
+Templates made with `--diagnostic NAME` set that variable in the task and
+declare the file as an optional output, named `q2dataflow_NAME`, so that the
+engine collects it.
+
+Consecutive runs in one process (e.g. in a fork-server task or a batch
+worker) add to the same file; the workers of `run-batch` each write their
+own, with the worker's PID before the extension.
+"""
+import os
+import collections
+import contextlib
+import multiprocessing
+
+from q2dataflow.core.runtime import (
+    tracing, resources, io_report, profiling, ledger)
+
+
+class Diagnostic:
+    def __init__(self, name, env_var, filename, description, listener,
+                 env_value=None):
+        self.name = name
+        self.env_var = env_var
+        # may be a glob, when the name of the file depends on the settings
+        self.filename = filename
+        self.description = description
+        # called with the environment variable's value
+        self.listener = listener
+        # what templates set the variable to
+        self.env_value = filename if env_value is None else env_value
+
+    @property
+    def output_name(self):
+        return 'q2dataflow_' + self.name
+
+
+def _sidecar_path(filepath):
+    filepath = os.path.abspath(filepath)
+    if multiprocessing.parent_process() is not None:
+        base, ext = os.path.splitext(filepath)
+        filepath = '%s.%d%s' % (base, os.getpid(), ext)
+    return filepath
+
+
+def _writing_to(listener_cls):
+    return lambda filepath: listener_cls(_sidecar_path(filepath))
+
+
+def _make_profiler(mode):
+    filepath = profiling.PROFILE_FILENAMES.get(mode)
+    if filepath is not None:
+        filepath = _sidecar_path(filepath)
+    return profiling.make_profiler(mode, filepath)
+
+
+DIAGNOSTICS = collections.OrderedDict(
+    (diagnostic.name, diagnostic) for diagnostic in [
+        Diagnostic('trace', tracing.TRACE_ENV_VAR, 'q2dataflow-trace.json',
+                   "Chrome trace-event JSON of the run's stages",
+                   _writing_to(tracing.Tracer)),
+        Diagnostic('resources', resources.RESOURCES_ENV_VAR,
+                   'q2dataflow-resources.json',
+                   "CPU and memory use of the run, per stage and over time",
+                   _writing_to(resources.ResourceSampler)),
+        Diagnostic('io', io_report.IO_REPORT_ENV_VAR, 'q2dataflow-io.json',
+                   "Sizes, times and throughput of the artifacts read and "
+                   "written", _writing_to(io_report.IOAccounting)),
+        Diagnostic('profile', profiling.PROFILE_ENV_VAR,
+                   'q2dataflow-profile.*',
+                   "Profile of the action: a pstats dump or collapsed stacks",
+                   _make_profiler, env_value='sampling'),
+    ])
+
+_listeners = {}
+
+
+def get_diagnostics(settings):
+    """The diagnostics `settings` asks templates to collect"""
+    if not settings:
+        return []
+    return [DIAGNOSTICS[name] for name in settings.get('diagnostics', ())]
+
+
+def get_listeners():
+    """Listeners for the diagnostics switched on in the environment"""
+    listeners = []
+    for diagnostic in DIAGNOSTICS.values():
+        value = os.environ.get(diagnostic.env_var)
+        if not value:
+            continue
+        key = (diagnostic.name, value)
+        if key not in _listeners:
+            _listeners[key] = diagnostic.listener(value)
+        listeners.append(_listeners[key])
+
+    # the one-line summaries need the accounting, if not its report
+    if (os.environ.get(io_report.IO_SUMMARY_ENV_VAR) and not any(
+            isinstance(listener, io_report.IOAccounting)
+            for listener in listeners)):
+        if io_report.IO_SUMMARY_ENV_VAR not in _listeners:
+            _listeners[io_report.IO_SUMMARY_ENV_VAR] = \
+                io_report.IOAccounting()
+        listeners.append(_listeners[io_report.IO_SUMMARY_ENV_VAR])
+
+    # not a file of the task, but a database shared by many
+    ledger_fp = os.environ.get(ledger.LEDGER_ENV_VAR)
+    if ledger_fp:
+        key = (ledger.LEDGER_ENV_VAR, ledger_fp)
+        if key not in _listeners:
+            _listeners[key] = ledger.RunLedger(os.path.abspath(ledger_fp))
+        listeners.append(_listeners[key])
+    return listeners
+
+
+@contextlib.contextmanager
+def diagnosed_run(name, **args):
+    """A span for a whole run, with the diagnostics written when it is done
+
+    Yields the span (None when no diagnostic is on), to which the driver may
+    add what it learns of the run, e.g. the plugin's version.
+    """
+    listeners = get_listeners()
+    for listener in listeners:
+        tracing.add_listener(listener)
+    try:
+        with tracing.span(name, 'run', **args) as current:
+            yield current
+    finally:
+        for listener in reversed(listeners):
+            tracing.remove_listener(listener)
+            listener.write()
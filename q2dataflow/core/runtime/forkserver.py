@@ -0,0 +1,520 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+# Opt-in fork-server for `q2dataflow {wdl,cwl} run`.
+#
+# A supervisor process owns a Unix socket and keeps one warm "zygote" child
+# that has already imported qiime2 (and, optionally, a chosen set of
+# plugins).  For every run request the zygote forks a copy-on-write task
+# process, which takes over the client's stdin/stdout/stderr (passed over the
+# socket) and its working directory and environment, so that the output ends
+# up exactly where the engine expects it.  The zygote is replaced after a
+# configurable number of tasks, when the supervisor receives SIGHUP, or when
+# the conda environment changes on disk.
+#
+# Nothing in this module may import qiime2 at module level: the client side
+# runs in every task and must stay cheap.
+import array
+import contextlib
+import json
+import os
+import select
+import signal
+import socket
+import site
+import struct
+import sys
+import tempfile
+import time
+import traceback
+
+SOCKET_ENV_VAR = 'Q2DATAFLOW_FORKSERVER'
+# not the temporary directory: engines give each task a TMPDIR of its own
+DEFAULT_SOCKET_DIR = '/tmp'
+
+_HEADER = struct.Struct('>I')
+_STATUS = struct.Struct('>i')
+_STDIO_FDS = (0, 1, 2)
+_BACKLOG = 64
+
+
+def get_socket_path(socket_path=None):
+    if socket_path:
+        return socket_path
+
+    socket_path = os.environ.get(SOCKET_ENV_VAR)
+    if socket_path:
+        return socket_path
+
+    return os.path.join(DEFAULT_SOCKET_DIR,
+                        'q2dataflow-forkserver-%d.sock' % os.getuid())
+
+
+# Client ---------------------------------------------------------------------
+def request_run(plugin, action, config, parse_primitives=False,
+                socket_path=None, plan=None):
+    """Run an action in the fork-server, if one is listening.
+
+    Returns the exit status of the forked task, or None if no fork-server
+    could be reached (in which case the caller should run in-process).
+    """
+    sock = _connect(socket_path)
+    if sock is None:
+        return None
+
+    request = {'command': 'run',
+               'plugin': plugin,
+               'action': action,
+               'config': config,
+               'parse_primitives': parse_primitives,
+               'plan': plan,
+               'cwd': os.getcwd(),
+               'env': dict(os.environ)}
+
+    with sock:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            with _stdio_fds() as fds:
+                _send_message(sock, request, fds=fds)
+        except OSError:
+            # the server went away before accepting the task
+            return None
+        status = _recv_exact(sock, _STATUS.size)
+
+    if status is None:
+        print("The q2dataflow fork-server closed the connection before the "
+              "task finished.", file=sys.stderr)
+        return 1
+
+    return _STATUS.unpack(status)[0]
+
+
+def request_control(command, socket_path=None):
+    sock = _connect(socket_path)
+    if sock is None:
+        raise RuntimeError("No q2dataflow fork-server is listening on %r."
+                           % get_socket_path(socket_path))
+
+    with sock:
+        _send_message(sock, {'command': command})
+
+
+@contextlib.contextmanager
+def _stdio_fds():
+    # Engines sometimes run tasks with stdin closed; hand the task /dev/null
+    # instead of failing to send a bad descriptor.
+    opened = []
+    fds = []
+    for fd in _STDIO_FDS:
+        try:
+            os.fstat(fd)
+        except OSError:
+            fd = os.open(os.devnull, os.O_RDWR)
+            opened.append(fd)
+        fds.append(fd)
+    try:
+        yield fds
+    finally:
+        for fd in opened:
+            os.close(fd)
+
+
+def _connect(socket_path):
+    socket_path = get_socket_path(socket_path)
+    if not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        # stale socket file left behind by a server that is gone
+        sock.close()
+        return None
+    return sock
+
+
+# Wire format: a 4-byte length prefix followed by a JSON document.  File
+# descriptors, if any, travel as SCM_RIGHTS ancillary data on the first chunk.
+def _send_message(sock, message, fds=()):
+    payload = json.dumps(message).encode('utf8')
+    data = _HEADER.pack(len(payload)) + payload
+
+    ancillary = []
+    if fds:
+        ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                      array.array('i', fds))]
+    sent = sock.sendmsg([data], ancillary)
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def _recv_message(sock, max_fds=len(_STDIO_FDS)):
+    fds = array.array('i')
+    data, ancdata, _, _ = sock.recvmsg(
+        _HEADER.size, socket.CMSG_LEN(max_fds * fds.itemsize))
+    for level, type_, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+            usable = len(cmsg_data) - (len(cmsg_data) % fds.itemsize)
+            fds.frombytes(cmsg_data[:usable])
+
+    if len(data) < _HEADER.size:
+        rest = _recv_exact(sock, _HEADER.size - len(data))
+        if rest is None:
+            raise ConnectionError("Truncated fork-server request")
+        data += rest
+
+    payload = _recv_exact(sock, _HEADER.unpack(data)[0])
+    if payload is None:
+        raise ConnectionError("Truncated fork-server request")
+
+    return json.loads(payload.decode('utf8')), list(fds)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+# Supervisor -----------------------------------------------------------------
+def serve(socket_path=None, plugins=(), max_tasks_per_child=0,
+          poll_interval=5.0):
+    socket_path = get_socket_path(socket_path)
+    listener = _bind(socket_path)
+
+    state = {'reload': False, 'stop': False, 'replace': False}
+
+    def _on_reload(signum, frame):
+        state['reload'] = True
+
+    def _on_stop(signum, frame):
+        state['stop'] = True
+
+    def _on_retiring(signum, frame):
+        state['replace'] = True
+
+    signal.signal(signal.SIGHUP, _on_reload)
+    signal.signal(signal.SIGTERM, _on_stop)
+    signal.signal(signal.SIGINT, _on_stop)
+    signal.signal(signal.SIGUSR1, _on_retiring)
+
+    stamp = _environment_stamp()
+    zygote = _spawn_zygote(listener, plugins, max_tasks_per_child,
+                           poll_interval)
+    print("q2dataflow fork-server listening on %s (pid %d)"
+          % (socket_path, os.getpid()), file=sys.stderr, flush=True)
+
+    try:
+        while not state['stop']:
+            time.sleep(min(poll_interval, 1.0))
+
+            current_stamp = _environment_stamp()
+            if current_stamp != stamp:
+                print("Environment changed, reloading the fork-server.",
+                      file=sys.stderr, flush=True)
+                stamp = current_stamp
+                state['reload'] = True
+
+            if state['reload']:
+                state['reload'] = False
+                _retire(zygote)
+                zygote = None
+
+            if state['replace']:
+                # the zygote told us it reached its task limit and is
+                # draining; it will exit on its own
+                state['replace'] = False
+                zygote = None
+
+            for pid, status in _reap():
+                if pid == zygote:
+                    if status != 0:
+                        raise RuntimeError(
+                            "The fork-server zygote exited unexpectedly "
+                            "(status %d)." % status)
+                    zygote = None
+
+            if zygote is None and not state['stop']:
+                zygote = _spawn_zygote(listener, plugins, max_tasks_per_child,
+                                       poll_interval)
+    finally:
+        if zygote is not None:
+            _retire(zygote)
+        listener.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        while True:
+            try:
+                os.wait()
+            except ChildProcessError:
+                break
+
+
+def _bind(socket_path):
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)  # stale
+        else:
+            raise RuntimeError("A q2dataflow fork-server is already "
+                               "listening on %r." % socket_path)
+        finally:
+            probe.close()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the socket is created accessible to this user alone, never to others
+    umask = os.umask(0o077)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, 0o600)
+    listener.listen(_BACKLOG)
+    return listener
+
+
+def _environment_stamp():
+    # Installing or removing conda packages adds or removes json records in
+    # conda-meta; pip touches site-packages.  Either changes the mtime.
+    prefix = os.environ.get('CONDA_PREFIX', sys.prefix)
+    watched = [os.path.join(prefix, 'conda-meta')]
+    watched.extend(site.getsitepackages())
+
+    stamp = []
+    for path in watched:
+        try:
+            stamp.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            continue
+    return stamp
+
+
+def _retire(pid):
+    if pid is None:
+        return
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def _reap():
+    reaped = []
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            break
+        reaped.append((pid, _exit_code(status)))
+    return reaped
+
+
+# Zygote ---------------------------------------------------------------------
+def _spawn_zygote(listener, plugins, max_tasks_per_child, poll_interval):
+    pid = os.fork()
+    if pid:
+        return pid
+
+    status = 0
+    try:
+        _zygote_main(listener, plugins, max_tasks_per_child, poll_interval)
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def _zygote_main(listener, plugins, max_tasks_per_child, poll_interval):
+    state = {'retire': False}
+
+    def _on_retire(signum, frame):
+        state['retire'] = True
+
+    signal.signal(signal.SIGTERM, _on_retire)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+
+    runner = _warm_up(plugins)
+
+    listener.settimeout(min(poll_interval, 1.0))
+    pending = {}
+    tasks = 0
+    while not state['retire']:
+        if max_tasks_per_child and tasks >= max_tasks_per_child:
+            os.kill(os.getppid(), signal.SIGUSR1)
+            break
+
+        try:
+            conn, _ = listener.accept()
+        except socket.timeout:
+            conn = None
+        except InterruptedError:
+            conn = None
+
+        if conn is not None:
+            conn.settimeout(None)
+            tasks += _handle(conn, listener, runner, pending)
+
+        _collect(pending, timeout=0)
+
+    listener.close()
+    while pending:
+        _collect(pending, timeout=poll_interval)
+
+
+def _warm_up(plugins):
+    from q2dataflow.core.description_language import interface
+    from q2dataflow.core.description_language.drivers.action import \
+        _get_plugin
+
+    if plugins:
+        for plugin_id in plugins:
+            _get_plugin(plugin_id)
+    else:
+        import qiime2.sdk
+        qiime2.sdk.PluginManager()
+
+    return interface.run
+
+
+def _handle(conn, listener, runner, pending):
+    try:
+        request, fds = _recv_message(conn)
+    except (OSError, ValueError) as e:
+        print("Rejected fork-server request: %s" % e, file=sys.stderr)
+        conn.close()
+        return 0
+
+    command = request.get('command')
+    if command == 'reload':
+        os.kill(os.getppid(), signal.SIGHUP)
+    elif command == 'stop':
+        os.kill(os.getppid(), signal.SIGTERM)
+    elif command == 'run' and len(fds) == len(_STDIO_FDS):
+        pending[_fork_task(request, fds, conn, listener, runner)] = conn
+        for fd in fds:
+            os.close(fd)
+        return 1
+    else:
+        print("Unrecognized fork-server request: %r" % command,
+              file=sys.stderr)
+
+    for fd in fds:
+        os.close(fd)
+    conn.close()
+    return 0
+
+
+def _fork_task(request, fds, conn, listener, runner):
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+    if pid:
+        return pid
+
+    status = 1
+    try:
+        listener.close()
+        conn.close()
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP,
+                       signal.SIGUSR1):
+            signal.signal(signum, signal.SIG_DFL)
+
+        for target, fd in zip(_STDIO_FDS, fds):
+            os.dup2(fd, target)
+            os.close(fd)
+
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        # gettempdir() cached the server's TMPDIR; the task's own applies
+        tempfile.tempdir = None
+
+        runner(request['plugin'], request['action'], request['config'],
+               parse_primitives=request['parse_primitives'],
+               plan=request.get('plan'))
+        status = 0
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status)
+
+
+def _collect(pending, timeout):
+    # Report finished tasks back to their clients, and cancel tasks whose
+    # client went away (e.g. the engine killed the job).
+    for pid, status in _reap_tasks(pending):
+        conn = pending.pop(pid)
+        if conn is None:
+            continue
+        try:
+            conn.sendall(_STATUS.pack(status))
+        except OSError:
+            pass
+        conn.close()
+
+    by_conn = {conn: pid for pid, conn in pending.items() if conn is not None}
+    if not by_conn:
+        if pending:
+            time.sleep(timeout)
+        return
+
+    readable, _, _ = select.select(list(by_conn), [], [], timeout)
+    for conn in readable:
+        try:
+            hung_up = not conn.recv(1, socket.MSG_PEEK)
+        except OSError:
+            hung_up = True
+        if hung_up:
+            pid = by_conn[conn]
+            pending[pid] = None
+            conn.close()
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def _reap_tasks(pending):
+    finished = []
+    for pid in list(pending):
+        try:
+            reaped, status = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            finished.append((pid, 1))
+            continue
+        if reaped:
+            finished.append((pid, _exit_code(status)))
+    return finished
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
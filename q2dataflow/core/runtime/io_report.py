@@ -0,0 +1,116 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Accounting for the artifacts a run reads and writes
+
+A listener of the 'load' and 'save' spans of the drivers: for each artifact
+it records the archive's size, how much data it holds uncompressed, the
+compression ratio, how long the load or save took and the resulting
+throughput. With $Q2DATAFLOW_IO_REPORT naming a file, the records are
+written there as JSON; with $Q2DATAFLOW_IO_SUMMARY set (`run --io-summary`),
+each is also printed as one line of the run's output.
+"""
+import os
+import sys
+import json
+import threading
+
+from q2dataflow.core.runtime.archive import summarize_archive
+
+IO_REPORT_ENV_VAR = 'Q2DATAFLOW_IO_REPORT'
+IO_SUMMARY_ENV_VAR = 'Q2DATAFLOW_IO_SUMMARY'
+
+_MB = 1e6
+
+
+def measure_artifact(filepath):
+    """(archive bytes, uncompressed bytes, UUID) of a .qza/.qzv, or Nones"""
+    try:
+        summary = summarize_archive(filepath)
+        return os.path.getsize(filepath), summary.size, summary.uuid
+    except (OSError, ValueError):
+        # e.g. a cache ref, or a directory
+        return None, None, None
+
+
+class IOAccounting:
+    def __init__(self, filepath=None, echo=None):
+        self.filepath = filepath
+        if echo is None:
+            echo = bool(os.environ.get(IO_SUMMARY_ENV_VAR))
+        self.echo = echo
+        self._runs = []
+        self._records = []
+        self._lock = threading.Lock()
+
+    def begin(self, span):
+        if span.category == 'run':
+            with self._lock:
+                self._records = []
+
+    def end(self, span):
+        if span.category == 'run':
+            with self._lock:
+                self._runs.append({'name': span.name,
+                                   'artifacts': self._records})
+            return
+        if span.category not in ('load', 'save') or span.error is not None:
+            return
+
+        record = self._account(span)
+        with self._lock:
+            self._records.append(record)
+        if self.echo:
+            print(format_record(record), file=sys.stdout, flush=True)
+
+    def _account(self, span):
+        direction = 'input' if span.category == 'load' else 'output'
+        path = str(span.args.get('location') or span.args.get('path'))
+        archive_bytes, data_bytes, uuid = measure_artifact(path)
+        seconds = span.duration
+
+        record = {'direction': direction,
+                  'name': span.name,
+                  'path': path,
+                  'uuid': uuid,
+                  'archive_bytes': archive_bytes,
+                  'data_bytes': data_bytes,
+                  'compression_ratio': None,
+                  'seconds': round(seconds, 4),
+                  'archive_mb_per_s': None,
+                  'data_mb_per_s': None}
+        if archive_bytes:
+            record['compression_ratio'] = round(data_bytes / archive_bytes, 3)
+        if archive_bytes is not None and seconds > 0:
+            record['archive_mb_per_s'] = round(
+                archive_bytes / _MB / seconds, 1)
+            record['data_mb_per_s'] = round(data_bytes / _MB / seconds, 1)
+        return record
+
+    def write(self):
+        if self.filepath is None:
+            return
+        with self._lock:
+            runs = list(self._runs)
+        tmp_fp = '%s.%d' % (self.filepath, os.getpid())
+        with open(tmp_fp, 'w') as fh:
+            json.dump({'runs': runs}, fh, indent=1)
+        os.replace(tmp_fp, self.filepath)
+
+
+def format_record(record):
+    verb = 'Loaded' if record['direction'] == 'input' else 'Saved'
+    if record['archive_bytes'] is None:
+        return '｢io: %s %s in %.2fs｣' % (verb, record['path'],
+                                         record['seconds'])
+    return ('｢io: %s %s: %.1f MB archive, %.1f MB data (%.2fx) in %.2fs, '
+            '%s MB/s｣' % (verb, record['path'],
+                          record['archive_bytes'] / _MB,
+                          record['data_bytes'] / _MB,
+                          record['compression_ratio'] or 0,
+                          record['seconds'],
+                          record['archive_mb_per_s']))
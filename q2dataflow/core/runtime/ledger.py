@@ -0,0 +1,307 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""A record of every run, kept in SQLite
+
+With $Q2DATAFLOW_LEDGER naming a database file, each run of an action or a
+builtin adds a row: the plugin, action and plugin version, a digest of the
+parameters, how long the run and each of its stages took, the peak resident
+memory of the process and of its child processes, and the exit status, with
+the UUID and size of every artifact read and written. The database is in WAL
+mode, so that the tasks of a workflow can add to it concurrently (as long as
+it is on a local filesystem: SQLite's locking does not survive NFS).
+
+The kernel keeps peaks over the life of a process, so a process that runs
+more than one record (e.g. a run-batch worker) resets its own through
+/proc/self/clear_refs where it can, and otherwise records none after its
+first run; its children's peak is recorded only when one of the run's
+children exceeded those of the earlier runs.
+
+`q2dataflow ledger` queries it: the slowest runs, and percentiles of the
+duration and memory of each action, which is what the resources of its tasks
+should be sized by.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import socket
+import resource
+import threading
+
+from q2dataflow.core.runtime.io_report import measure_artifact
+
+LEDGER_ENV_VAR = 'Q2DATAFLOW_LEDGER'
+
+# seconds a writer waits for another to commit
+BUSY_TIMEOUT = 60
+
+# the peak memory of a run: its own, or its largest child's if larger; a run
+# whose own peak is unknown has none
+PEAK_MEMORY = 'MAX(peak_rss_bytes, IFNULL(peak_children_rss_bytes, 0))'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    host TEXT,
+    pid INTEGER,
+    plugin TEXT,
+    action TEXT,
+    plugin_version TEXT,
+    params_digest TEXT,
+    duration_s REAL,
+    peak_rss_bytes INTEGER,
+    peak_children_rss_bytes INTEGER,
+    exit_status INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_action ON runs (plugin, action);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    duration_s REAL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    direction TEXT NOT NULL,
+    name TEXT,
+    path TEXT,
+    uuid TEXT,
+    archive_bytes INTEGER,
+    data_bytes INTEGER
+);
+"""
+
+
+def connect(filepath):
+    import sqlite3
+
+    conn = sqlite3.connect(filepath, timeout=BUSY_TIMEOUT)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def params_digest(params):
+    """A digest of an invocation's parameters, to tell like runs apart"""
+    canonical = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def _max_rss():
+    """High-water marks of this process and its largest waited-for child
+
+    Both are over the life of the process, not just the current run.
+    """
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own * scale, children * scale
+
+
+def _reset_peak_rss():
+    """Restart this process's VmHWM from its current RSS, where Linux can"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+    except OSError:
+        return False
+    return _read_peak_rss() is not None
+
+
+def _read_peak_rss():
+    """VmHWM: the peak RSS since the process started or it was reset"""
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def exit_status(error):
+    if error is None:
+        return 0
+    if isinstance(error, SystemExit):
+        if error.code is None or isinstance(error.code, int):
+            return error.code or 0
+        return 1
+    if isinstance(error, KeyboardInterrupt):
+        return 130
+    return 1
+
+
+class RunLedger:
+    """Records each run in the database at `filepath`
+
+    A listener of `tracing.span`; the drivers name the plugin, action,
+    plugin version and parameter digest in the args of the run span.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._pending = []
+        self._stages = {}
+        self._artifacts = []
+        self._lock = threading.Lock()
+        # a process that has run a record before (e.g. a run-batch worker)
+        # only knows lifetime peaks, unless it can reset its own
+        self._runs = 0
+
+    def begin(self, span):
+        if span.category == 'run':
+            with self._lock:
+                self._started = time.time()
+                self._stages = {}
+                self._artifacts = []
+                self._runs += 1
+                self._peak_reset = _reset_peak_rss()
+                self._children_rss_before = _max_rss()[1]
+
+    def end(self, span):
+        if span.category == 'stage':
+            with self._lock:
+                self._stages[span.name] = (self._stages.get(span.name, 0.0)
+                                           + span.duration)
+        elif span.category in ('load', 'save') and span.error is None:
+            path = str(span.args.get('location') or span.args.get('path'))
+            archive_bytes, data_bytes, uuid = measure_artifact(path)
+            direction = 'input' if span.category == 'load' else 'output'
+            with self._lock:
+                self._artifacts.append((direction, span.name, path, uuid,
+                                        archive_bytes, data_bytes))
+        elif span.category == 'run':
+            self._end_run(span)
+
+    def _end_run(self, span):
+        rss, children_rss = _max_rss()
+        if self._peak_reset:
+            rss = _read_peak_rss()
+        elif self._runs > 1:
+            rss = None
+        # a child of this run only shows if it exceeded the earlier ones
+        if self._runs > 1 and children_rss <= self._children_rss_before:
+            children_rss = None
+        run = {'started': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                        time.gmtime(self._started)),
+               'host': socket.gethostname(),
+               'pid': os.getpid(),
+               'plugin': span.args.get('plugin'),
+               'action': span.args.get('action'),
+               'plugin_version': span.args.get('plugin_version'),
+               'params_digest': span.args.get('params_digest'),
+               'duration_s': round(span.duration, 4),
+               'peak_rss_bytes': rss,
+               'peak_children_rss_bytes': children_rss,
+               'exit_status': exit_status(span.error),
+               'error': None if span.error is None else repr(span.error)}
+        with self._lock:
+            self._pending.append((run, sorted(self._stages.items()),
+                                  self._artifacts))
+            self._stages = {}
+            self._artifacts = []
+
+    def write(self):
+        import sqlite3
+
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            conn = connect(self.filepath)
+            try:
+                with conn:
+                    for run, stages, artifacts in pending:
+                        _insert_run(conn, run, stages, artifacts)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # the run itself went as it went: only its record is lost
+            print('Could not record the run in %s: %s' % (self.filepath, e),
+                  file=sys.stderr)
+
+
+def _insert_run(conn, run, stages, artifacts):
+    columns = list(run)
+    cursor = conn.execute(
+        'INSERT INTO runs (%s) VALUES (%s)'
+        % (', '.join(columns), ', '.join('?' * len(columns))),
+        [run[column] for column in columns])
+    run_id = cursor.lastrowid
+    conn.executemany(
+        'INSERT INTO stages (run_id, name, duration_s) VALUES (?, ?, ?)',
+        [(run_id, name, round(seconds, 4)) for name, seconds in stages])
+    conn.executemany(
+        'INSERT INTO artifacts (run_id, direction, name, path, uuid, '
+        'archive_bytes, data_bytes) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(run_id,) + artifact for artifact in artifacts])
+
+
+def _where(plugin=None, include_failed=False):
+    clauses, values = [], []
+    if plugin is not None:
+        clauses.append('plugin = ?')
+        values.append(plugin)
+    if not include_failed:
+        clauses.append('exit_status = 0')
+    if not clauses:
+        return '', values
+    return ' WHERE ' + ' AND '.join(clauses), values
+
+
+def slowest_runs(conn, limit=20, plugin=None, include_failed=False):
+    where, values = _where(plugin, include_failed)
+    return conn.execute(
+        'SELECT started, plugin, action, duration_s, peak_rss_bytes, '
+        'exit_status FROM runs%s ORDER BY duration_s DESC LIMIT ?' % where,
+        values + [limit]).fetchall()
+
+
+def percentile(values, q):
+    """The `q`th percentile of sorted `values`, interpolating linearly"""
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def action_percentiles(conn, column, plugin=None, include_failed=False):
+    """(plugin, action, runs, p50, p95, max) of `column` for each action
+
+    `column` may be any expression over the columns of `runs`.
+    """
+    where, values = _where(plugin, include_failed)
+    by_action = {}
+    for plugin_id, action_id, value in conn.execute(
+            'SELECT plugin, action, %s FROM runs%s' % (column, where),
+            values):
+        if value is not None:
+            by_action.setdefault((plugin_id, action_id), []).append(value)
+
+    rows = []
+    for (plugin_id, action_id), action_values in sorted(by_action.items()):
+        action_values.sort()
+        rows.append((plugin_id, action_id, len(action_values),
+                     percentile(action_values, 50),
+                     percentile(action_values, 95), action_values[-1]))
+    return rows
+
+
+def format_table(header, rows):
+    cells = [list(header)] + [['-' if v is None else str(v) for v in row]
+                              for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width)
+                               for cell, width in zip(row, widths)).rstrip()
+                     for row in cells)
@@ -0,0 +1,63 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Cutting a single column out of a QIIME 2 metadata TSV
+
+Splitting the rows of a wide file is much cheaper than having qiime2 parse,
+type and validate every one of its columns, when only one is wanted. The
+projected file keeps the ID column, the wanted column and the directives for
+it, and is loaded by qiime2 as usual.
+"""
+import csv
+
+DIRECTIVE_PREFIX = '#q2:'
+# the ID column names qiime2 accepts that start like a comment
+HASH_ID_HEADERS = frozenset(['#SampleID', '#Sample ID', '#OTUID', '#OTU ID'])
+
+
+def project_metadata_tsv(source, destination, column):
+    """Write the ID column and `column` of `source` to `destination`
+
+    Returns False, writing nothing useful, when the projection could differ
+    from loading the whole file (e.g. `column` is missing or repeated, or a
+    row has values but no ID); the caller should then load the whole file,
+    which also reports any problem with it.
+    """
+    try:
+        with open(source, newline='', encoding='utf-8-sig') as src, \
+                open(destination, 'w', newline='', encoding='utf-8') as dst:
+            return _project(csv.reader(src, dialect='excel-tab', strict=True),
+                            csv.writer(dst, dialect='excel-tab'), column)
+    except (csv.Error, UnicodeDecodeError):
+        return False
+
+
+def _project(reader, writer, column):
+    index = None
+    for row in reader:
+        if _is_empty(row):
+            continue
+        first = row[0].strip()
+        if (first.startswith('#') and not first.startswith(DIRECTIVE_PREFIX)
+                and not (index is None and first in HASH_ID_HEADERS)):
+            continue  # a comment
+
+        if index is None:
+            header = [name.strip() for name in row]
+            if header.count(column) != 1 or header.index(column) == 0:
+                return False
+            index = header.index(column)
+        elif not first:
+            return False
+
+        writer.writerow([row[0], row[index] if index < len(row) else ''])
+
+    return index is not None
+
+
+def _is_empty(row):
+    return not any(field.strip() for field in row)
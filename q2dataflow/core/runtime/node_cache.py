@@ -0,0 +1,162 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Bookkeeping for a cache shared by the tasks running on one node
+
+A NodeCache does not store anything itself: the caller fills and removes
+entries, while the NodeCache makes sure that
+
+* an entry is filled by one process, while the others wait for it;
+* an entry in use by a live process is never evicted;
+* the entries stay under a total size, least recently used first out.
+
+Processes coordinate through flock(2) locks in the cache directory. Per
+entry, `<key>.fill` is held exclusively while filling (or evicting) and
+`<key>.use` is held shared by every process using the entry, for the rest
+of its life.
+
+Cached data is loaded as it is found (the metadata cache unpickles it), so
+the cache directory must be this user's alone: it is created with mode
+0o700, and one that another user owns or could write to is refused.
+"""
+import os
+import json
+import time
+import fcntl
+import threading
+import contextlib
+
+INDEX_FILENAME = 'index.json'
+
+
+def make_private_dir(path):
+    """Create the directory `path` for this user alone, if it is missing
+
+    Raises PermissionError if it belongs to another user, or others can
+    write to it.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise PermissionError(
+            "%s must be owned by, and writable only by, the current user to "
+            "be used as a cache, since what is found there is loaded "
+            "as is" % path)
+
+
+class NodeCache:
+    def __init__(self, root, max_bytes=None, remove=None):
+        """`remove(keys)` deletes the evicted entries' data"""
+        self.root = root
+        self.max_bytes = max_bytes
+        self._remove = remove
+        make_private_dir(root)
+        self._locks_dir = os.path.join(root, 'locks')
+        os.makedirs(self._locks_dir, mode=0o700, exist_ok=True)
+        self._index_fp = os.path.join(root, INDEX_FILENAME)
+        self._held = {}
+        self._held_lock = threading.Lock()
+
+    def acquire(self, key, fill):
+        """Hold `key` for the rest of the process, calling `fill()` if absent
+
+        `fill` creates the entry and returns its size in bytes. Returns
+        whether the entry was already present.
+        """
+        with self._flock(key + '.fill', fcntl.LOCK_EX):
+            with self._index() as index:
+                hit = key in index
+                if hit:
+                    index[key]['last_used'] = time.time()
+
+            if not hit:
+                size = fill()
+                with self._index() as index:
+                    index[key] = {'size': size, 'last_used': time.time()}
+
+            # taken before the fill lock is released, so an evicting
+            # process cannot slip in between
+            self._hold(key)
+
+        if not hit:
+            self.evict()
+        return hit
+
+    def discard(self, key):
+        """Forget an entry whose data turned out to be missing or broken"""
+        with self._index() as index:
+            index.pop(key, None)
+
+    def evict(self):
+        if self.max_bytes is None:
+            return
+
+        evicted = []
+        with self._index() as index:
+            total = sum(entry['size'] for entry in index.values())
+            by_age = sorted(index, key=lambda k: index[k]['last_used'])
+            for key in by_age:
+                if total <= self.max_bytes:
+                    break
+                if key in self._held or not self._try_evict(key):
+                    continue
+                total -= index.pop(key)['size']
+                evicted.append(key)
+
+            if evicted and self._remove is not None:
+                self._remove(evicted)
+
+    def _try_evict(self, key):
+        # only an entry nobody is filling or using can go
+        fill_fd = self._open_lock(key + '.fill')
+        use_fd = self._open_lock(key + '.use')
+        try:
+            fcntl.flock(fill_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(use_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        finally:
+            os.close(use_fd)
+            os.close(fill_fd)
+        return True
+
+    def _hold(self, key):
+        with self._held_lock:
+            if key in self._held:
+                return
+            fd = self._open_lock(key + '.use')
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            self._held[key] = fd
+
+    def _open_lock(self, name):
+        return os.open(os.path.join(self._locks_dir, name),
+                       os.O_RDWR | os.O_CREAT, 0o600)
+
+    @contextlib.contextmanager
+    def _flock(self, name, operation):
+        fd = self._open_lock(name)
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            os.close(fd)
+
+    @contextlib.contextmanager
+    def _index(self):
+        with self._flock(INDEX_FILENAME + '.lock', fcntl.LOCK_EX):
+            try:
+                with open(self._index_fp) as fh:
+                    index = json.load(fh)
+            except (OSError, ValueError):
+                index = {}
+
+            yield index
+
+            tmp_fp = '%s.%d' % (self._index_fp, os.getpid())
+            with open(tmp_fp, 'w') as fh:
+                json.dump(index, fh)
+            os.replace(tmp_fp, self._index_fp)
@@ -0,0 +1,97 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""The conversion plan an action's template carries to its runs
+
+Templating an action works out, for each of its inputs and parameters, the
+kind of case it is (see `case.classify_spec`), whether it is a collection
+(a List, Set or Collection) and which synthetic input keys of the template
+hold its argument. The template records that as a plan:
+
+    {"version": 1,
+     "params": {NAME: [KIND, COLLECTION, TYPE], ...},
+     "outputs": [NAME, ...],
+     "keys": {KEY: [NAME, ROLE], ...}}
+
+where "keys" lists only the synthetic keys: any other key is named for its
+parameter or output. A run given a plan maps the keys straight to the
+action's arguments, rejecting any key the plan does not know, and converts
+each argument as its kind says, without scanning the keys for prefixes or
+interrogating the action's types. Arguments whose shape does not fit their
+kind are reported before anything is loaded. Runs of templates without a
+plan do both from the types, as they always have.
+"""
+import json
+
+PLAN_VERSION = 1
+
+# what a synthetic key holds of its parameter's argument
+VALUE = 'value'
+METAFILE = 'metafile'
+COLUMN = 'column'
+COLLECTION_KEYS = 'collection_keys'
+
+ARTIFACT_KINDS = ('input', 'multiple_input')
+METADATA_KINDS = ('column_tabular', 'metadata_tabular')
+COLLECTIONS = ('List', 'Set', 'Collection')
+
+
+def make_plan(params, outputs, keys):
+    return {'version': PLAN_VERSION, 'params': params,
+            'outputs': outputs, 'keys': keys}
+
+
+def dump_plan(plan):
+    return json.dumps(plan, separators=(',', ':'), sort_keys=True)
+
+
+def load_plan(plan):
+    """The plan (or its JSON), or None if there is none this can apply"""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION:
+        return None
+    return plan
+
+
+def get_kinds(plan):
+    """The (kind, collection) of each input and parameter of a plan"""
+    return {name: (kind, collection)
+            for name, (kind, collection, _) in plan['params'].items()}
+
+
+def _expected(kind, collection):
+    """The JSON types an argument of `kind` can be, and their description"""
+    if collection == 'Collection':
+        if kind == 'simple_collection':
+            return (dict,), 'a mapping'
+        return (str,), 'a directory'
+    if collection is not None:
+        return (list,), 'a list'
+    if kind == 'metadata_tabular':
+        return (list,), 'a list of metadata files'
+    if kind == 'column_tabular':
+        return (dict,), 'a metadata file and column'
+    if kind == 'input':
+        return (str,), 'an artifact'
+    return (str, int, float, bool), 'a single value'
+
+
+def check_arguments(arguments, plan):
+    """What is wrong with the shape of each argument, as the plan sees it"""
+    errors = []
+    for name, value in arguments.items():
+        if value is None or name not in plan['params']:
+            continue
+        kind, collection, type_ = plan['params'][name]
+        if kind == 'not_implemented':
+            continue
+        types, description = _expected(kind, collection)
+        if not isinstance(value, types):
+            errors.append(f"{name}: expected {description} for {type_}, "
+                          f"not {type(value).__name__} {value!r:.80}")
+    return errors
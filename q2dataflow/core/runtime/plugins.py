@@ -0,0 +1,76 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Look up installed QIIME 2 plugins from distribution metadata alone
+
+Nothing here imports qiime2 or the plugins themselves.
+"""
+import os
+
+ENTRY_POINT_GROUP = 'qiime2.plugins'
+
+
+def _plugin_id_candidates(entry_point_name):
+    # entry points are usually named after the distribution ('q2-types'),
+    # while plugin ids are the plugin name with dashes replaced ('types')
+    name = entry_point_name.replace('-', '_')
+    candidates = {name}
+    if name.startswith('q2_'):
+        candidates.add(name[len('q2_'):])
+    return candidates
+
+
+def iter_plugin_entry_points():
+    """Yield (entry point, distribution) for each installed plugin"""
+    # a noticeable share of start-up, so only paid by the callers
+    import importlib.metadata
+
+    for dist in importlib.metadata.distributions():
+        for entry_point in dist.entry_points:
+            if entry_point.group != ENTRY_POINT_GROUP:
+                continue
+            # the same exclusion qiime2's PluginManager makes
+            if (entry_point.name == 'dummy-plugin'
+                    and 'QIIMETEST' not in os.environ):
+                continue
+            yield entry_point, dist
+
+
+def _iter_matching_entry_points(plugin_id):
+    plugin_id = plugin_id.replace('-', '_')
+    for entry_point, dist in iter_plugin_entry_points():
+        if plugin_id in _plugin_id_candidates(entry_point.name):
+            yield entry_point, dist
+
+
+def find_plugin_entry_point(plugin_id):
+    """The (entry point, distribution) likely to provide `plugin_id`
+
+    Returns (None, None) if no entry point name matches the id; the match is
+    by name only, so the plugin it loads may still turn out to be another.
+    """
+    for entry_point, dist in _iter_matching_entry_points(plugin_id):
+        return entry_point, dist
+    return None, None
+
+
+def get_distribution_version(plugin_id):
+    """Version of the distribution providing `plugin_id`, or None
+
+    None also when that is ambiguous: several entry points could provide
+    the plugin (e.g. installs in two prefixes, or names that normalise
+    alike) and their distributions disagree on the version. The caller
+    should then load the plugin and ask it.
+    """
+    versions = set()
+    for entry_point, dist in _iter_matching_entry_points(plugin_id):
+        # the distribution the entry point itself belongs to
+        dist = getattr(entry_point, 'dist', None) or dist
+        versions.add(dist.version)
+    if len(versions) != 1:
+        return None
+    return versions.pop()
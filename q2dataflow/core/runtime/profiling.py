@@ -0,0 +1,152 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Profiling the action a run executes
+
+$Q2DATAFLOW_PROFILE (`run --profile`) picks the profiler:
+
+* cprofile: the deterministic profiler of the standard library, written as a
+  pstats dump to q2dataflow-profile.pstats (`python -m pstats` or snakeviz
+  read it). It slows pure-Python code down considerably.
+* sampling: a thread records the stack of every other thread every
+  $Q2DATAFLOW_PROFILE_INTERVAL seconds (default 0.01), written as collapsed
+  stacks to q2dataflow-profile.collapsed (flamegraph.pl, speedscope and
+  Perfetto read them). It costs little, but only sees Python frames.
+
+Only the execute_action stage is profiled, or the whole run with
+$Q2DATAFLOW_PROFILE_SCOPE=run.
+"""
+import os
+import sys
+import time
+import threading
+import collections
+
+PROFILE_ENV_VAR = 'Q2DATAFLOW_PROFILE'
+SCOPE_ENV_VAR = 'Q2DATAFLOW_PROFILE_SCOPE'
+INTERVAL_ENV_VAR = 'Q2DATAFLOW_PROFILE_INTERVAL'
+
+PROFILE_FILENAMES = collections.OrderedDict([
+    ('cprofile', 'q2dataflow-profile.pstats'),
+    ('sampling', 'q2dataflow-profile.collapsed'),
+])
+SCOPES = ('action', 'run')
+
+
+class _Profiler:
+    """Profiles the span the scope names, writing the profile to `filepath`
+
+    Consecutive runs in one process accumulate into one profile.
+    """
+    def __init__(self, filepath, scope=None):
+        self.filepath = filepath
+        if scope is None:
+            scope = os.environ.get(SCOPE_ENV_VAR) or 'action'
+        if scope not in SCOPES:
+            raise ValueError("$%s must be one of %s, not %r"
+                             % (SCOPE_ENV_VAR, ', '.join(SCOPES), scope))
+        self.scope = scope
+
+    def _profiles(self, span):
+        if self.scope == 'run':
+            return span.category == 'run'
+        return span.category == 'stage' and span.name == 'execute_action'
+
+    def begin(self, span):
+        if self._profiles(span):
+            self.start()
+
+    def end(self, span):
+        if self._profiles(span):
+            self.stop()
+
+
+class CProfiler(_Profiler):
+    def __init__(self, filepath, scope=None):
+        import cProfile
+
+        super().__init__(filepath, scope)
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def write(self):
+        self._profile.dump_stats(self.filepath)
+
+
+class SamplingProfiler(_Profiler):
+    def __init__(self, filepath, scope=None, interval=None):
+        super().__init__(filepath, scope)
+        if interval is None:
+            interval = float(os.environ.get(INTERVAL_ENV_VAR) or 0.01)
+        self.interval = interval
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop,
+                                        daemon=True,
+                                        name='q2dataflow-profiler')
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.is_set():
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = [_frame_label(f) for f in _iter_frames(frame)]
+                stack.append(names.get(ident, 'thread-%d' % ident))
+                self._stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def write(self):
+        tmp_fp = '%s.%d' % (self.filepath, os.getpid())
+        with open(tmp_fp, 'w') as fh:
+            for stack, count in self._stacks.most_common():
+                fh.write('%s %d\n' % (stack, count))
+        os.replace(tmp_fp, self.filepath)
+
+
+def _iter_frames(frame):
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    # ';' separates frames in the collapsed format
+    return ('%s.%s:%d' % (module, code.co_name, code.co_firstlineno)
+            ).replace(';', ':')
+
+
+PROFILERS = {'cprofile': CProfiler, 'sampling': SamplingProfiler}
+
+
+def make_profiler(mode, filepath=None):
+    """The profiler for `mode`, writing to its file in the working directory"""
+    if mode not in PROFILERS:
+        raise ValueError("$%s must be one of %s, not %r"
+                         % (PROFILE_ENV_VAR, ', '.join(PROFILERS), mode))
+    if filepath is None:
+        filepath = PROFILE_FILENAMES[mode]
+    return PROFILERS[mode](filepath)
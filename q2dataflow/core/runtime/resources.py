@@ -0,0 +1,233 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Sampling the CPU and memory a run uses
+
+While a run is in progress, a thread samples, every
+$Q2DATAFLOW_RESOURCES_INTERVAL seconds (default 1), the CPU time and the
+resident memory of this process and of its child processes (e.g. the tools
+a plugin runs). The file named by $Q2DATAFLOW_RESOURCES receives, per run, a
+summary (wall and CPU time, mean and most cores busy, peak memory), the same
+per driver stage and the raw timeline, which is what the `runtime` block of
+a WDL task or the ResourceRequirement of a CWL tool should be sized by.
+
+Child processes are only seen on Linux (through /proc); elsewhere the
+samples cover this process and the children it has already waited for.
+"""
+import os
+import json
+import time
+import resource
+import threading
+
+RESOURCES_ENV_VAR = 'Q2DATAFLOW_RESOURCES'
+INTERVAL_ENV_VAR = 'Q2DATAFLOW_RESOURCES_INTERVAL'
+
+_PROC = '/proc'
+_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = resource.getpagesize()
+
+
+class Sample:
+    def __init__(self, wall, cpu, rss, children_rss):
+        self.wall = wall
+        # seconds of CPU used so far, children included
+        self.cpu = cpu
+        self.rss = rss
+        self.children_rss = children_rss
+
+    @property
+    def total_rss(self):
+        return self.rss + self.children_rss
+
+
+def take_sample():
+    wall = time.perf_counter()
+    own = _read_stat(os.getpid())
+    if own is None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (usage.ru_utime + usage.ru_stime
+               + children.ru_utime + children.ru_stime)
+        # the peak, not the current size, which is all there is here
+        rss = usage.ru_maxrss * (1 if os.uname().sysname == 'Darwin'
+                                 else 1024)
+        return Sample(wall, cpu, rss, 0)
+
+    # own time plus that of the children already waited for
+    cpu, rss = own['cpu'] + own['children_cpu'], own['rss']
+    children_rss = 0
+    for child in _iter_descendants(os.getpid()):
+        cpu += child['cpu']
+        children_rss += child['rss']
+    return Sample(wall, cpu, rss, children_rss)
+
+
+def _read_stat(pid):
+    try:
+        with open('%s/%d/stat' % (_PROC, pid)) as fh:
+            stat = fh.read()
+    except OSError:
+        return None
+    # the command name may contain spaces and parentheses
+    fields = stat[stat.rindex(')') + 2:].split()
+    return {'ppid': int(fields[1]),
+            'cpu': (int(fields[11]) + int(fields[12])) / _TICKS,
+            'children_cpu': (int(fields[13]) + int(fields[14])) / _TICKS,
+            'rss': int(fields[21]) * _PAGE_SIZE}
+
+
+def _iter_descendants(pid):
+    try:
+        pids = [int(name) for name in os.listdir(_PROC) if name.isdigit()]
+    except OSError:
+        return
+
+    stats = {}
+    children = {}
+    for other in pids:
+        stat = _read_stat(other)
+        if stat is not None:
+            stats[other] = stat
+            children.setdefault(stat['ppid'], []).append(other)
+
+    pending = list(children.get(pid, ()))
+    while pending:
+        child = pending.pop()
+        yield stats[child]
+        pending.extend(children.get(child, ()))
+
+
+class _Usage:
+    """Peaks and totals over part of a run"""
+    def __init__(self, start):
+        self.start = start
+        self.end = start
+        self.peak_rss = start.rss
+        self.peak_children_rss = start.children_rss
+        self.peak_total_rss = start.total_rss
+        self.max_cores = 0.0
+
+    def add(self, previous, sample):
+        self.end = sample
+        self.peak_rss = max(self.peak_rss, sample.rss)
+        self.peak_children_rss = max(self.peak_children_rss,
+                                     sample.children_rss)
+        self.peak_total_rss = max(self.peak_total_rss, sample.total_rss)
+        self.max_cores = max(self.max_cores, _cores(previous, sample))
+
+    def summary(self):
+        wall = self.end.wall - self.start.wall
+        cpu = max(self.end.cpu - self.start.cpu, 0.0)
+        return {'wall_s': round(wall, 3),
+                'cpu_s': round(cpu, 3),
+                'mean_cores': round(cpu / wall, 2) if wall > 0 else 0.0,
+                'max_cores': round(self.max_cores, 2),
+                'peak_rss_bytes': self.peak_rss,
+                'peak_children_rss_bytes': self.peak_children_rss,
+                'peak_total_rss_bytes': self.peak_total_rss}
+
+
+def _cores(previous, sample):
+    wall = sample.wall - previous.wall
+    if wall <= 0:
+        return 0.0
+    return max(sample.cpu - previous.cpu, 0.0) / wall
+
+
+class ResourceSampler:
+    """Samples resource use during each run, writing it all to `filepath`
+
+    A listener of `tracing.span`: the run span starts and stops the
+    sampling, and peaks are attributed to each stage span.
+    """
+    def __init__(self, filepath, interval=None):
+        self.filepath = filepath
+        if interval is None:
+            interval = float(os.environ.get(INTERVAL_ENV_VAR) or 1.0)
+        self.interval = interval
+        self._runs = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def begin(self, span):
+        if span.category == 'run':
+            self._start_run(span)
+        elif span.category == 'stage' and self._thread is not None:
+            self._sample()
+            with self._lock:
+                self._stages[span.name] = _Usage(self._previous)
+
+    def end(self, span):
+        # not at the end of every load, save or metadata span: each sample
+        # scans /proc for the process's descendants
+        if span.category == 'run':
+            self._sample()
+            self._stop_run(span)
+        elif span.category == 'stage' and self._thread is not None:
+            self._sample()
+            with self._lock:
+                usage = self._stages.pop(span.name, None)
+                if usage is not None:
+                    self._run['stages'][span.name] = usage.summary()
+
+    def _start_run(self, span):
+        start = take_sample()
+        self._run = {'name': span.name,
+                     'args': {k: str(v) for k, v in span.args.items()},
+                     'interval_s': self.interval, 'stages': {},
+                     'timeline_columns': ['t_s', 'cores', 'rss_bytes',
+                                          'children_rss_bytes'],
+                     'timeline': []}
+        self._origin = start.wall
+        self._previous = start
+        self._usage = _Usage(start)
+        self._stages = {}
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop,
+                                        daemon=True,
+                                        name='q2dataflow-resources')
+        self._thread.start()
+
+    def _stop_run(self, span):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._run['summary'] = self._usage.summary()
+        if span.error is not None:
+            self._run['error'] = repr(span.error)
+        self._runs.append(self._run)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        if self._thread is None:
+            return
+        sample = take_sample()
+        with self._lock:
+            previous = self._previous
+            if sample.wall <= previous.wall:
+                return  # overtaken by a sample from another thread
+            self._previous = sample
+            self._usage.add(previous, sample)
+            for usage in self._stages.values():
+                usage.add(previous, sample)
+            self._run['timeline'].append([
+                round(sample.wall - self._origin, 3),
+                round(_cores(previous, sample), 2),
+                sample.rss, sample.children_rss])
+
+    def write(self):
+        with self._lock:
+            runs = list(self._runs)
+        tmp_fp = '%s.%d' % (self.filepath, os.getpid())
+        with open(tmp_fp, 'w') as fh:
+            json.dump({'runs': runs}, fh, separators=(',', ':'))
+        os.replace(tmp_fp, self.filepath)
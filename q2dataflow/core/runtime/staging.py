@@ -0,0 +1,164 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Laying out files under new names without copying them
+
+Importing several files arranges them in a directory under the names their
+format expects. Each file is staged there by the cheapest means that works:
+a hardlink, else a reflink (a copy-on-write clone, where the filesystem has
+them, e.g. btrfs and XFS), else a symlink, and only then a copy. Many files
+are staged on $Q2DATAFLOW_STAGING_THREADS threads (default 8: staging waits
+on the filesystem, not the CPU).
+
+A staging manifest lists the files instead of the inputs naming each: one
+line per file, its path (relative to the manifest's directory, if not
+absolute) and, after a tab, the name to stage it under (its own name, if
+not given). Blank lines and lines starting with '#' are skipped.
+"""
+import os
+import sys
+import shutil
+import collections
+import concurrent.futures
+
+STAGING_THREADS_ENV_VAR = 'Q2DATAFLOW_STAGING_THREADS'
+DEFAULT_STAGING_THREADS = 8
+
+# from linux/fs.h: _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+
+def get_staging_threads():
+    threads = os.environ.get(STAGING_THREADS_ENV_VAR)
+    if threads:
+        return max(int(threads), 1)
+    return DEFAULT_STAGING_THREADS
+
+
+def _hardlink(src, dst):
+    os.link(src, dst)
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith('linux'):
+        raise OSError('reflinks are only made on Linux')
+    import fcntl
+
+    with open(src, 'rb') as src_fh, open(dst, 'xb') as dst_fh:
+        try:
+            fcntl.ioctl(dst_fh.fileno(), _FICLONE, src_fh.fileno())
+        except OSError:
+            dst_fh.close()
+            os.unlink(dst)
+            raise
+
+
+def _symlink(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+
+
+def _copy(src, dst):
+    shutil.copyfile(src, dst)
+
+
+STAGING_METHODS = collections.OrderedDict([
+    ('hardlink', _hardlink),
+    ('reflink', _reflink),
+    ('symlink', _symlink),
+    ('copy', _copy),
+])
+
+
+# for copies that must outlive their source, e.g. a temporary directory
+COPY_METHODS = ('hardlink', 'reflink', 'copy')
+
+
+def stage_file(src, dst, methods=None):
+    """Stage the file `src` at `dst`, returning the method that did"""
+    if methods is None:
+        methods = tuple(STAGING_METHODS)
+    for method in methods:
+        function = STAGING_METHODS[method]
+        try:
+            function(src, dst)
+            return method
+        except (FileNotFoundError, FileExistsError):
+            # no other method will do any better
+            raise
+        except OSError:
+            if method == methods[-1]:
+                raise
+
+
+def _iter_files(src, dst):
+    if not os.path.isdir(src):
+        yield src, dst
+        return
+    for dirpath, _, filenames in os.walk(src):
+        rel = os.path.relpath(dirpath, src)
+        for filename in filenames:
+            yield (os.path.join(dirpath, filename),
+                   os.path.normpath(os.path.join(dst, rel, filename)))
+
+
+def stage_files(files, directory, threads=None, methods=None,
+                replace=False):
+    """Stage each (source, name) of `files` under `directory`
+
+    Sources that are directories are staged file by file. With `replace`,
+    existing files are replaced rather than an error. Returns a Counter of
+    the methods used.
+    """
+    pairs = []
+    for src, name in files:
+        pairs.extend(_iter_files(src, os.path.join(directory, name)))
+    for parent in {os.path.dirname(dst) for _, dst in pairs}:
+        os.makedirs(parent, exist_ok=True)
+
+    def stage(pair):
+        src, dst = pair
+        if replace and os.path.lexists(dst):
+            os.unlink(dst)
+        return stage_file(src, dst, methods)
+
+    if threads is None:
+        threads = get_staging_threads()
+    threads = min(threads, len(pairs))
+    if threads <= 1:
+        return collections.Counter(map(stage, pairs))
+    with concurrent.futures.ThreadPoolExecutor(
+            threads, thread_name_prefix='q2dataflow-staging') as executor:
+        return collections.Counter(executor.map(stage, pairs))
+
+
+def copy_tree(src, dst, threads=None):
+    """Copy the directory `src` into `dst`, hardlinking where possible"""
+    os.makedirs(dst, exist_ok=True)
+    return stage_files([(src, '.')], dst, threads, methods=COPY_METHODS,
+                       replace=True)
+
+
+def read_staging_manifest(filepath):
+    """The (source, name) pairs of a staging manifest"""
+    base = os.path.dirname(os.path.abspath(filepath))
+    files = []
+    with open(filepath) as fh:
+        for n, line in enumerate(fh, start=1):
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) > 2:
+                raise ValueError('Line %d of %s has more than two fields'
+                                 % (n, filepath))
+            src = os.path.join(base, fields[0])
+            name = fields[1] if len(fields) == 2 else os.path.basename(src)
+            if os.path.isabs(name) or '..' in name.split('/'):
+                raise ValueError('Line %d of %s names a file outside the '
+                                 'import: %s' % (n, filepath, name))
+            files.append((src, name))
+    return files
@@ -0,0 +1,167 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Writing tables as TSV a chunk of rows at a time
+
+A BIOM 2.1 (HDF5) table is read straight from its compressed sparse rows,
+one chunk of observations at a time, and written as `biom convert --to-tsv`
+would: a row per observation (feature) and a column per sample. At most
+$Q2DATAFLOW_TABULAR_CHUNK_CELLS cells (default 4M) are held at once,
+whatever the size of the table. Other tables are written from a DataFrame,
+a chunk of its rows at a time.
+
+Either may be subset to some of its rows and columns, given by ID; the
+subset keeps the order of the table.
+"""
+import os
+
+CHUNK_CELLS_ENV_VAR = 'Q2DATAFLOW_TABULAR_CHUNK_CELLS'
+DEFAULT_CHUNK_CELLS = 4 * 1024 * 1024
+
+
+def get_chunk_cells():
+    cells = os.environ.get(CHUNK_CELLS_ENV_VAR)
+    if cells:
+        return max(int(cells), 1)
+    return DEFAULT_CHUNK_CELLS
+
+
+def read_ids(ids):
+    """IDs given as a list, or as a file of one per line, or None"""
+    if ids is None or isinstance(ids, (list, tuple)):
+        return ids
+    with open(ids) as fh:
+        return [line.strip() for line in fh
+                if line.strip() and not line.startswith('#')]
+
+
+def _select(all_ids, wanted, kind):
+    """Indices (in table order) of the `wanted` IDs, or all if None"""
+    import numpy as np
+
+    if wanted is None:
+        return np.arange(len(all_ids))
+    wanted = set(wanted)
+    selected = np.array([i for i, id_ in enumerate(all_ids) if id_ in wanted],
+                        dtype=np.int64)
+    if len(selected) < len(wanted):
+        missing = sorted(wanted - {all_ids[i] for i in selected})
+        raise ValueError("%d %s ID(s) are not in the table: %s%s"
+                         % (len(missing), kind, ', '.join(missing[:10]),
+                            ', ...' if len(missing) > 10 else ''))
+    return selected
+
+
+def _decode(ids):
+    return [id_.decode('utf8') if isinstance(id_, bytes) else str(id_)
+            for id_ in ids]
+
+
+def _write_rows(fh, ids, values):
+    import numpy as np
+
+    if np.all(np.mod(values, 1) == 0):
+        # counts, written as biom writes them
+        row_format = '\t%d.0' * values.shape[1]
+        rows = values.astype(np.int64).tolist()
+    else:
+        row_format = '\t%r' * values.shape[1]
+        rows = values.tolist()
+    for id_, row in zip(ids, rows):
+        fh.write(id_)
+        fh.write(row_format % tuple(row))
+        fh.write('\n')
+
+
+def _iter_chunks(row_idx, indptr, chunk_rows, chunk_cells):
+    """Runs of `row_idx` with at most `chunk_rows` rows, whose stored
+    values (those of the rows left out in between too) fit `chunk_cells`"""
+    start = 0
+    for end in range(1, len(row_idx) + 1):
+        if (end == len(row_idx) or end - start == chunk_rows
+                or (indptr[row_idx[end] + 1] - indptr[row_idx[start]]
+                    > chunk_cells)):
+            yield row_idx[start:end]
+            start = end
+
+
+def write_biom_tsv(biom_fp, output_fp, rows=None, columns=None,
+                   chunk_cells=None):
+    """Write a BIOM 2.1 file's table as TSV, streaming its rows
+
+    Returns the number of rows and columns written.
+    """
+    import h5py
+    import numpy as np
+
+    if chunk_cells is None:
+        chunk_cells = get_chunk_cells()
+
+    with h5py.File(biom_fp, 'r') as table:
+        row_ids = _decode(table['observation/ids'][:])
+        column_ids = _decode(table['sample/ids'][:])
+        row_idx = _select(row_ids, rows, 'observation')
+        column_idx = _select(column_ids, columns, 'sample')
+
+        # position of each table column in the output, or -1 if left out
+        column_map = np.full(len(column_ids), -1, dtype=np.int64)
+        column_map[column_idx] = np.arange(len(column_idx))
+
+        matrix = table['observation/matrix']
+        indptr = matrix['indptr'][:]
+        chunk_rows = max(1, chunk_cells // max(len(column_idx), 1))
+
+        tmp_fp = '%s.%d' % (output_fp, os.getpid())
+        with open(tmp_fp, 'w') as fh:
+            fh.write('# Constructed from biom file\n')
+            fh.write('\t'.join(['#OTU ID'] + [column_ids[i]
+                                              for i in column_idx]))
+            fh.write('\n')
+            for chunk in _iter_chunks(row_idx, indptr, chunk_rows,
+                                      chunk_cells):
+                first, last = chunk[0], chunk[-1] + 1
+                lo, hi = indptr[first], indptr[last]
+                data = matrix['data'][lo:hi]
+                indices = matrix['indices'][lo:hi]
+
+                # the rows of the range that are in the chunk, densified
+                dense = np.zeros((len(chunk), len(column_idx)))
+                positions = np.full(last - first, -1, dtype=np.int64)
+                positions[chunk - first] = np.arange(len(chunk))
+                row_of = np.repeat(np.arange(last - first),
+                                   np.diff(indptr[first:last + 1]))
+                keep = (positions[row_of] >= 0) & (column_map[indices] >= 0)
+                dense[positions[row_of[keep]],
+                      column_map[indices[keep]]] = data[keep]
+
+                _write_rows(fh, [row_ids[i] for i in chunk], dense)
+        os.replace(tmp_fp, output_fp)
+    return len(row_idx), len(column_idx)
+
+
+def write_dataframe_tsv(df, output_fp, rows=None, columns=None,
+                        chunk_cells=None):
+    """Write a DataFrame as TSV, a chunk of its rows at a time
+
+    Returns the number of rows and columns written.
+    """
+    if chunk_cells is None:
+        chunk_cells = get_chunk_cells()
+
+    row_ids = [str(id_) for id_ in df.index]
+    column_ids = [str(id_) for id_ in df.columns]
+    df = df.iloc[_select(row_ids, rows, 'row'),
+                 _select(column_ids, columns, 'column')]
+    chunk_rows = max(1, chunk_cells // max(len(df.columns), 1))
+
+    tmp_fp = '%s.%d' % (output_fp, os.getpid())
+    with open(tmp_fp, 'w') as fh:
+        for start in range(0, max(len(df), 1), chunk_rows):
+            df.iloc[start:start + chunk_rows].to_csv(
+                fh, sep='\t', header=(start == 0), index_label='id')
+    os.replace(tmp_fp, output_fp)
+    return df.shape
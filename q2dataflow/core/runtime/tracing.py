@@ -0,0 +1,114 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Spans of what a run spends its time on, and who is listening for them
+
+The drivers wrap their stages (and each input load and output save) in
+`span()`, which costs nothing unless a listener is registered (see
+`diagnostics`). The Tracer listens when $Q2DATAFLOW_TRACE names a file:
+every span of a run is written to it as Chrome trace-event JSON, which
+Perfetto (ui.perfetto.dev) and chrome://tracing display as a timeline per
+thread.
+"""
+import os
+import json
+import time
+import threading
+import contextlib
+
+TRACE_ENV_VAR = 'Q2DATAFLOW_TRACE'
+
+_listeners = []
+
+
+def add_listener(listener):
+    """Have `listener.begin(span)` and `listener.end(span)` called"""
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+class Span:
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread = threading.current_thread()
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+@contextlib.contextmanager
+def span(name, category='stage', **args):
+    if not _listeners:
+        yield None
+        return
+
+    current = Span(name, category, args)
+    listeners = list(_listeners)
+    for listener in listeners:
+        listener.begin(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = e
+        raise
+    finally:
+        current.end = time.perf_counter()
+        for listener in reversed(listeners):
+            listener.end(current)
+
+
+class Tracer:
+    """Collects spans as trace events and writes them to `filepath`"""
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._pid = os.getpid()
+        # trace timestamps are microseconds since the epoch, so that the
+        # traces of consecutive tasks line up when opened together
+        self._epoch_us = time.time() * 1e6 - time.perf_counter() * 1e6
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def begin(self, span):
+        pass
+
+    def end(self, span):
+        event = {'name': span.name,
+                 'cat': span.category,
+                 'ph': 'X',
+                 'ts': round(self._epoch_us + span.start * 1e6),
+                 'dur': round(span.duration * 1e6),
+                 'pid': self._pid,
+                 'tid': span.thread.ident,
+                 'args': {k: str(v) for k, v in span.args.items()}}
+        if span.error is not None:
+            event['args']['error'] = repr(span.error)
+
+        with self._lock:
+            self._events.append(event)
+            self._threads.setdefault(span.thread.ident, span.thread.name)
+
+    def write(self):
+        with self._lock:
+            events = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid,
+                       'tid': tid, 'args': {'name': name}}
+                      for tid, name in self._threads.items()]
+            events.extend(self._events)
+
+        tmp_fp = '%s.%d' % (self.filepath, os.getpid())
+        with open(tmp_fp, 'w') as fh:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fh)
+        os.replace(tmp_fp, self.filepath)
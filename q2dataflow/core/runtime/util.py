@@ -0,0 +1,59 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import math
+import os
+
+
+def get_available_cores():
+    """Number of cores this process may actually use.
+
+    Respects the CPU affinity mask (set by most schedulers, e.g. SLURM) and a
+    cgroup v2 CPU quota (set by container runtimes), whichever is smaller.
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        cores = os.cpu_count() or 1
+
+    quota = _get_cgroup_cpu_quota()
+    if quota is not None:
+        cores = min(cores, quota)
+
+    return max(cores, 1)
+
+
+def _get_cgroup_cpu_quota():
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as fh:
+            quota, period = fh.read().split()[:2]
+    except (OSError, ValueError):
+        return None
+
+    if quota == 'max':
+        return None
+    return max(math.ceil(int(quota) / int(period)), 1)
+
+
+_SIZE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+                  'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """Bytes in a size such as '500M' or '20G' (binary units), or None"""
+    if size is None or str(size).strip() == '':
+        return None
+
+    size = str(size).strip().upper()
+    if size.endswith('B'):
+        size = size[:-1]
+    suffix = size[-1:] if size[-1:] in _SIZE_SUFFIXES else ''
+    number = size[:len(size) - len(suffix)]
+    try:
+        return int(float(number) * _SIZE_SUFFIXES[suffix])
+    except ValueError:
+        raise ValueError("Not a size: %r" % size)
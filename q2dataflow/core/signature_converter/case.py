@@ -11,6 +11,10 @@ from qiime2.sdk.util import (interrogate_collection_type, is_semantic_type,
                              is_metadata_column_type)
 from qiime2.core.type.signature import ParameterSpec
 
+from q2dataflow.core.runtime.plan import VALUE
+from q2dataflow.core.signature_converter.snapshot import \
+    SnapshotSpec, SnapshotType
+
 QIIME_STR_TYPE = "Str"
 QIIME_BOOL_TYPE = "Bool"
 QIIME_COLLECTION_TYPE = "Collection"
@@ -76,11 +80,17 @@ def arg_is_dictlike(arg):
 class ParamCase:
     dataflow_prefix = None  # Will be defined in child classes
     _dataflow_keywords = []  # Will be defined in child classes
+    # what the input keys hold of the argument, for the conversion plan
+    plan_role = VALUE
+    synth_plan_role = None
+    is_output = False
 
     def __init__(self, name, spec, arg=None, type_name=None,
                  is_optional=None, default=None):
         super(ParamCase, self).__init__()
         self.name = name
+        # the action's name for it, whatever the template calls it
+        self.native_name = name
         self.spec = spec
         self.arg = arg
 
@@ -116,6 +126,14 @@ class ParamCase:
     def _convert_args(self, convertable_args):
         return convertable_args
 
+    def plan_keys(self):
+        """The parameter and role of each input key this case adds"""
+        keys = {self.name: [self.native_name, self.plan_role]}
+        if self.synth_param_name is not None:
+            keys[self.synth_param_name] = [self.native_name,
+                                           self.synth_plan_role]
+        return keys
+
     def inputs(self):
         raise NotImplementedError(self.__class__)
 
@@ -148,15 +166,67 @@ class BaseSimpleCollectionCase(ParamCase):
 
         # If we have a simple collection, we only have a single field
         self.inner_type = spec.qiime_type.fields[0]
-        self.inner_spec = ParameterSpec(self.inner_type, spec.view_type)
+        if isinstance(spec, SnapshotSpec):
+            self.inner_spec = SnapshotSpec(self.inner_type)
+        else:
+            self.inner_spec = ParameterSpec(self.inner_type, spec.view_type)
 
     def inputs(self):
         raise NotImplementedError("inputs")
 
 
+def classify_spec(spec):
+    """The kind of case an input or parameter spec is templated as
+
+    One of 'input', 'multiple_input', 'primitive_union', 'column_tabular',
+    'metadata_tabular', 'bool', 'str', 'numeric', 'simple_collection' or
+    'not_implemented'.  Specs from a snapshot carry their recorded kind.
+    """
+    if isinstance(spec, SnapshotSpec):
+        return spec.case
+
+    style = interrogate_collection_type(spec.qiime_type)
+
+    if is_semantic_type(spec.qiime_type):
+        return 'input' if style.style is None else 'multiple_input'
+
+    if style.style is None:  # not a collection
+        if SignatureConverter.is_union_anywhere(spec.qiime_type):
+            return 'primitive_union'
+        elif is_metadata_type(spec.qiime_type):
+            if is_metadata_column_type(spec.qiime_type):
+                return 'column_tabular'
+            else:
+                return 'metadata_tabular'
+        elif spec.qiime_type.name == 'Bool':
+            return 'bool'
+        elif spec.qiime_type.name == 'Str':
+            return 'str'
+        else:
+            return 'numeric'
+
+    elif style.style == 'simple':  # single type collection
+        return 'simple_collection'
+    elif style.style == 'monomorphic':  # multiple types, but monomorphic
+        return 'not_implemented'
+    elif style.style == 'composite':  # multiple types, but polymorphic
+        return 'simple_collection'
+    elif style.style == 'complex':  # oof
+        return 'not_implemented'
+
+    raise NotImplementedError
+
+
 class SignatureConverter:
+    def __init__(self, cache_refs=False):
+        # artifacts are passed as 'cache:/path/to/cache:key' strings rather
+        # than as files
+        self.cache_refs = cache_refs
+
     @staticmethod
     def is_union_anywhere(qiime_type):
+        if isinstance(qiime_type, SnapshotType):
+            return qiime_type.union_anywhere
         return is_union(qiime_type) or (
             qiime_type.predicate is not None and is_union(qiime_type.predicate))
 
@@ -208,34 +278,20 @@ class SignatureConverter:
                 yield self.get_output_case(name, spec, out_arg)
 
     def _identify_arg_case(self, name, spec, arg):
-        style = interrogate_collection_type(spec.qiime_type)
+        case = classify_spec(spec)
 
-        if is_semantic_type(spec.qiime_type):
+        if case in ('input', 'multiple_input'):
             return self.get_input_case(
-                name, spec, arg, multiple=style.style is not None)
-
-        if style.style is None:  # not a collection
-            if self.is_union_anywhere(spec.qiime_type):
-                return self.get_primitive_union_case(name, spec, arg)
-            elif is_metadata_type(spec.qiime_type):
-                if is_metadata_column_type(spec.qiime_type):
-                    return self.get_column_tabular_case(name, spec, arg)
-                else:
-                    return self.get_metadata_tabular_case(name, spec, arg)
-            elif spec.qiime_type.name == 'Bool':
-                return self.get_bool_case(name, spec, arg)
-            elif spec.qiime_type.name == 'Str':
-                return self.get_str_case(name, spec, arg)
-            else:
-                return self.get_numeric_case(name, spec, arg)
-
-        elif style.style == 'simple':  # single type collection
-            return self.get_simple_collection_case(name, spec, arg)
-        elif style.style == 'monomorphic':  # multiple types, but monomorphic
-            return self.get_not_implemented_case(name, spec, arg)
-        elif style.style == 'composite':  # multiple types, but polymorphic
-            return self.get_simple_collection_case(name, spec, arg)
-        elif style.style == 'complex':  # oof
-            return self.get_not_implemented_case(name, spec, arg)
-
-        raise NotImplementedError
+                name, spec, arg, multiple=case == 'multiple_input')
+
+        get_case = {
+            'primitive_union': self.get_primitive_union_case,
+            'column_tabular': self.get_column_tabular_case,
+            'metadata_tabular': self.get_metadata_tabular_case,
+            'bool': self.get_bool_case,
+            'str': self.get_str_case,
+            'numeric': self.get_numeric_case,
+            'simple_collection': self.get_simple_collection_case,
+            'not_implemented': self.get_not_implemented_case,
+        }[case]
+        return get_case(name, spec, arg)
@@ -0,0 +1,254 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+"""Plugin signatures, serialized so templating need not import the plugins
+
+A snapshot records, for every action, what the templaters read from a
+signature: names, descriptions, defaults, type names and how each parameter
+is templated (see `case.classify_spec`). Loading one gives stand-ins for
+plugins, actions and specs that the signature converters accept in place of
+the real thing.
+"""
+import gzip
+import json
+import types
+
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotType:
+    def __init__(self, name, repr_, union_anywhere=False, members=(),
+                 fields=(), members_repr=None):
+        self.name = name
+        self._repr = repr_
+        self.union_anywhere = union_anywhere
+        # [(name, members_repr), ...] of what iterating the type yields
+        self._iterated = [tuple(member) for member in members]
+        self.fields = tuple(fields)
+        # only ever shown in error messages
+        self.members = members_repr
+
+    def __iter__(self):
+        # as for qiime2 types, a union iterates over its members and
+        # anything else over itself
+        for name, members_repr in self._iterated:
+            yield SnapshotType(name, name, members_repr=members_repr)
+
+    def __repr__(self):
+        return self._repr
+
+    @classmethod
+    def from_dict(cls, description):
+        return cls(description['name'], description['repr'],
+                   union_anywhere=description['union'],
+                   members=description['members'],
+                   fields=[cls.from_dict(f) for f in description['fields']])
+
+
+class SnapshotSpec:
+    NOVALUE = object()
+
+    def __init__(self, qiime_type, case=None, default=NOVALUE,
+                 description=NOVALUE):
+        self.qiime_type = qiime_type
+        self.case = case
+        self.default = default
+        self.description = description
+        self.view_type = None
+
+    def has_default(self):
+        return self.default is not self.NOVALUE
+
+    def has_description(self):
+        return self.description is not self.NOVALUE
+
+    @classmethod
+    def from_dict(cls, description):
+        spec = cls(SnapshotType.from_dict(description['type']),
+                   case=description['case'])
+        if 'default' in description:
+            spec.default = _decode_value(description['default'])
+        if 'description' in description:
+            spec.description = description['description']
+        return spec
+
+
+class SnapshotSignature:
+    def __init__(self, inputs, parameters, outputs):
+        self.inputs = inputs
+        self.parameters = parameters
+        self.outputs = outputs
+
+
+class SnapshotAction:
+    def __init__(self, id, name, description, type, signature):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.type = type
+        self.signature = signature
+        # usage examples cannot be serialized; they are not templated
+        self.examples = {}
+
+
+class SnapshotPlugin:
+    def __init__(self, id, name, version, actions):
+        self.id = id
+        self.name = name
+        self.version = version
+        self.actions = types.MappingProxyType(actions)
+
+
+class Snapshot:
+    def __init__(self, plugins, qiime2_version=None):
+        self.plugins = plugins
+        self.qiime2_version = qiime2_version
+
+    def get_plugin(self, id):
+        try:
+            return self.plugins[id]
+        except KeyError:
+            raise KeyError("No plugin %r in the snapshot" % id)
+
+
+def make_snapshot(plugins):
+    """A JSON-serializable description of the plugins' actions"""
+    from q2dataflow.core.signature_converter.util import get_q2_version
+
+    return {'version': SNAPSHOT_VERSION,
+            'qiime2_version': get_q2_version(),
+            'plugins': [_describe_plugin(plugin) for plugin in
+                        sorted(plugins, key=lambda p: p.id)]}
+
+
+def write_snapshot(plugins, filepath):
+    from q2dataflow.core.signature_converter.util import open_atomic
+
+    blob = json.dumps(make_snapshot(plugins), separators=(',', ':'))
+    if filepath.endswith('.gz'):
+        with open_atomic(filepath, mode='wb') as fh:
+            fh.write(gzip.compress(blob.encode('utf8')))
+    else:
+        with open_atomic(filepath) as fh:
+            fh.write(blob)
+
+
+def load_snapshot(filepath):
+    opener = gzip.open if filepath.endswith('.gz') else open
+    with opener(filepath, 'rt', encoding='utf8') as fh:
+        snapshot = json.load(fh)
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(
+            "%s is a version %r snapshot; this q2dataflow reads version %r. "
+            "Please run `q2dataflow snapshot` again."
+            % (filepath, snapshot.get('version'), SNAPSHOT_VERSION))
+
+    plugins = {}
+    for plugin in snapshot['plugins']:
+        actions = {action['id']: _action_from_dict(action)
+                   for action in plugin['actions']}
+        plugins[plugin['id']] = SnapshotPlugin(
+            plugin['id'], plugin['name'], plugin['version'], actions)
+    return Snapshot(plugins, qiime2_version=snapshot.get('qiime2_version'))
+
+
+def _describe_plugin(plugin):
+    actions = []
+    for action_id in sorted(plugin.actions):
+        try:
+            actions.append(_describe_action(plugin.actions[action_id]))
+        except ValueError as e:
+            raise ValueError("Cannot snapshot %s %s: %s"
+                             % (plugin.id, action_id, e)) from e
+    return {'id': plugin.id,
+            'name': plugin.name,
+            'version': plugin.version,
+            'actions': actions}
+
+
+def _describe_action(action):
+    signature = {
+        section: [_describe_spec(name, spec, section != 'outputs')
+                  for name, spec in getattr(action.signature, section).items()]
+        for section in ('inputs', 'parameters', 'outputs')}
+    return {'id': action.id,
+            'name': action.name,
+            'description': action.description,
+            'type': action.type,
+            'signature': signature}
+
+
+def _describe_spec(name, spec, classify):
+    from q2dataflow.core.signature_converter.case import classify_spec
+
+    description = {'name': name,
+                   'type': _describe_type(spec.qiime_type),
+                   'case': classify_spec(spec) if classify else None}
+    if spec.has_default():
+        try:
+            description['default'] = _encode_value(spec.default)
+        except ValueError as e:
+            raise ValueError("the default of %r: %s" % (name, e)) from e
+    if spec.has_description():
+        description['description'] = spec.description
+    return description
+
+
+def _describe_type(qiime_type):
+    from q2dataflow.core.signature_converter.case import SignatureConverter
+
+    try:
+        members = [[member.name, repr(getattr(member, 'members', None))]
+                   for member in qiime_type]
+    except TypeError:
+        members = []
+    try:
+        union_anywhere = SignatureConverter.is_union_anywhere(qiime_type)
+    except AttributeError:
+        union_anywhere = False
+
+    return {'name': qiime_type.name,
+            'repr': repr(qiime_type),
+            'union': union_anywhere,
+            'members': members,
+            'fields': [_describe_type(field)
+                       for field in getattr(qiime_type, 'fields', ())]}
+
+
+def _encode_value(value):
+    # sets (e.g. the default of a Set parameter) do not survive JSON
+    if isinstance(value, (set, frozenset)):
+        return {'__set__': [_encode_value(v)
+                            for v in sorted(value, key=repr)]}
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _encode_value(v) for k, v in value.items()}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    # a repr would come back as a string, and template a wrong default
+    raise ValueError("%r is not a value a snapshot can hold" % (value,))
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if set(value) == {'__set__'}:
+            return set(_decode_value(v) for v in value['__set__'])
+        return {k: _decode_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode_value(v) for v in value]
+    return value
+
+
+def _action_from_dict(action):
+    signature = SnapshotSignature(*(
+        {spec['name']: SnapshotSpec.from_dict(spec)
+         for spec in action['signature'][section]}
+        for section in ('inputs', 'parameters', 'outputs')))
+    return SnapshotAction(action['id'], action['name'],
+                          action['description'], action['type'], signature)
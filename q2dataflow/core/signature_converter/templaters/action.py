@@ -1,9 +1,15 @@
+from q2dataflow.core.runtime.plan import VALUE, COLLECTIONS, make_plan
+from q2dataflow.core.signature_converter.case import classify_spec
+
+
 class DataflowActionTemplate:
     def __init__(self, plugin_id, action_id, template_id):
         self._plugin_id = plugin_id
         self._action_id = action_id
         self._template_id = template_id
         self._param_cases = []
+        # see make_conversion_plan; templates of builtins have none
+        self.conversion_plan = None
 
     def _make_input_name(self, param_name):
         return param_name
@@ -21,5 +27,27 @@ class DataflowActionTemplate:
 
         return input_dict
 
+    def make_conversion_plan(self):
+        """How a run converts this template's inputs (see `runtime.plan`)"""
+        params, outputs, keys = {}, [], {}
+        for curr_param in self._param_cases:
+            if curr_param.is_output:
+                outputs.append(curr_param.native_name)
+            else:
+                qiime_type = curr_param.spec.qiime_type
+                collection = (qiime_type.name
+                              if qiime_type.name in COLLECTIONS else None)
+                params[curr_param.native_name] = [
+                    classify_spec(curr_param.spec), collection,
+                    repr(qiime_type)]
+
+            for k, v in curr_param.plan_keys().items():
+                # a key named for its parameter, holding all of it, is
+                # not synthetic
+                if v != [k, VALUE]:
+                    keys[k] = v
+
+        return make_plan(params, outputs, keys)
+
     def make_template_str(self):
         raise NotImplementedError("Subclasses must implement this method")
@@ -5,9 +5,10 @@
 #
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
+import os
+import tempfile
+import contextlib
 from datetime import datetime
-from qiime2 import __version__ as q2_version
-import qiime2.sdk as sdk
 import warnings
 
 
@@ -21,12 +22,40 @@ Distributed under the terms of the Modified BSD License. (SPDX: BSD-3-Clause)
 
 
 def get_q2_version():
+    # imported here so that merely importing this module stays cheap
+    from qiime2 import __version__ as q2_version
     return q2_version
 
 
+@contextlib.contextmanager
+def open_atomic(filepath, mode='w'):
+    """Open a temporary file that replaces `filepath` once it is closed
+
+    Readers (and concurrent writers) never see a partially written file.
+    """
+    directory, filename = os.path.split(os.path.abspath(filepath))
+    if os.path.exists(filepath):
+        permissions = os.stat(filepath).st_mode & 0o777
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        permissions = 0o666 & ~umask
+
+    fd, tmp_fp = tempfile.mkstemp(prefix=f'.{filename}.', dir=directory)
+    try:
+        with os.fdopen(fd, mode) as fh:
+            yield fh
+        os.chmod(tmp_fp, permissions)
+        os.replace(tmp_fp, filepath)
+    except BaseException:
+        os.unlink(tmp_fp)
+        raise
+
+
 def get_mystery_stew(desired_filters=None):
     from q2_mystery_stew.plugin_setup import create_plugin
     from q2_mystery_stew.generators import FILTERS
+    import qiime2.sdk as sdk
 
     try:
         pm = sdk.PluginManager.reuse_existing()
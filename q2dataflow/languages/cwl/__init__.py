@@ -1,9 +1,27 @@
-from q2dataflow.languages.cwl.util import get_extension
-from q2dataflow.languages.cwl.templaters import make_action_template, \
-    make_action_template_str, store_action_template_str, BUILTIN_MAKERS
-from q2dataflow.core.signature_converter.case import make_action_template_id
+import importlib
+
+from q2dataflow.languages.cwl.util import get_extension, get_version
 
 COLLECTABLE_TEST_USAGE = None
-__all__ = ["get_extension", "make_action_template_id", "make_action_template",
-           "make_action_template_str", "store_action_template_str",
-           "BUILTIN_MAKERS", "COLLECTABLE_TEST_USAGE"]
\ No newline at end of file
+__all__ = ["get_extension", "get_version", "make_action_template_id",
+           "make_action_template", "make_action_template_str",
+           "store_action_template_str", "BUILTIN_MAKERS",
+           "COLLECTABLE_TEST_USAGE"]
+
+# The templaters (and through them qiime2) are imported on first use, so that
+# importing this package, e.g. for its util module, stays cheap
+_LAZY_ATTRS = {
+    "make_action_template": "q2dataflow.languages.cwl.templaters",
+    "make_action_template_str": "q2dataflow.languages.cwl.templaters",
+    "store_action_template_str": "q2dataflow.languages.cwl.templaters",
+    "BUILTIN_MAKERS": "q2dataflow.languages.cwl.templaters",
+    "make_action_template_id": "q2dataflow.core.signature_converter.case",
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+    globals()[name] = value
+    return value
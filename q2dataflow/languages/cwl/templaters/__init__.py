@@ -10,13 +10,19 @@ import types
 from q2dataflow.languages.cwl.templaters.action import make_action_template, \
     make_action_template_str, store_action_template_str
 from q2dataflow.languages.cwl.templaters.import_export import \
-    make_builtin_import_template_str, make_builtin_export_template_str
+    make_builtin_import_template_str, make_builtin_export_template_str, \
+    make_builtin_materialize_template_str, \
+    make_builtin_qza_to_tabular_template_str
 from q2dataflow.core.signature_converter.case import make_action_template_id
 #
 #
 BUILTIN_MAKERS = types.MappingProxyType({
     make_action_template_id('tools', 'import'): make_builtin_import_template_str,
     make_action_template_id('tools', 'export'): make_builtin_export_template_str,
+    make_action_template_id('tools', 'materialize'):
+        make_builtin_materialize_template_str,
+    make_action_template_id('tools', 'qza_to_tabular'):
+        make_builtin_qza_to_tabular_template_str,
 })
 
 
@@ -10,7 +10,10 @@ import locale
 import yaml
 from q2dataflow.core.signature_converter.templaters.action import \
     DataflowActionTemplate
+from q2dataflow.core.runtime.diagnostics import get_diagnostics
+from q2dataflow.core.runtime.plan import dump_plan
 from q2dataflow.core.signature_converter.case import make_action_template_id
+from q2dataflow.core.signature_converter.util import open_atomic
 from q2dataflow.languages.cwl.templaters.helpers import CwlSignatureConverter
 
 
@@ -29,6 +32,7 @@ class CwlActionTemplate(DataflowActionTemplate):
         # q2dataflow.__main__.run, which take a *json* input file.
         self._template_dict['arguments'] = ['cwl', 'run',
             plugin_id.replace('-', '_'), action_id, 'inputs.json']
+        self._add_diagnostics(get_diagnostics(settings))
 
     def _root_structure(self):
         template_dict = collections.OrderedDict()
@@ -82,12 +86,34 @@ class CwlActionTemplate(DataflowActionTemplate):
 
         return req
 
+    def _add_diagnostics(self, diagnostics):
+        if not diagnostics:
+            return
+
+        requirements = self._template_dict['requirements']
+        env_req = requirements.setdefault('EnvVarRequirement', {'envDef': {}})
+        for diagnostic in diagnostics:
+            env_req['envDef'][diagnostic.env_var] = diagnostic.env_value
+            self._template_dict['outputs'][diagnostic.output_name] = {
+                'type': 'File?',
+                'doc': diagnostic.description,
+                'outputBinding': {'glob': diagnostic.filename}
+            }
+
     def add_param(self, param_case):
         self._param_cases.append(param_case)  # this is what superclass does
         self._template_dict['inputs'].update(param_case.inputs())
         self._template_dict['outputs'].update(param_case.outputs())
 
+    def _add_conversion_plan(self):
+        listing = self._template_dict['requirements'][
+            'InitialWorkDirRequirement']['listing']
+        listing[0]['entry'] = ('{"inputs": $(inputs), "plan": %s}'
+                               % dump_plan(self.conversion_plan))
+
     def make_template_str(self):
+        if self.conversion_plan is not None:
+            self._add_conversion_plan()
         template_str = yaml.dump(
             self._template_dict, default_flow_style=False, indent=2)
         return template_str
@@ -101,11 +127,14 @@ def make_action_template(plugin_id, action, settings, arguments=None):
         plugin_id, action.id, template_id, action.name, action.description,
         settings)
 
-    cwl_sig_converter = CwlSignatureConverter()
+    cwl_sig_converter = CwlSignatureConverter(
+        cache_refs=bool(settings and settings.get("cache_refs")))
     cases = cwl_sig_converter.signature_to_param_cases(
         action.signature, arguments=arguments, include_outputs=True)
     for case in cases:
         cwl_template.add_param(case)
+    if arguments is None:
+        cwl_template.conversion_plan = cwl_template.make_conversion_plan()
 
     return cwl_template
 
@@ -116,7 +145,7 @@ def make_action_template_str(plugin, action, settings):
 
 
 def store_action_template_str(action_template_str, filepath):
-    with open(filepath, 'w') as fh:
+    with open_atomic(filepath) as fh:
         fh.write('#!/usr/bin/env cwl-runner\n\n')
         fh.write(action_template_str)
 
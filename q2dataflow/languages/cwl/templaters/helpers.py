@@ -2,11 +2,9 @@ from q2dataflow.core.signature_converter.case import SignatureConverter, \
     ParamCase, BaseSimpleCollectionCase, QIIME_STR_TYPE, QIIME_BOOL_TYPE, \
     QIIME_COLLECTION_TYPE, get_multiple_qtype_names, \
     get_possibly_str_collection_args, arg_is_dictlike
-
-q2cwl_prefix = "q2cwl_"
-metafile_synth_param_prefix = f"{q2cwl_prefix}metafile_"
-reserved_param_prefix = f"{q2cwl_prefix}reserved_"
-collection_keys_prefix = f"{q2cwl_prefix}collection_keys_"
+from q2dataflow.core.runtime.plan import COLUMN, METAFILE, COLLECTION_KEYS
+from q2dataflow.languages.cwl.util import q2cwl_prefix, \
+    metafile_synth_param_prefix, reserved_param_prefix, collection_keys_prefix
 
 _cwl_file_type = "File"
 _cwl_dir_type = "Directory"
@@ -132,9 +130,11 @@ class CwlParamCase(ParamCase):
 
 class CwlInputCase(CwlParamCase):
     def __init__(self, name, spec, arg=None, type_name=_cwl_file_type,
-                 is_optional=None, default=None, multiple=False):
+                 is_optional=None, default=None, multiple=False,
+                 cache_ref=False):
         super().__init__(name, spec, arg, type_name, is_optional, default)
         self.multiple = multiple
+        self.cache_ref = cache_ref
         self._is_file = (self.spec is not None and
                          self.spec.qiime_type.name != QIIME_COLLECTION_TYPE)
 
@@ -142,7 +142,12 @@ class CwlInputCase(CwlParamCase):
         if self.spec and self.spec.has_default() and self.spec.default is not None:
             raise NotImplementedError("inputs with non-None default values")
 
-        if self._is_file:
+        if self.cache_ref:
+            # a 'cache:/path/to/cache:key' string
+            input_type = _internal_to_cwl_type[QIIME_STR_TYPE]
+            if self.multiple and self._is_file:
+                self._suffix = "[]" + self._suffix
+        elif self._is_file:
             input_type = _cwl_file_type
             if self.multiple:
                 self._suffix = "[]" + self._suffix
@@ -187,10 +192,14 @@ class CwlPrimitiveUnionCase(CwlParamCase):
 
 
 class CwlColumnTabularCase(CwlParamCase):
-    def __init__(self, name, spec, arg=None):
+    plan_role = COLUMN
+    synth_plan_role = METAFILE
+
+    def __init__(self, name, spec, arg=None, cache_ref=False):
         if arg is not None and type(arg) != tuple:
             raise ValueError("Unexpected type of input parameter 'arg'")
         super().__init__(name, spec, arg)
+        self.cache_ref = cache_ref
 
         # Note: here the synth param holds the file name
         # and the "regular" param name holds the column name
@@ -201,9 +210,12 @@ class CwlColumnTabularCase(CwlParamCase):
             raise NotImplementedError(
                 "metadata columns with non-None default values")
 
+        # an artifact-backed metadata source may be a cache key, a string
+        file_type = _internal_to_cwl_type[QIIME_STR_TYPE] if self.cache_ref \
+            else _cwl_file_type
         output_dict = {
             self.synth_param_name: {
-                'type': _cwl_file_type + self._suffix,
+                'type': file_type + self._suffix,
                 'doc': self._make_doc_str(),
             },
             self.name: {
@@ -219,7 +231,8 @@ class CwlColumnTabularCase(CwlParamCase):
         if self.arg is not None:
             # expect argument to be in the form of a tuple where the first
             # element is the file name and the second is the column name
-            file_arg_dict = _make_path_arg_value(self.arg[0], True)
+            file_arg_dict = self.arg[0] if self.cache_ref else \
+                _make_path_arg_value(self.arg[0], True)
             result = {self.synth_param_name: file_arg_dict,
                       self.name: self.arg[1]}
         return result
@@ -249,6 +262,8 @@ class CwlSimpleCollectionCase(CwlParamCase, BaseSimpleCollectionCase):
 
 
 class CwlSimpleCollectionDictCase(CwlSimpleCollectionCase, BaseSimpleCollectionCase):
+    synth_plan_role = COLLECTION_KEYS
+
     def __init__(self, name, spec, arg=None, type_name=None,
                  is_optional=None, default=None):
         super(CwlSimpleCollectionDictCase, self).__init__(
@@ -313,29 +328,50 @@ class CwlSimpleCollectionDictCase(CwlSimpleCollectionCase, BaseSimpleCollectionC
 
 
 class CwlMetadataTabularCase(CwlParamCase):
-    def __init__(self, name, spec, arg=None):
+    plan_role = METAFILE
+
+    def __init__(self, name, spec, arg=None, cache_ref=False):
         if arg is not None and type(arg) != list:
             arg = arg.split()  # default split is on whitespace
         super().__init__(name, spec, arg)
+        self.cache_ref = cache_ref
 
         mod_param_name = self.name.replace(reserved_param_prefix, "")
         self.name = f"{metafile_synth_param_prefix}{mod_param_name}"
 
     def inputs(self):
+        # an artifact-backed metadata source may be a cache key, a string
+        file_type = _internal_to_cwl_type[QIIME_STR_TYPE] if self.cache_ref \
+            else _cwl_file_type
         param_dict = self._make_param_dict_for_type_or_types(
-            [_cwl_file_type, _cwl_file_type + '[]'])
+            [file_type, file_type + '[]'])
         return param_dict
 
     def args(self):
+        if self.cache_ref:
+            return {} if self.arg is None else {self.name: self.arg}
         return _make_file_or_path_arg_dict(self.name, self.arg, True)
 
 
 class CwlOutputCase(CwlParamCase):
+    is_output = True
+
     def __init__(self, name, spec, arg=None, type_name=QIIME_STR_TYPE,
-                 is_optional=None, default=None):
+                 is_optional=None, default=None, cache_ref=False):
         super().__init__(name, spec, arg, type_name, is_optional, default)
+        self.cache_ref = cache_ref
 
     def outputs(self):
+        if self.cache_ref:
+            # the cache key given as input, for the next step to read from
+            return {
+                (self.name + "_ref"): {
+                    'type': _internal_to_cwl_type[QIIME_STR_TYPE],
+                    'doc': self._make_doc_str(),
+                    'outputBinding': {'outputEval': f"$(inputs.{self.name})"}
+                }
+            }
+
         out_binding_str = f"$(inputs.{self.name})"
         type_suffix = "file"
         cwl_type = _cwl_file_type
@@ -398,7 +434,8 @@ class CwlFileAndDirCase(CwlPrimitiveUnionCase):
 
 class CwlSignatureConverter(SignatureConverter):
     def get_input_case(self, name, spec, arg, multiple):
-        return CwlInputCase(name, spec, arg, multiple=multiple)
+        return CwlInputCase(name, spec, arg, multiple=multiple,
+                            cache_ref=self.cache_refs)
 
     def get_str_case(self, name, spec, arg):
         return CwlParamCase(name, spec, arg)
@@ -413,10 +450,12 @@ class CwlSignatureConverter(SignatureConverter):
         return CwlPrimitiveUnionCase(name, spec, arg)
 
     def get_column_tabular_case(self, name, spec, arg):
-        return CwlColumnTabularCase(name, spec, arg)
+        return CwlColumnTabularCase(name, spec, arg,
+                                    cache_ref=self.cache_refs)
 
     def get_metadata_tabular_case(self, name, spec, arg):
-        return CwlMetadataTabularCase(name, spec, arg)
+        return CwlMetadataTabularCase(name, spec, arg,
+                                      cache_ref=self.cache_refs)
 
     def get_simple_collection_case(self, name, spec, arg):
         if spec.qiime_type.name == QIIME_COLLECTION_TYPE:
@@ -425,4 +464,4 @@ class CwlSignatureConverter(SignatureConverter):
             return CwlSimpleCollectionCase(name, spec, arg)
 
     def get_output_case(self, name, spec, arg):
-        return CwlOutputCase(name, spec, arg)
+        return CwlOutputCase(name, spec, arg, cache_ref=self.cache_refs)
@@ -1,6 +1,7 @@
 from q2dataflow.languages.cwl.templaters.action import CwlActionTemplate
-from q2dataflow.languages.cwl.templaters.helpers import CwlStrCase, \
-    CwlInputCase, CwlOutputCase, CwlFileAndDirCase
+from q2dataflow.languages.cwl.templaters.helpers import CwlParamCase, \
+    CwlStrCase, CwlBoolCase, CwlInputCase, CwlOutputCase, CwlFileAndDirCase, \
+    _cwl_file_type
 
 
 def make_builtin_import_template_str(template_id, settings):
@@ -28,5 +29,37 @@ def make_builtin_export_template_str(template_id, settings):
         "output_format", None, is_optional=True, default=None))
     export_template.add_param(CwlFileAndDirCase(
         "output_name", None, is_optional=True, default='data', is_output=True))
+    export_template.add_param(CwlBoolCase("tar", None, is_optional=True))
 
     return export_template.make_template_str()
+
+
+def make_builtin_materialize_template_str(template_id, settings):
+    materialize_template = CwlActionTemplate(
+        "tools", "materialize",
+        'Save a QIIME 2 Cache key as an Artifact', None, template_id,
+        settings)
+    materialize_template.add_param(CwlStrCase(
+        "input_location", None, is_optional=False))
+    materialize_template.add_param(CwlOutputCase(
+        'output_location', None, is_optional=True, default='artifact.qza'))
+
+    return materialize_template.make_template_str()
+
+
+def make_builtin_qza_to_tabular_template_str(template_id, settings):
+    tabular_template = CwlActionTemplate(
+        "tools", "qza_to_tabular",
+        'Write a QIIME 2 Artifact\'s table as TSV', None, template_id,
+        settings)
+    tabular_template.add_param(CwlParamCase(
+        "input_location", None, type_name=_cwl_file_type, is_optional=False))
+    # files of the row and column IDs to keep, one per line
+    tabular_template.add_param(CwlParamCase(
+        "rows", None, type_name=_cwl_file_type, is_optional=True))
+    tabular_template.add_param(CwlParamCase(
+        "columns", None, type_name=_cwl_file_type, is_optional=True))
+    tabular_template.add_param(CwlOutputCase(
+        'output_location', None, is_optional=True, default='table.tsv'))
+
+    return tabular_template.make_template_str()
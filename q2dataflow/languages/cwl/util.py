@@ -1,5 +1,16 @@
 Q2_CWL_VERSION = "0.2.0"
 
+# prefixes of the synthetic input keys the templates add; these are needed
+# both when templating and (cheaply, without templater imports) when running
+q2cwl_prefix = "q2cwl_"
+metafile_synth_param_prefix = f"{q2cwl_prefix}metafile_"
+reserved_param_prefix = f"{q2cwl_prefix}reserved_"
+collection_keys_prefix = f"{q2cwl_prefix}collection_keys_"
+
+
+def get_version():
+    return Q2_CWL_VERSION
+
 
 def get_extension():
     return ".cwl"
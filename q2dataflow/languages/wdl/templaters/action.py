@@ -6,12 +6,15 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 import re
+import json
+from q2dataflow.core.runtime.diagnostics import get_diagnostics
+from q2dataflow.core.runtime.plan import dump_plan
 from q2dataflow.core.signature_converter.case import make_action_template_id
 from q2dataflow.core.signature_converter.util import \
-    get_q2_version, get_copyright
+    get_q2_version, get_copyright, open_atomic
 from q2dataflow.core.signature_converter.templaters.action import \
     DataflowActionTemplate
-from q2dataflow.languages.wdl.util import Q2_WDL_VERSION
+from q2dataflow.languages.wdl.util import Q2_WDL_VERSION, plan_param_name
 from q2dataflow.languages.wdl.templaters.helpers import WdlSignatureConverter
 
 
@@ -24,9 +27,10 @@ def _append_or_extend(content_holder, new_content):
 
 
 class WdlActionTemplate(DataflowActionTemplate):
-    def __init__(self, plugin_id, action_id, template_id):
+    def __init__(self, plugin_id, action_id, template_id, diagnostics=()):
         super().__init__(plugin_id, action_id, template_id)
         self._wkflow_id = f"wkflw_{self._template_id}"
+        self._diagnostics = diagnostics
 
     def _make_input_name(self, param_name):
         return f"{self._wkflow_id}.{param_name}"
@@ -53,6 +57,9 @@ class WdlActionTemplate(DataflowActionTemplate):
 
     def _get_input_declarations(self, delimiter="\n    "):
         result = self._get_delimited_param_str(True, False, delimiter)
+        if self.conversion_plan is not None:
+            result = delimiter.join(
+                [x for x in [result, f"String {plan_param_name}"] if x])
         return result
 
     def _get_input_declarations_w_defaults(self, delimiter="\n        "):
@@ -82,9 +89,34 @@ class WdlActionTemplate(DataflowActionTemplate):
 
         return delimiter.join(input_name_pairs)
 
+    def _get_task_params_assignments(self, delimiter=",\n        "):
+        result = self._get_input_assignments(delimiter=delimiter)
+        if self.conversion_plan is not None:
+            # a JSON string literal is also a WDL one
+            plan_str = json.dumps(dump_plan(self.conversion_plan))
+            result = delimiter.join(
+                [x for x in [result, f"{plan_param_name}: {plan_str}"] if x])
+        return result
+
+    def _get_diagnostic_outputs(self):
+        outputs = []
+        for diagnostic in self._diagnostics:
+            if '*' in diagnostic.filename:
+                outputs.append(f"Array[File] {diagnostic.output_name} = "
+                               f"glob(\"{diagnostic.filename}\")")
+            else:
+                outputs.append(f"File? {diagnostic.output_name} = "
+                               f"\"{diagnostic.filename}\"")
+        return outputs
+
+    def _get_env_assignments(self):
+        return "".join(f"{diagnostic.env_var}={diagnostic.env_value} "
+                       for diagnostic in self._diagnostics)
+
     def _get_outputs(self, delimiter="\n        "):
         result = ""
-        outputs_str = self._get_delimited_param_str(False, False, delimiter)
+        outputs_str = delimiter.join(self._get_param_strs(False, False)
+                                     + self._get_diagnostic_outputs())
         if outputs_str:
             result = f"""output {{
         {outputs_str}
@@ -104,11 +136,11 @@ task {self._template_id} {{
     {self._get_input_declarations_w_defaults()}
 
     {self._template_id}_params task_params = object {{
-        {self._get_input_assignments()}
+        {self._get_task_params_assignments()}
     }}
 
     command {{
-        q2dataflow wdl run {self._plugin_id} {self._action_id} ~{{write_json(task_params)}}
+        {self._get_env_assignments()}q2dataflow wdl run {self._plugin_id} {self._action_id} ~{{write_json(task_params)}}
     }}
 
     {self._get_outputs()}
@@ -141,15 +173,19 @@ workflow {self._wkflow_id} {{
 
 # Required public functions
 def make_action_template(plugin_id, action, settings=None, arguments=None):
-    wdl_sig_converter = WdlSignatureConverter()
+    wdl_sig_converter = WdlSignatureConverter(
+        cache_refs=bool(settings and settings.get("cache_refs")))
     template_id = make_action_template_id(
         plugin_id, action.id, replace_underscores=False)
-    wdl_template = WdlActionTemplate(plugin_id, action.id, template_id)
+    wdl_template = WdlActionTemplate(plugin_id, action.id, template_id,
+                                     diagnostics=get_diagnostics(settings))
 
     cases = wdl_sig_converter.signature_to_param_cases(
         action.signature, arguments=arguments, include_outputs=True)
     for case in cases:
         wdl_template.add_param(case)
+    if arguments is None:
+        wdl_template.conversion_plan = wdl_template.make_conversion_plan()
 
     return wdl_template
 
@@ -172,5 +208,5 @@ def store_action_template_str(action_template_str, filepath):
     commented_str = "# " + "\n# ".join(temp_line_str.split("\n"))
     output_str = "\n".join([commented_str, action_template_str])
 
-    with open(filepath, 'w') as fh:
+    with open_atomic(filepath) as fh:
         fh.write(output_str)
\ No newline at end of file
@@ -5,10 +5,9 @@ from q2dataflow.core.signature_converter.case import SignatureConverter, \
     ParamCase, BaseSimpleCollectionCase, QIIME_STR_TYPE, QIIME_BOOL_TYPE, \
     QIIME_COLLECTION_TYPE, get_multiple_qtype_names, \
     get_possibly_str_collection_args
-
-q2wdl_prefix = "q2wdl_"
-metafile_synth_param_prefix = f"{q2wdl_prefix}metafile_"
-reserved_param_prefix = f"{q2wdl_prefix}reserved_"
+from q2dataflow.core.runtime.plan import COLUMN, METAFILE
+from q2dataflow.languages.wdl.util import q2wdl_prefix, \
+    metafile_synth_param_prefix, reserved_param_prefix
 
 _wdl_file_type = "File"
 _wdl_str_type = "String"
@@ -176,25 +175,28 @@ class WdlParamCase(ParamCase):
 
 class WdlInputCase(WdlParamCase):
     def __init__(self, name, spec, arg=None, type_name=_wdl_file_type,
-                 is_optional=None, default=None, multiple=False):
+                 is_optional=None, default=None, multiple=False,
+                 cache_ref=False):
         super().__init__(
             name, spec, arg, type_name, is_optional, default)
         self.multiple = multiple
+        self.cache_ref = cache_ref
 
     def inputs(self, include_defaults=False):
         if self.default:
             raise NotImplementedError(
                 "inputs with non-None default values")
 
-        if self._is_collection:
+        if self._is_collection and not self.cache_ref:
             warnings.warn(UntestableImplementationWarning(
                 "Unable to test Artifact Collection inputs for WDL "
                 "using miniWDL"))
 
         # if this is a collection of inputs, represent its directory path as a
-        # string (since WDL doesn't currently have a Directory type); otherwise
-        # represent it as a File type
-        curr_type = QIIME_STR_TYPE if self._is_collection else _wdl_file_type
+        # string (since WDL doesn't currently have a Directory type); a cache
+        # key is a string too; otherwise represent it as a File type
+        curr_type = QIIME_STR_TYPE if self._is_collection or self.cache_ref \
+            else _wdl_file_type
 
         if self.multiple and not self._is_collection:
             param = _make_array_input_dec(
@@ -286,10 +288,14 @@ class WdlPrimitiveUnionCase(WdlParamCase):
 
 
 class WdlColumnTabularCase(WdlParamCase):
-    def __init__(self, name, spec, arg=None):
+    plan_role = COLUMN
+    synth_plan_role = METAFILE
+
+    def __init__(self, name, spec, arg=None, cache_ref=False):
         if arg is not None and type(arg) != tuple:
             raise ValueError("Unexpected type of input parameter 'arg'")
         super().__init__(name, spec, arg)
+        self.cache_ref = cache_ref
 
         # Note: here the synth param holds the file name
         # and the "regular" param name holds the column name
@@ -303,8 +309,10 @@ class WdlColumnTabularCase(WdlParamCase):
 
         col_input = _make_basic_input_dec(
             self.name, QIIME_STR_TYPE, self.is_optional, self.default)
-        file_input = _make_file_input_dec(
-            self.synth_param_name, self.is_optional, self.default)
+        # an artifact-backed metadata source may be a cache key, a string
+        file_type = QIIME_STR_TYPE if self.cache_ref else _wdl_file_type
+        file_input = _make_basic_input_dec(
+            self.synth_param_name, file_type, self.is_optional, self.default)
         result = [col_input, file_input]
         return result
 
@@ -359,25 +367,32 @@ class WdlSimpleCollectionCase(BaseSimpleCollectionCase, WdlParamCase):
 
 
 class WdlMetadataTabularCase(WdlParamCase):
-    def __init__(self, name, spec, arg=None):
+    plan_role = METAFILE
+
+    def __init__(self, name, spec, arg=None, cache_ref=False):
         if arg is not None and type(arg) != list:
             arg = arg.split()  # default split is on whitespace
         super().__init__(name, spec, arg)
+        self.cache_ref = cache_ref
 
         mod_param_name = self.name.replace(reserved_param_prefix, "")
         self.name = f"{metafile_synth_param_prefix}{mod_param_name}"
 
     def inputs(self, include_defaults=False):
-        return _make_array_inputs(self.name, _wdl_file_type,
+        file_type = QIIME_STR_TYPE if self.cache_ref else _wdl_file_type
+        return _make_array_inputs(self.name, file_type,
                                   self.is_optional, self.default,
                                   include_defaults=include_defaults)
 
 
 class WdlOutputCase(WdlParamCase):
+    is_output = True
+
     def __init__(self, name, spec, arg=None, type_name=QIIME_STR_TYPE,
-                 is_optional=None, default=None):
+                 is_optional=None, default=None, cache_ref=False):
         super().__init__(
             name, spec, arg, type_name, is_optional, default)
+        self.cache_ref = cache_ref
 
     def inputs(self, include_defaults=False):
         # TODO can outputs have defaults?
@@ -387,7 +402,10 @@ class WdlOutputCase(WdlParamCase):
 
     def outputs(self):
         result = []
-        if not self._is_collection:
+        if self.cache_ref:
+            # the cache key given as input, for the next step to read from
+            result = [f"{_wdl_str_type} {self.name}_ref = \"~{{{self.name}}}\""]
+        elif not self._is_collection:
             file_param_name = self.name + "_file"
             dec_base = _make_file_input_dec(file_param_name, False, None)
             dec_str = f"{dec_base} = \"~{{{self.name}}}\""
@@ -397,7 +415,8 @@ class WdlOutputCase(WdlParamCase):
 
 class WdlSignatureConverter(SignatureConverter):
     def get_input_case(self, name, spec, arg, multiple):
-        return WdlInputCase(name, spec, arg, multiple=multiple)
+        return WdlInputCase(name, spec, arg, multiple=multiple,
+                            cache_ref=self.cache_refs)
 
     def get_str_case(self, name, spec, arg):
         return WdlStrCase(name, spec, arg)
@@ -412,13 +431,15 @@ class WdlSignatureConverter(SignatureConverter):
         return WdlPrimitiveUnionCase(name, spec, arg)
 
     def get_column_tabular_case(self, name, spec, arg):
-        return WdlColumnTabularCase(name, spec, arg)
+        return WdlColumnTabularCase(name, spec, arg,
+                                    cache_ref=self.cache_refs)
 
     def get_metadata_tabular_case(self, name, spec, arg):
-        return WdlMetadataTabularCase(name, spec, arg)
+        return WdlMetadataTabularCase(name, spec, arg,
+                                      cache_ref=self.cache_refs)
 
     def get_simple_collection_case(self, name, spec, arg):
         return WdlSimpleCollectionCase(name, spec, arg)
 
     def get_output_case(self, name, spec, arg):
-        return WdlOutputCase(name, spec, arg)
+        return WdlOutputCase(name, spec, arg, cache_ref=self.cache_refs)
@@ -1,6 +1,6 @@
 from q2dataflow.languages.wdl.templaters.action import WdlActionTemplate
 from q2dataflow.languages.wdl.templaters.helpers import WdlStrCase, \
-    WdlInputCase, WdlOutputCase
+    WdlBoolCase, WdlInputCase, WdlOutputCase
 
 
 def make_builtin_import_template_str(template_id, settings):
@@ -20,6 +20,35 @@ def make_builtin_export_template_str(template_id, settings):
     export_template.add_param(WdlStrCase(
         "output_format", None, is_optional=True, default=None))
     export_template.add_param(WdlStrCase("output_location", None, is_optional=False))
+    export_template.add_param(WdlBoolCase("tar", None, is_optional=True))
 
     export_template_str = export_template.make_template_str()
     return export_template_str
+
+
+def make_builtin_materialize_template_str(template_id, settings):
+    materialize_template = WdlActionTemplate(
+        "tools", "materialize", template_id)
+    materialize_template.add_param(WdlStrCase(
+        "input_location", None, is_optional=False))
+    materialize_template.add_param(WdlOutputCase(
+        "output_location", None, is_optional=False))
+
+    materialize_template_str = materialize_template.make_template_str()
+    return materialize_template_str
+
+
+def make_builtin_qza_to_tabular_template_str(template_id, settings):
+    tabular_template = WdlActionTemplate(
+        "tools", "qza_to_tabular", template_id)
+    tabular_template.add_param(WdlInputCase(
+        "input_location", None, is_optional=False))
+    # files of the row and column IDs to keep, one per line
+    tabular_template.add_param(WdlInputCase("rows", None, is_optional=True))
+    tabular_template.add_param(WdlInputCase(
+        "columns", None, is_optional=True))
+    tabular_template.add_param(WdlOutputCase(
+        "output_location", None, is_optional=False))
+
+    tabular_template_str = tabular_template.make_template_str()
+    return tabular_template_str
@@ -1,5 +1,17 @@
 Q2_WDL_VERSION = "0.2.0"
 
+# prefixes of the synthetic input keys the templates add; these are needed
+# both when templating and (cheaply, without templater imports) when running
+q2wdl_prefix = "q2wdl_"
+metafile_synth_param_prefix = f"{q2wdl_prefix}metafile_"
+reserved_param_prefix = f"{q2wdl_prefix}reserved_"
+# holds the action's conversion plan (see q2dataflow.core.runtime.plan)
+plan_param_name = f"{q2wdl_prefix}plan"
+
+
+def get_version():
+    return Q2_WDL_VERSION
+
 
 def get_extension():
     return ".wdl"
@@ -0,0 +1,223 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import os
+import zipfile
+
+import pytest
+
+import q2dataflow.core.runtime.archive as archive
+
+UUID = '3a7c1b2e-0f4d-4c5e-9a6b-8d7e6f5a4b3c'
+
+
+def _write_files(root, files):
+    for relpath, content in files.items():
+        fp = os.path.join(str(root), *relpath.split('/'))
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        with open(fp, 'wb') as fh:
+            fh.write(content)
+
+
+def _make_result_dir(root, data=None):
+    """A result's directory as qiime2 lays it out before zipping it"""
+    files = {
+        UUID + '/VERSION': b'QIIME 2\narchive: 5\nframework: 2023.5.1\n',
+        UUID + '/metadata.yaml': (
+            b'uuid: ' + UUID.encode('ascii') +
+            b'\ntype: FeatureTable[Frequency]\n'
+            b'format: BIOMV210DirFmt\n'),
+    }
+    for relpath, content in (data or {'feature-table.biom': b'biom'}).items():
+        files[UUID + '/data/' + relpath] = content
+    _write_files(root, files)
+
+
+def _members(filepath):
+    with zipfile.ZipFile(filepath) as zf:
+        assert zf.testzip() is None
+        return {info.filename: zf.read(info) for info in zf.infolist()}
+
+
+@pytest.mark.parametrize('compresslevel', [0, 6])
+def test_written_archive_holds_the_result(tmp_path, compresslevel):
+    _make_result_dir(tmp_path / 'src', {'a.txt': b'a' * 1000,
+                                        'nested/b.txt': b'b'})
+    fp = str(tmp_path / 'result.qza')
+
+    archive.write_archive(str(tmp_path / 'src'), UUID, fp,
+                          compresslevel=compresslevel)
+
+    members = _members(fp)
+    assert sorted(members) == [
+        UUID + '/VERSION', UUID + '/data/a.txt', UUID + '/data/nested/b.txt',
+        UUID + '/metadata.yaml']
+    assert members[UUID + '/data/a.txt'] == b'a' * 1000
+    with zipfile.ZipFile(fp) as zf:
+        compression = zf.getinfo(UUID + '/data/a.txt').compress_type
+    assert compression == (zipfile.ZIP_STORED if compresslevel == 0
+                           else zipfile.ZIP_DEFLATED)
+
+
+def test_hidden_files_are_skipped(tmp_path):
+    _make_result_dir(tmp_path, {'a.txt': b'a', '.hidden': b'h',
+                                '.git/config': b'c'})
+    fp = str(tmp_path / 'result.qza')
+
+    archive.write_archive(str(tmp_path), UUID, fp)
+
+    assert UUID + '/data/a.txt' in _members(fp)
+    assert not any('/.' in name for name in _members(fp))
+
+
+def test_parallel_deflate_is_one_member(tmp_path, monkeypatch):
+    # several blocks, the last one short
+    monkeypatch.setattr(archive, 'DEFLATE_BLOCK_SIZE', 1000)
+    content = os.urandom(2000) + b'compressible ' * 1000
+    _make_result_dir(tmp_path, {'large.bin': content, 'small.txt': b's'})
+    fp = str(tmp_path / 'result.qza')
+
+    archive.write_archive(str(tmp_path), UUID, fp, threads=4)
+
+    members = _members(fp)
+    assert members[UUID + '/data/large.bin'] == content
+    assert members[UUID + '/data/small.txt'] == b's'
+    summary = archive.summarize_archive(fp)
+    assert summary.uuid == UUID
+    assert summary.size == sum(len(c) for c in members.values())
+
+
+def test_summary_does_not_depend_on_compression(tmp_path):
+    _make_result_dir(tmp_path, {'a.txt': b'a' * 1000})
+    stored, deflated = str(tmp_path / 's.qza'), str(tmp_path / 'd.qza')
+
+    archive.write_archive(str(tmp_path), UUID, stored, compresslevel=0)
+    archive.write_archive(str(tmp_path), UUID, deflated, compresslevel=9)
+
+    assert archive.summarize_archive(stored).checksum == \
+        archive.summarize_archive(deflated).checksum
+
+
+def test_summary_of_a_non_archive_is_an_error(tmp_path):
+    fp = tmp_path / 'table.qza'
+    fp.write_bytes(b'not a zip')
+
+    with pytest.raises(ValueError):
+        archive.summarize_archive(str(fp))
+
+
+def _make_archive(tmp_path, data):
+    _make_result_dir(tmp_path / 'src', data)
+    fp = str(tmp_path / 'result.qza')
+    archive.write_archive(str(tmp_path / 'src'), UUID, fp)
+    return fp
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_data_is_extracted(tmp_path, threads):
+    fp = _make_archive(tmp_path, {'a.txt': b'aa', 'nested/b.txt': b'b'})
+    destination = tmp_path / 'exported'
+
+    assert archive.extract_data(fp, str(destination), threads=threads) == \
+        (2, 3)
+    assert (destination / 'a.txt').read_bytes() == b'aa'
+    assert (destination / 'nested' / 'b.txt').read_bytes() == b'b'
+    assert not (destination / 'metadata.yaml').exists()
+
+
+def test_extracting_does_not_write_through_hardlinks(tmp_path):
+    fp = _make_archive(tmp_path, {'a.txt': b'new'})
+    destination = tmp_path / 'exported'
+    destination.mkdir()
+    (tmp_path / 'original.txt').write_bytes(b'old')
+    os.link(str(tmp_path / 'original.txt'), str(destination / 'a.txt'))
+
+    archive.extract_data(fp, str(destination))
+
+    assert (destination / 'a.txt').read_bytes() == b'new'
+    assert (tmp_path / 'original.txt').read_bytes() == b'old'
+
+
+def test_member_outside_the_data_is_an_error(tmp_path):
+    fp = str(tmp_path / 'evil.qza')
+    with zipfile.ZipFile(fp, 'w') as zf:
+        zf.writestr(UUID + '/data/../../escaped.txt', b'x')
+
+    with pytest.raises(ValueError, match='outside its data'):
+        archive.extract_data(fp, str(tmp_path / 'exported'))
+    assert not (tmp_path / 'escaped.txt').exists()
+
+
+def test_extracting_a_non_archive_is_an_error(tmp_path):
+    fp = tmp_path / 'table.qza'
+    fp.write_bytes(b'not a zip')
+
+    with pytest.raises(ValueError):
+        archive.extract_data(str(fp), str(tmp_path / 'exported'))
+
+
+def test_data_is_tarred(tmp_path):
+    import tarfile
+
+    fp = _make_archive(tmp_path, {'a.txt': b'aa', 'nested/b.txt': b'b'})
+    tar_fp = str(tmp_path / 'data.tar')
+
+    assert archive.tar_data(fp, tar_fp) == (2, 3)
+    with tarfile.open(tar_fp) as tf:
+        assert sorted(tf.getnames()) == ['a.txt', 'nested/b.txt']
+        assert tf.extractfile('nested/b.txt').read() == b'b'
+
+
+def test_archive_is_peeked_at(tmp_path):
+    pytest.importorskip('yaml')
+    fp = _make_archive(tmp_path, {'feature-table.biom': b'biom'})
+
+    peek = archive.peek_archive(fp)
+
+    assert peek.uuid == UUID
+    assert peek.type == 'FeatureTable[Frequency]'
+    assert peek.format == 'BIOMV210DirFmt'
+    assert peek.archive_version == '5'
+
+
+def test_visualization_has_no_format(tmp_path):
+    pytest.importorskip('yaml')
+    _write_files(tmp_path / 'src', {
+        UUID + '/VERSION': b'QIIME 2\narchive: 6\nframework: 2023.9.0\n',
+        UUID + '/metadata.yaml': b'uuid: ' + UUID.encode('ascii') +
+        b'\ntype: Visualization\nformat: null\n',
+        UUID + '/data/index.html': b'<html></html>'})
+    fp = str(tmp_path / 'result.qzv')
+    archive.write_archive(str(tmp_path / 'src'), UUID, fp)
+
+    peek = archive.peek_archive(fp)
+
+    assert (peek.type, peek.format, peek.archive_version) == \
+        ('Visualization', None, '6')
+
+
+@pytest.mark.parametrize('metadata', [b'format: BIOMV210DirFmt\n', b'[',
+                                      None])
+def test_peeking_without_a_type_is_an_error(tmp_path, metadata):
+    pytest.importorskip('yaml')
+    fp = str(tmp_path / 'result.qza')
+    with zipfile.ZipFile(fp, 'w') as zf:
+        zf.writestr(UUID + '/VERSION', b'QIIME 2\narchive: 5\n')
+        if metadata is not None:
+            zf.writestr(UUID + '/metadata.yaml', metadata)
+
+    with pytest.raises(ValueError):
+        archive.peek_archive(fp)
+
+
+def test_peeking_at_a_non_archive_is_an_error(tmp_path):
+    pytest.importorskip('yaml')
+    fp = tmp_path / 'table.qza'
+    fp.write_bytes(b'not a zip')
+
+    with pytest.raises(ValueError):
+        archive.peek_archive(str(fp))
@@ -0,0 +1,49 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import pytest
+
+from q2dataflow.__main__ import _make_metadata_param
+from q2dataflow.core.runtime.cache_refs import is_cache_ref, parse_cache_ref
+
+
+def test_cache_ref_is_recognised():
+    assert is_cache_ref('cache:/data/cache:table')
+    assert not is_cache_ref('/data/table.qza')
+    assert not is_cache_ref(None)
+
+
+def test_cache_ref_is_parsed():
+    assert parse_cache_ref('cache:/data/cache:table') == \
+        ('/data/cache', 'table')
+
+
+def test_key_follows_the_last_colon():
+    assert parse_cache_ref('cache:/data/a:b/cache:table') == \
+        ('/data/a:b/cache', 'table')
+
+
+@pytest.mark.parametrize('value', [
+    '/data/table.qza', 'cache:', 'cache:/data/cache', 'cache:/data/cache:',
+    'cache::table', None])
+def test_malformed_cache_ref_is_an_error(value):
+    with pytest.raises(ValueError):
+        parse_cache_ref(value)
+
+
+def test_metadata_from_a_cache_is_an_artifact():
+    assert _make_metadata_param('cache:/data/cache:md', 'col') == \
+        {'type': 'qza', 'source': 'cache:/data/cache:md', 'column': 'col'}
+
+
+def test_metadata_type_is_its_extension():
+    assert _make_metadata_param('/data/md.tsv', None) == \
+        {'type': 'tsv', 'source': '/data/md.tsv', 'column': None}
+    with pytest.raises(ValueError):
+        _make_metadata_param('/data/md.csv', None)
+    with pytest.raises(ValueError):
+        _make_metadata_param('cache:/data/cache', None)
@@ -0,0 +1,114 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import os
+import socket
+import stat
+import threading
+
+import pytest
+
+from q2dataflow.core.runtime.forkserver import (
+    SOCKET_ENV_VAR, get_socket_path, _bind, _HEADER, _send_message,
+    _recv_message)
+
+
+@pytest.fixture
+def sockets():
+    client, server = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client, server:
+        yield client, server
+
+
+def test_message_round_trip(sockets):
+    client, server = sockets
+    message = {'command': 'run', 'plugin': 'types', 'config': {'x': [1, 2]},
+               'plan': None}
+
+    _send_message(client, message)
+
+    assert _recv_message(server) == (message, [])
+
+
+def test_message_carries_fds(sockets):
+    client, server = sockets
+    read_fd, write_fd = os.pipe()
+    try:
+        _send_message(client, {'command': 'run'}, fds=[write_fd])
+        message, fds = _recv_message(server)
+
+        assert message == {'command': 'run'}
+        assert len(fds) == 1
+        # a duplicate of the sent descriptor, writing into the same pipe
+        os.write(fds[0], b'through the socket')
+        os.close(fds[0])
+        assert os.read(read_fd, 64) == b'through the socket'
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_large_message_is_reassembled(sockets):
+    client, server = sockets
+    # larger than a socket buffer, so it is sent and received in pieces
+    message = {'config': {'ids': ['sample-%d' % i for i in range(100000)]}}
+
+    sender = threading.Thread(target=_send_message, args=(client, message))
+    sender.start()
+    received, fds = _recv_message(server)
+    sender.join()
+
+    assert received == message
+    assert fds == []
+
+
+def test_truncated_payload_is_an_error(sockets):
+    client, server = sockets
+    client.sendall(_HEADER.pack(100) + b'{"command": ')
+    client.shutdown(socket.SHUT_WR)
+
+    with pytest.raises(ConnectionError):
+        _recv_message(server)
+
+
+def test_truncated_header_is_an_error(sockets):
+    client, server = sockets
+    client.sendall(b'\x00\x00')
+    client.shutdown(socket.SHUT_WR)
+
+    with pytest.raises(ConnectionError):
+        _recv_message(server)
+
+
+def test_default_socket_path_ignores_tmpdir(monkeypatch, tmp_path):
+    monkeypatch.delenv(SOCKET_ENV_VAR, raising=False)
+    default = get_socket_path()
+    monkeypatch.setenv('TMPDIR', str(tmp_path))
+
+    assert get_socket_path() == default
+    assert not default.startswith(str(tmp_path))
+
+
+def test_socket_path_is_configurable(monkeypatch):
+    monkeypatch.setenv(SOCKET_ENV_VAR, '/run/q2dataflow.sock')
+
+    assert get_socket_path() == '/run/q2dataflow.sock'
+    assert get_socket_path('/given.sock') == '/given.sock'
+
+
+def test_socket_is_private(tmp_path):
+    socket_path = str(tmp_path / 'forkserver.sock')
+    umask = os.umask(0)
+    try:
+        listener = _bind(socket_path)
+    finally:
+        os.umask(umask)
+
+    with listener:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        with pytest.raises(RuntimeError):
+            _bind(socket_path)
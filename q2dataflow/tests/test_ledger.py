@@ -0,0 +1,147 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import os
+import types
+
+import pytest
+
+import q2dataflow.core.runtime.ledger as ledger
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = ledger.connect(str(tmp_path / 'ledger.db'))
+    yield conn
+    conn.close()
+
+
+def _add_run(conn, plugin, action, duration_s, peak_rss_bytes=None,
+             exit_status=0, peak_children_rss_bytes=None):
+    run = {'started': '2023-06-01T00:00:00Z', 'plugin': plugin,
+           'action': action, 'duration_s': duration_s,
+           'peak_rss_bytes': peak_rss_bytes,
+           'peak_children_rss_bytes': peak_children_rss_bytes,
+           'exit_status': exit_status}
+    with conn:
+        ledger._insert_run(conn, run, [], [])
+
+
+@pytest.mark.parametrize('q, expected', [
+    (0, 1), (50, 2.5), (95, 3.85), (100, 4)])
+def test_percentile_interpolates(q, expected):
+    assert ledger.percentile([1, 2, 3, 4], q) == pytest.approx(expected)
+
+
+def test_percentile_of_one_or_no_values():
+    assert ledger.percentile([7], 95) == 7
+    assert ledger.percentile([], 50) is None
+
+
+def test_percentiles_are_per_action(conn):
+    for duration in [4, 1, 3, 2]:
+        _add_run(conn, 'dada2', 'denoise_paired', duration)
+    _add_run(conn, 'feature_table', 'summarize', 10)
+
+    assert ledger.action_percentiles(conn, 'duration_s') == [
+        ('dada2', 'denoise_paired', 4, 2.5, pytest.approx(3.85), 4),
+        ('feature_table', 'summarize', 1, 10, 10, 10)]
+
+
+def test_failed_runs_are_left_out_unless_asked_for(conn):
+    _add_run(conn, 'dada2', 'denoise_paired', 1)
+    _add_run(conn, 'dada2', 'denoise_paired', 100, exit_status=1)
+
+    assert ledger.action_percentiles(conn, 'duration_s') == [
+        ('dada2', 'denoise_paired', 1, 1, 1, 1)]
+    assert ledger.action_percentiles(
+        conn, 'duration_s', include_failed=True)[0][2] == 2
+
+
+def test_percentiles_of_one_plugin(conn):
+    _add_run(conn, 'dada2', 'denoise_paired', 1)
+    _add_run(conn, 'feature_table', 'summarize', 2)
+
+    assert ledger.action_percentiles(conn, 'duration_s', plugin='dada2') == [
+        ('dada2', 'denoise_paired', 1, 1, 1, 1)]
+
+
+def test_unmeasured_runs_are_not_counted(conn):
+    _add_run(conn, 'dada2', 'denoise_paired', 1, peak_rss_bytes=2048)
+    _add_run(conn, 'dada2', 'denoise_paired', 2)
+
+    assert ledger.action_percentiles(conn, 'peak_rss_bytes / 1024') == [
+        ('dada2', 'denoise_paired', 1, 2, 2, 2)]
+
+
+def test_slowest_runs_come_first(conn):
+    for duration in [1, 3, 2]:
+        _add_run(conn, 'dada2', 'denoise_paired', duration)
+
+    assert [row[3] for row in ledger.slowest_runs(conn, limit=2)] == [3, 2]
+
+
+@pytest.mark.parametrize('error, expected', [
+    (None, 0), (SystemExit(), 0), (SystemExit(2), 2), (SystemExit('no'), 1),
+    (KeyboardInterrupt(), 130), (ValueError(), 1)])
+def test_exit_status(error, expected):
+    assert ledger.exit_status(error) == expected
+
+
+def test_params_digest_ignores_key_order():
+    assert ledger.params_digest({'a': 1, 'b': [2]}) == \
+        ledger.params_digest({'b': [2], 'a': 1})
+    assert ledger.params_digest({'a': 1}) != ledger.params_digest({'a': 2})
+
+
+def test_peak_memory_is_the_larger_of_own_and_children(conn):
+    _add_run(conn, 'dada2', 'denoise_paired', 1, peak_rss_bytes=10,
+             peak_children_rss_bytes=30)
+    _add_run(conn, 'dada2', 'denoise_paired', 1, peak_rss_bytes=20)
+    _add_run(conn, 'dada2', 'denoise_paired', 1, peak_children_rss_bytes=40)
+
+    assert ledger.action_percentiles(conn, ledger.PEAK_MEMORY) == [
+        ('dada2', 'denoise_paired', 2, 25, pytest.approx(29.5), 30)]
+
+
+def _record_runs(tmp_path, allocations):
+    run_ledger = ledger.RunLedger(str(tmp_path / 'ledger.db'))
+    for n_bytes in allocations:
+        span = types.SimpleNamespace(
+            category='run', name='run', error=None, duration=0.1,
+            args={'plugin': 'dada2', 'action': 'denoise_paired'})
+        run_ledger.begin(span)
+        allocated = bytearray(n_bytes)
+        allocated[::4096] = b'x' * len(allocated[::4096])
+        del allocated
+        run_ledger.end(span)
+    run_ledger.write()
+
+    conn = ledger.connect(str(tmp_path / 'ledger.db'))
+    try:
+        return [row[0] for row in conn.execute(
+            'SELECT peak_rss_bytes FROM runs ORDER BY id')]
+    finally:
+        conn.close()
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/clear_refs'),
+                    reason="needs Linux's /proc/self/clear_refs")
+def test_later_runs_have_their_own_peak(tmp_path):
+    big, small = _record_runs(tmp_path, [64 * 1024 ** 2, 0])
+
+    assert big > 64 * 1024 ** 2
+    assert small < big - 32 * 1024 ** 2
+
+
+def test_later_runs_without_a_reset_have_no_peak(tmp_path, monkeypatch):
+    monkeypatch.setattr(ledger, '_reset_peak_rss', lambda: False)
+
+    first, second = _record_runs(tmp_path, [0, 0])
+
+    assert first > 0
+    assert second is None
@@ -0,0 +1,47 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import pytest
+
+from q2dataflow.core.description_language.manifest import action_selected
+
+
+@pytest.mark.parametrize('patterns', [None, []])
+def test_no_patterns_select_everything(patterns):
+    assert action_selected(patterns, 'feature_table', 'summarize')
+
+
+@pytest.mark.parametrize('pattern', [
+    'summarize', 'summ*', 'feature_table.summarize', 'feature-table.*',
+    '*.summarize', 'feature-table.summ?rize'])
+def test_action_matches(pattern):
+    assert action_selected([pattern], 'feature_table', 'summarize')
+
+
+def test_dashes_and_underscores_are_interchangeable():
+    assert action_selected(['core-metrics*'], 'diversity',
+                           'core_metrics_phylogenetic')
+    assert action_selected(['core_metrics*'], 'diversity',
+                           'core_metrics_phylogenetic')
+
+
+@pytest.mark.parametrize('pattern', [
+    'summary', 'taxa.*', 'feature_table', 'SUMMARIZE', 'summarize.*'])
+def test_action_does_not_match(pattern):
+    assert not action_selected([pattern], 'feature_table', 'summarize')
+
+
+def test_any_pattern_selects():
+    assert action_selected(['taxa.*', '*.summarize'], 'feature_table',
+                           'summarize')
+
+
+def test_builtin_template_id_matches():
+    assert action_selected(['qiime2_tools_qza-to-*'], 'tools',
+                           'qza_to_tabular', 'qiime2_tools_qza-to-tabular')
+    assert not action_selected(['qiime2_tools_qza-to-*'], 'tools',
+                               'qza_to_tabular')
@@ -0,0 +1,70 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import pytest
+
+from q2dataflow.core.runtime.metadata_tsv import project_metadata_tsv
+
+
+def _project(tmp_path, lines, column):
+    source, destination = tmp_path / 'md.tsv', tmp_path / 'projected.tsv'
+    source.write_text(''.join(line + '\n' for line in lines),
+                      encoding='utf-8')
+    if not project_metadata_tsv(str(source), str(destination), column):
+        return None
+    return destination.read_text(encoding='utf-8').splitlines()
+
+
+@pytest.mark.parametrize('id_header', [
+    'id', 'sample-id', '#SampleID', '#Sample ID', '#OTUID', '#OTU ID'])
+def test_column_is_projected(tmp_path, id_header):
+    lines = [id_header + '\tbody-site\tyear\tsubject',
+             '#q2:types\tcategorical\tnumeric\tcategorical',
+             's1\tgut\t2008\tsubject-1',
+             's2\ttongue\t2009\tsubject-2']
+
+    assert _project(tmp_path, lines, 'year') == [
+        id_header + '\tyear', '#q2:types\tnumeric', 's1\t2008', 's2\t2009']
+
+
+def test_comments_and_empty_rows_are_skipped(tmp_path):
+    lines = ['# exported from the lab database',
+             '',
+             '#SampleID\tbody-site',
+             '# sampled in 2008',
+             '\t',
+             's1\tgut']
+
+    assert _project(tmp_path, lines, 'body-site') == [
+        '#SampleID\tbody-site', 's1\tgut']
+
+
+def test_hash_header_after_the_header_is_not_one(tmp_path):
+    lines = ['id\tbody-site', '#OTU ID\tnot a header', 's1\tgut']
+
+    assert _project(tmp_path, lines, 'body-site') == ['id\tbody-site',
+                                                      's1\tgut']
+
+
+def test_short_row_gets_an_empty_value(tmp_path):
+    lines = ['id\tbody-site\tyear', 's1\tgut']
+
+    assert _project(tmp_path, lines, 'year') == ['id\tyear', 's1\t']
+
+
+@pytest.mark.parametrize('lines, column', [
+    # missing, repeated or the ID column
+    (['id\tbody-site', 's1\tgut'], 'year'),
+    (['id\tyear\tyear', 's1\t1\t2'], 'year'),
+    (['id\tyear', 's1\t1'], 'id'),
+    # a row with values but no ID
+    (['id\tyear', '\t2008'], 'year'),
+    # no header
+    (['# only a comment'], 'year'),
+])
+def test_whole_file_is_loaded_instead(tmp_path, lines, column):
+    assert _project(tmp_path, lines, column) is None
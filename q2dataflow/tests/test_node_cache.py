@@ -0,0 +1,150 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import json
+import os
+import stat
+import multiprocessing
+
+import pytest
+
+from q2dataflow.core.runtime.node_cache import NodeCache, INDEX_FILENAME
+
+
+def _index(root):
+    with open(os.path.join(str(root), INDEX_FILENAME)) as fh:
+        return json.load(fh)
+
+
+def _filler(size, calls):
+    def fill():
+        calls.append(size)
+        return size
+    return fill
+
+
+def _in_another_process(function, *args):
+    # the entries a process acquires are held until it exits
+    process = multiprocessing.get_context('fork').Process(
+        target=function, args=args)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+
+def _fill_and_exit(root, keys):
+    cache = NodeCache(root)
+    for key in keys:
+        cache.acquire(key, lambda: 40)
+
+
+def test_entry_is_filled_once(tmp_path):
+    cache = NodeCache(str(tmp_path))
+    calls = []
+
+    assert not cache.acquire('a', _filler(10, calls))
+    assert cache.acquire('a', _filler(10, calls))
+    assert calls == [10]
+    assert _index(tmp_path)['a']['size'] == 10
+
+
+def test_entry_filled_elsewhere_is_a_hit(tmp_path):
+    _in_another_process(_fill_and_exit, str(tmp_path), ['a'])
+    calls = []
+
+    assert NodeCache(str(tmp_path)).acquire('a', _filler(10, calls))
+    assert calls == []
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    # 'b' was used last before 'a' was used again
+    _in_another_process(_fill_and_exit, str(tmp_path), ['a', 'b', 'a'])
+    removed = []
+    cache = NodeCache(str(tmp_path), max_bytes=100, remove=removed.extend)
+
+    cache.acquire('c', lambda: 40)
+
+    assert removed == ['b']
+    assert sorted(_index(tmp_path)) == ['a', 'c']
+
+
+def test_eviction_stops_under_the_limit(tmp_path):
+    _in_another_process(_fill_and_exit, str(tmp_path), ['a', 'b', 'c'])
+    removed = []
+    cache = NodeCache(str(tmp_path), max_bytes=70, remove=removed.extend)
+
+    cache.acquire('d', lambda: 30)
+
+    assert removed == ['a', 'b']
+    assert sorted(_index(tmp_path)) == ['c', 'd']
+
+
+def test_entries_in_use_are_not_evicted(tmp_path):
+    # another task, still running, uses 'a'
+    running = NodeCache(str(tmp_path))
+    running.acquire('a', lambda: 80)
+    removed = []
+    cache = NodeCache(str(tmp_path), max_bytes=100, remove=removed.extend)
+
+    cache.acquire('b', lambda: 80)
+
+    assert removed == []
+    assert sorted(_index(tmp_path)) == ['a', 'b']
+
+
+def test_no_limit_never_evicts(tmp_path):
+    _in_another_process(_fill_and_exit, str(tmp_path), ['a', 'b'])
+    removed = []
+    cache = NodeCache(str(tmp_path), remove=removed.extend)
+
+    cache.acquire('c', lambda: 10 ** 12)
+
+    assert removed == []
+    assert sorted(_index(tmp_path)) == ['a', 'b', 'c']
+
+
+def test_discarded_entry_is_filled_again(tmp_path):
+    cache = NodeCache(str(tmp_path))
+    calls = []
+    cache.acquire('a', _filler(10, calls))
+
+    cache.discard('a')
+
+    assert not cache.acquire('a', _filler(20, calls))
+    assert calls == [10, 20]
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(str(path)).st_mode)
+
+
+def test_cache_is_private(tmp_path):
+    root = tmp_path / 'cache'
+    NodeCache(str(root)).acquire('a', lambda: 10)
+
+    assert _mode(root) == 0o700
+    assert _mode(root / 'locks') == 0o700
+    assert _mode(root / 'locks' / 'a.use') == 0o600
+
+
+def test_cache_others_can_write_to_is_refused(tmp_path):
+    root = tmp_path / 'cache'
+    root.mkdir()
+    os.chmod(str(root), 0o777)
+
+    with pytest.raises(PermissionError):
+        NodeCache(str(root))
+
+
+@pytest.mark.skipif(os.getuid() != 0, reason="needs to give a file away")
+def test_cache_of_another_user_is_refused(tmp_path):
+    root = tmp_path / 'cache'
+    root.mkdir(mode=0o700)
+    os.chown(str(root), 12345, -1)
+
+    with pytest.raises(PermissionError):
+        NodeCache(str(root))
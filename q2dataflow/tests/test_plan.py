@@ -0,0 +1,113 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import pytest
+
+import q2dataflow.core.runtime.plan as conversion_plan
+from q2dataflow.__main__ import _apply_conversion_plan
+
+PLAN = conversion_plan.make_plan(
+    params={'table': ['input', None, 'FeatureTable[Frequency]'],
+            'tables': ['multiple_input', 'List', 'List[FeatureTable]'],
+            'metadata': ['metadata_tabular', None, 'Metadata'],
+            'column': ['column_tabular', None, 'MetadataColumn[Categorical]'],
+            'depths': ['simple_collection', 'Collection',
+                       'Collection[Int]'],
+            'input': ['simple', None, 'Str'],
+            'sampling_depth': ['simple', None, 'Int'],
+            'steps': ['simple_collection', 'List', 'List[Int]']},
+    outputs=['visualization'],
+    keys={'q2wdl_metafile_metadata': ['metadata', 'metafile'],
+          'q2wdl_metafile_column': ['column', 'metafile'],
+          'column': ['column', 'column'],
+          'q2wdl_collection_keys_depths': ['depths', 'collection_keys'],
+          'q2wdl_input': ['input', 'value']})
+
+
+def test_plan_round_trips_through_json():
+    assert conversion_plan.load_plan(conversion_plan.dump_plan(PLAN)) == PLAN
+
+
+@pytest.mark.parametrize('plan', [
+    None, '{"version": 0}', {'params': {}}, '[1]'])
+def test_plan_of_another_version_is_ignored(plan):
+    assert conversion_plan.load_plan(plan) is None
+
+
+def test_kinds_of_the_params():
+    kinds = conversion_plan.get_kinds(PLAN)
+
+    assert kinds['tables'] == ('multiple_input', 'List')
+    assert kinds['sampling_depth'] == ('simple', None)
+
+
+def test_arguments_of_the_wrong_shape_are_reported():
+    errors = conversion_plan.check_arguments(
+        {'table': ['a.qza'], 'tables': 'a.qza', 'column': 'md.tsv',
+         'depths': {'a': 1}, 'sampling_depth': None, 'unplanned': 1}, PLAN)
+
+    assert errors == [
+        "table: expected an artifact for FeatureTable[Frequency], "
+        "not list ['a.qza']",
+        "tables: expected a list for List[FeatureTable], not str 'a.qza'",
+        "column: expected a metadata file and column for "
+        "MetadataColumn[Categorical], not str 'md.tsv'"]
+
+
+def test_keys_are_mapped_to_arguments():
+    config = _apply_conversion_plan(
+        {'table': 'table.qza', 'q2wdl_input': 'reserved',
+         'q2wdl_metafile_metadata': ['md.tsv', 'cache:/data/cache:md'],
+         'q2wdl_metafile_column': 'md.tsv', 'column': 'body-site',
+         'q2wdl_collection_keys_depths': ['a', 'b'], 'depths': [1, 2],
+         'visualization': 'out.qzv'}, PLAN)
+
+    assert config == {
+        'table': 'table.qza', 'input': 'reserved',
+        'metadata': [
+            {'type': 'tsv', 'source': 'md.tsv', 'column': None},
+            {'type': 'qza', 'source': 'cache:/data/cache:md',
+             'column': None}],
+        'column': {'type': 'tsv', 'source': 'md.tsv', 'column': 'body-site'},
+        'depths': {'a': 1, 'b': 2},
+        'visualization': 'out.qzv'}
+
+
+def test_unset_arguments_stay_unset():
+    config = _apply_conversion_plan(
+        {'q2wdl_metafile_metadata': None, 'q2wdl_metafile_column': None,
+         'column': None, 'q2wdl_collection_keys_depths': None,
+         'depths': None}, PLAN)
+
+    assert config == {'metadata': None, 'column': None, 'depths': None}
+
+
+@pytest.mark.parametrize('keys, values', [(None, []), ([], None), ([], [])])
+def test_unset_and_empty_collection_is_empty(keys, values):
+    config = _apply_conversion_plan(
+        {'q2wdl_collection_keys_depths': keys, 'depths': values}, PLAN)
+
+    assert config == {'depths': {}}
+
+
+@pytest.mark.parametrize('keys, values', [
+    (['a', 'b'], [1]), (None, [1]), (['a'], None)])
+def test_collection_keys_and_values_must_pair_up(keys, values):
+    with pytest.raises(ValueError, match='same length'):
+        _apply_conversion_plan(
+            {'q2wdl_collection_keys_depths': keys, 'depths': values}, PLAN)
+
+
+def test_unknown_keys_are_an_error():
+    with pytest.raises(ValueError, match='Unrecognized inputs: q2wdl_x, z'):
+        _apply_conversion_plan({'table': 'table.qza', 'z': 1, 'q2wdl_x': 2},
+                               PLAN)
+
+
+def test_metadata_of_unknown_type_is_an_error():
+    with pytest.raises(ValueError, match="Unexpected metadata type: 'csv'"):
+        _apply_conversion_plan({'q2wdl_metafile_metadata': ['md.csv']}, PLAN)
@@ -0,0 +1,45 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import json
+import types
+
+import q2dataflow.core.runtime.resources as resources
+
+
+def _span(category, name):
+    return types.SimpleNamespace(category=category, name=name, args={},
+                                 error=None)
+
+
+def test_samples_are_taken_for_runs_and_stages_only(tmp_path, monkeypatch):
+    samples = []
+
+    def take_sample():
+        samples.append(len(samples))
+        return resources.Sample(float(len(samples)), 0.0, 0, 0)
+
+    monkeypatch.setattr(resources, 'take_sample', take_sample)
+    # a sampling thread that never wakes up
+    sampler = resources.ResourceSampler(str(tmp_path / 'resources.json'),
+                                        interval=3600)
+    run, stage = _span('run', 'summarize'), _span('stage', 'load')
+
+    sampler.begin(run)
+    sampler.begin(stage)
+    for _ in range(100):
+        sampler.begin(_span('load', 'table.qza'))
+        sampler.end(_span('load', 'table.qza'))
+        sampler.end(_span('metadata', 'md.tsv'))
+    sampler.end(stage)
+    sampler.end(run)
+    sampler.write()
+
+    # at the start and end of the run and the stage
+    assert len(samples) == 4
+    with open(str(tmp_path / 'resources.json')) as fh:
+        assert list(json.load(fh)['runs'][0]['stages']) == ['load']
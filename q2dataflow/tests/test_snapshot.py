@@ -0,0 +1,29 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import json
+
+import pytest
+
+from q2dataflow.core.signature_converter.snapshot import (
+    _encode_value, _decode_value)
+
+
+@pytest.mark.parametrize('value', [
+    None, True, 3, 0.5, 'braycurtis', [1, 2], {'a': 1, 'b': [True]},
+    {'euclidean', 'jaccard'}, {'nested': {1, 2}}])
+def test_default_survives_json(value):
+    encoded = json.loads(json.dumps(_encode_value(value)))
+
+    assert _decode_value(encoded) == value
+
+
+@pytest.mark.parametrize('value', [
+    object(), b'bytes', [1, object()], {'a': {object()}}])
+def test_default_json_cannot_hold_is_an_error(value):
+    with pytest.raises(ValueError, match='not a value a snapshot can hold'):
+        _encode_value(value)
@@ -0,0 +1,96 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import os
+
+import pytest
+
+from q2dataflow.core.runtime.staging import (
+    read_staging_manifest, stage_files, copy_tree)
+
+
+def _manifest(tmp_path, *lines):
+    fp = tmp_path / 'manifest.tsv'
+    fp.write_text(''.join(line + '\n' for line in lines))
+    return str(fp)
+
+
+def test_manifest_paths_are_relative_to_it(tmp_path):
+    fp = _manifest(tmp_path, 'reads/s1_R1.fastq.gz\ts1_1_L001_R1_001.fastq.gz',
+                   '/data/s2_R1.fastq.gz\ts2_2_L001_R1_001.fastq.gz')
+
+    assert read_staging_manifest(fp) == [
+        (str(tmp_path / 'reads' / 's1_R1.fastq.gz'),
+         's1_1_L001_R1_001.fastq.gz'),
+        ('/data/s2_R1.fastq.gz', 's2_2_L001_R1_001.fastq.gz')]
+
+
+def test_manifest_names_default_to_the_file_name(tmp_path):
+    fp = _manifest(tmp_path, '# staged as they are', '', 'reads/s1.fastq.gz',
+                   'reads/s2.fastq.gz\tsub/s2.fastq.gz')
+
+    assert read_staging_manifest(fp) == [
+        (str(tmp_path / 'reads' / 's1.fastq.gz'), 's1.fastq.gz'),
+        (str(tmp_path / 'reads' / 's2.fastq.gz'), 'sub/s2.fastq.gz')]
+
+
+@pytest.mark.parametrize('name', [
+    '../s1.fastq.gz', 'sub/../../s1.fastq.gz', '..', '/tmp/s1.fastq.gz'])
+def test_manifest_names_stay_inside_the_import(tmp_path, name):
+    fp = _manifest(tmp_path, 'reads/s1.fastq.gz\t' + name)
+
+    with pytest.raises(ValueError, match='Line 1 .* outside the import'):
+        read_staging_manifest(fp)
+
+
+def test_manifest_lines_have_at_most_two_fields(tmp_path):
+    fp = _manifest(tmp_path, 'a.fastq.gz', 'b.fastq.gz\tb\textra')
+
+    with pytest.raises(ValueError, match='Line 2 .* more than two fields'):
+        read_staging_manifest(fp)
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_files_are_staged_under_their_names(tmp_path, threads):
+    src = tmp_path / 'src'
+    (src / 'dir').mkdir(parents=True)
+    (src / 'a.txt').write_text('a')
+    (src / 'dir' / 'b.txt').write_text('b')
+    dst = tmp_path / 'dst'
+
+    methods = stage_files([(str(src / 'a.txt'), 'renamed.txt'),
+                           (str(src / 'dir'), 'sub')], str(dst),
+                          threads=threads)
+
+    assert sum(methods.values()) == 2
+    assert (dst / 'renamed.txt').read_text() == 'a'
+    assert (dst / 'sub' / 'b.txt').read_text() == 'b'
+
+
+def test_existing_files_are_an_error_unless_replaced(tmp_path):
+    (tmp_path / 'a.txt').write_text('new')
+    dst = tmp_path / 'dst'
+    dst.mkdir()
+    (dst / 'a.txt').write_text('old')
+    files = [(str(tmp_path / 'a.txt'), 'a.txt')]
+
+    with pytest.raises(FileExistsError):
+        stage_files(files, str(dst), threads=1)
+    stage_files(files, str(dst), threads=1, replace=True)
+
+    assert (dst / 'a.txt').read_text() == 'new'
+
+
+def test_copied_tree_is_not_a_symlink(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'a.txt').write_text('a')
+
+    copy_tree(str(src), str(tmp_path / 'dst'), threads=1)
+
+    assert not os.path.islink(str(tmp_path / 'dst' / 'a.txt'))
+    assert (tmp_path / 'dst' / 'a.txt').read_text() == 'a'
@@ -0,0 +1,125 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+import pytest
+
+from q2dataflow.core.runtime.tabular import (
+    read_ids, _iter_chunks, write_biom_tsv, write_dataframe_tsv)
+
+# observations (rows) by samples (columns)
+TABLE = [[0, 1, 2],
+         [3, 0, 0],
+         [0, 0, 0],
+         [4, 5, 6]]
+ROW_IDS = ['f1', 'f2', 'f3', 'f4']
+COLUMN_IDS = ['s1', 's2', 's3']
+
+
+def _write_biom(fp, table=TABLE):
+    """A BIOM 2.1 file holding just what is read of one"""
+    h5py = pytest.importorskip('h5py')
+    import numpy as np
+
+    data, indices, indptr = [], [], [0]
+    for row in table:
+        for j, value in enumerate(row):
+            if value:
+                data.append(value)
+                indices.append(j)
+        indptr.append(len(data))
+    with h5py.File(fp, 'w') as f:
+        f['observation/ids'] = np.array(ROW_IDS, dtype='S')
+        f['sample/ids'] = np.array(COLUMN_IDS, dtype='S')
+        f['observation/matrix/data'] = np.array(data, dtype=float)
+        f['observation/matrix/indices'] = np.array(indices, dtype=np.int32)
+        f['observation/matrix/indptr'] = np.array(indptr, dtype=np.int32)
+    return str(fp)
+
+
+def _read_tsv(fp):
+    with open(str(fp)) as fh:
+        return [line.rstrip('\n').split('\t') for line in fh]
+
+
+def test_ids_from_a_file(tmp_path):
+    fp = tmp_path / 'ids.txt'
+    fp.write_text('# wanted\ns1\n\n  s2  \n')
+
+    assert read_ids(str(fp)) == ['s1', 's2']
+    assert read_ids(['s1']) == ['s1']
+    assert read_ids(None) is None
+
+
+def test_chunks_fit_the_rows_and_cells():
+    # stored values per row: 2, 1, 0, 3
+    indptr = [0, 2, 3, 3, 6]
+
+    assert list(_iter_chunks([0, 1, 2, 3], indptr, 2, 100)) == \
+        [[0, 1], [2, 3]]
+    assert list(_iter_chunks([0, 1, 2, 3], indptr, 10, 3)) == \
+        [[0, 1, 2], [3]]
+    # the values of rows left out in between count too
+    assert list(_iter_chunks([0, 3], indptr, 10, 4)) == [[0], [3]]
+
+
+@pytest.mark.parametrize('chunk_cells', [1, 4, 1000])
+def test_biom_table_is_written_as_biom_would(tmp_path, chunk_cells):
+    biom_fp = _write_biom(tmp_path / 'table.biom')
+    output_fp = tmp_path / 'table.tsv'
+
+    assert write_biom_tsv(biom_fp, str(output_fp),
+                          chunk_cells=chunk_cells) == (4, 3)
+    assert _read_tsv(output_fp) == [
+        ['# Constructed from biom file'],
+        ['#OTU ID', 's1', 's2', 's3'],
+        ['f1', '0.0', '1.0', '2.0'],
+        ['f2', '3.0', '0.0', '0.0'],
+        ['f3', '0.0', '0.0', '0.0'],
+        ['f4', '4.0', '5.0', '6.0']]
+
+
+def test_biom_subset_keeps_the_table_order(tmp_path):
+    biom_fp = _write_biom(tmp_path / 'table.biom')
+    output_fp = tmp_path / 'table.tsv'
+
+    assert write_biom_tsv(biom_fp, str(output_fp), rows=['f4', 'f1'],
+                          columns=['s3', 's2'], chunk_cells=2) == (2, 2)
+    assert _read_tsv(output_fp)[1:] == [
+        ['#OTU ID', 's2', 's3'], ['f1', '1.0', '2.0'], ['f4', '5.0', '6.0']]
+
+
+def test_fractional_values_are_written_in_full(tmp_path):
+    biom_fp = _write_biom(tmp_path / 'table.biom',
+                          [[0.5, 0, 0], [0, 0.25, 0], [0, 0, 0], [1, 0, 0]])
+    output_fp = tmp_path / 'table.tsv'
+
+    write_biom_tsv(biom_fp, str(output_fp), rows=['f1', 'f2'])
+
+    assert _read_tsv(output_fp)[2:] == [['f1', '0.5', '0.0', '0.0'],
+                                        ['f2', '0.0', '0.25', '0.0']]
+
+
+def test_missing_ids_are_an_error(tmp_path):
+    biom_fp = _write_biom(tmp_path / 'table.biom')
+
+    with pytest.raises(ValueError, match='2 sample ID.* s0, s9'):
+        write_biom_tsv(biom_fp, str(tmp_path / 'table.tsv'),
+                       columns=['s1', 's9', 's0'])
+    assert not (tmp_path / 'table.tsv').exists()
+
+
+@pytest.mark.parametrize('chunk_cells', [1, 1000])
+def test_dataframe_is_written_in_chunks(tmp_path, chunk_cells):
+    pd = pytest.importorskip('pandas')
+    df = pd.DataFrame(TABLE, index=ROW_IDS, columns=COLUMN_IDS)
+    output_fp = tmp_path / 'table.tsv'
+
+    assert write_dataframe_tsv(df, str(output_fp), rows=['f2', 'f4'],
+                               columns=['s1', 's3'],
+                               chunk_cells=chunk_cells) == (2, 2)
+    assert _read_tsv(output_fp) == [['id', 's1', 's3'], ['f2', '3', '0'],
+                                    ['f4', '4', '6']]